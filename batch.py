@@ -0,0 +1,144 @@
+"""
+Пакетная сборка нескольких проектов за один запуск.
+
+    python batch.py                         # все проекты в out/
+    python batch.py event_* city_map        # имена или glob-маски папок в out/
+    python batch.py --max-memory 16000 --no-cache
+
+Все проекты идут через один пул процессов: воркеры не перезапускаются
+между проектами и держат свои кэши шрифтов. Проекты запускаются от самого
+тяжёлого к лёгкому, ошибка одного не останавливает остальные, в конце —
+сводка по каждому проекту.
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from config import Config
+from main import load_project_image, plan_project, run_project
+from scheduler import worker_count
+
+PROJECTS_DIR = "out"
+
+# карты на 1200 DPI больше порога Pillow; Config снимает его только при создании
+Image.MAX_IMAGE_PIXELS = None
+
+
+def find_projects(patterns):
+    """Имена проектов в out/ (папки с config.json), подходящие под маски."""
+    names = set()
+    for pattern in patterns or ["*"]:
+        for path in glob.glob(os.path.join(PROJECTS_DIR, pattern)):
+            if os.path.isfile(os.path.join(path, "config.json")):
+                names.add(os.path.basename(path))
+    return sorted(names)
+
+
+def estimate_cost(name):
+    """
+    Оценка тяжести проекта без загрузки растра: пиксели исходника по
+    заголовку файла. Возвращает (стоимость, ошибка или None).
+    """
+    with open(os.path.join(PROJECTS_DIR, name, "config.json"), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    input_file = data.get("input_file")
+    if not input_file or not os.path.exists(input_file):
+        return 0, f"исходный файл '{input_file}' не найден"
+    with Image.open(input_file) as img:
+        w, h = img.size
+    return w * h, None
+
+
+def build_project(name, pool, args):
+    """Собирает один проект в общем пуле; возвращает (число файлов, папка вывода)."""
+    cfg = Config().load(name)
+    cfg.init_random()
+    output_dir = cfg.make_output_dir()
+
+    img, tile_size, px_per_mm, export_dpi = load_project_image(cfg)
+    img_tiles, units, budget_mb, pages = plan_project(
+        cfg, img, tile_size, px_per_mm, export_dpi, output_dir,
+        reshuffle=args.reshuffle, threads=args.threads,
+        max_memory=args.max_memory, use_cache=not args.no_cache)
+    workers = worker_count(units, args.threads, budget_mb)
+    try:
+        outputs, failed = run_project(cfg, units, pages, output_dir, workers, budget_mb, pool)
+    finally:
+        img_tiles.close()
+    if failed:
+        raise RuntimeError(f"не собрано задач: {len(failed)}, дособрать: "
+                           f"main.py --project {name} --resume {output_dir}")
+    return len(outputs), output_dir
+
+
+def print_summary(summary):
+    print("\n📋 Сводка пакета:")
+    print(f"  {'проект':<28}{'статус':<8}{'время, с':>10}{'файлов':>8}  вывод / ошибка")
+    for row in summary:
+        status = "✅" if row["ok"] else "❌"
+        print(f"  {row['project']:<28}{status:<8}{row['wall_s']:>10.1f}{row['files']:>8}  {row['detail']}")
+    failed = sum(1 for row in summary if not row["ok"])
+    print(f"\n{'✅' if not failed else '⚠️'} Проектов: {len(summary)}, с ошибками: {failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="📦 Пакетная сборка проектов")
+    parser.add_argument("projects", nargs="*", help="Имена или glob-маски проектов в out/ (по умолчанию — все)")
+    parser.add_argument("--reshuffle", action="store_true", help="Пересоздать random_state у всех")
+    parser.add_argument("--threads", type=int, default=None, help="Сколько процессов в общем пуле")
+    parser.add_argument("--max-memory", type=int, default=None, help="Бюджет памяти в МБ на проект")
+    parser.add_argument("--no-cache", action="store_true", help="Не брать готовые листы из кэша рендера")
+    args = parser.parse_args()
+
+    names = find_projects(args.projects)
+    if not names:
+        print(f"❌ В {PROJECTS_DIR}/ нет проектов под {' '.join(args.projects) or '*'}")
+        return 1
+
+    summary, jobs = [], []
+    for name in names:
+        try:
+            cost, error = estimate_cost(name)
+        except Exception as e:  # битый конфиг или исходник не должен ронять весь пакет
+            cost, error = 0, f"{type(e).__name__}: {e}"
+        if error:
+            summary.append({"project": name, "ok": False, "wall_s": 0.0, "files": 0, "detail": error})
+        else:
+            jobs.append((cost, name))
+    jobs.sort(reverse=True)
+
+    print(f"📦 Проектов к сборке: {len(jobs)} (по убыванию размера: {', '.join(n for _, n in jobs)})")
+    pool_size = args.threads or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=pool_size)
+    try:
+        for _, name in jobs:
+            print(f"\n━━━━━━━━ 🧩 {name} ━━━━━━━━")
+            t0 = time.perf_counter()
+            try:
+                files, output_dir = build_project(name, pool, args)
+                summary.append({"project": name, "ok": True, "wall_s": time.perf_counter() - t0,
+                                "files": files, "detail": output_dir})
+            except Exception as e:
+                traceback.print_exc()
+                summary.append({"project": name, "ok": False, "wall_s": time.perf_counter() - t0,
+                                "files": 0, "detail": f"{type(e).__name__}: {e}"})
+                if isinstance(e, BrokenProcessPool):
+                    # воркер убит (OOM) — следующим проектам нужен новый пул
+                    pool.shutdown(wait=True)
+                    pool = ProcessPoolExecutor(max_workers=pool_size)
+    finally:
+        pool.shutdown(wait=True)
+
+    print_summary(summary)
+    return 0 if all(row["ok"] for row in summary) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
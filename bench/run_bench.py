@@ -0,0 +1,228 @@
+"""
+Бенчмарк конвейера листов на синтетических картах.
+
+    python bench/run_bench.py                                 # быстрые пресеты
+    python bench/run_bench.py --presets 20x28@1200 --out bench_output.json
+    python bench/run_bench.py --compare bench_output.json     # сравнение с прошлым прогоном
+
+Каждый пресет гоняется в отдельном процессе, чтобы пиковый RSS одного
+не влиял на другой. Этапы: загрузка, поиск белых, нарезка, random_state,
+сетка, shuffled/answers-листы. Для каждого — wall, CPU и пиковый RSS
+процесса на момент окончания этапа. Результат — JSON.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.synthetic import PRESETS, make_synthetic_map  # noqa: E402
+
+DEFAULT_PRESETS = ["9x13@300", "20x28@300"]
+# насколько можно стать медленнее/тяжелее, прежде чем считать это регрессией
+REGRESSION_TOLERANCE = 1.10
+
+
+# ──────────────────────────────
+# 🔬 Прогон одного пресета (в дочернем процессе)
+# ──────────────────────────────
+def _measure(results, name, fn, **extra):
+    from profiler import peak_rss_mb
+
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    value = fn()
+    results[name] = dict(extra,
+                         wall_s=round(time.perf_counter() - wall0, 4),
+                         cpu_s=round(time.process_time() - cpu0, 4),
+                         peak_rss_mb=round(peak_rss_mb() or 0.0, 1))
+    return value
+
+
+def run_preset(preset, pages, keep=False):
+    from config import Config
+    from image_loader import load_image
+    from tile_store import TileStore
+    from tiles import split_tiles, generate_random_state
+    from white_tiles import detect_white_tiles
+    from grid import make_grid
+    from sheets import render_page_outputs
+
+    cols, rows, dpi = PRESETS[preset]
+    workdir = tempfile.mkdtemp(prefix="quest_bench_")
+    os.chdir(workdir)
+
+    cfg = Config()
+    cfg.project_name = "bench"
+    cfg.cols, cfg.rows = cols, rows
+    cfg.font_path = os.path.join(ROOT, cfg.font_path)
+    cfg.ensure_project_dir()
+    cfg.input_file = os.path.join(cfg.project_dir, "map.tif")
+    whites, tile_px = make_synthetic_map(cfg.input_file, cols, rows, dpi)
+    output_dir = cfg.make_output_dir()
+
+    results = {}
+    img, tile_size, _, _ = load_image(cfg.input_file, cols, rows)
+    megapixels = img.width * img.height / 1e6
+    store = _measure(results, "load", lambda: TileStore.from_image(img, tile_size, cfg, whites),
+                     megapixels=round(megapixels, 1))
+    try:
+        found = _measure(results, "white_detection", lambda: detect_white_tiles(img, cfg))
+        results["white_detection"]["correct"] = sorted(found) == sorted(whites)
+
+        tiles = _measure(results, "tile_split", lambda: split_tiles(store, cfg, whites),
+                         tiles=cols * rows - len(whites))
+        state = _measure(results, "state", lambda: generate_random_state(cfg, tiles))
+
+        # px_per_mm/dpi листов — как в main.py
+        export_dpi = (img.width / (cfg.sheet_w_mm / 25.4) + img.height / (cfg.sheet_h_mm / 25.4)) / 2
+        px_per_mm = export_dpi / 25.4
+        _measure(results, "grid", lambda: make_grid(cfg, img, tile_size, px_per_mm, export_dpi,
+                                                    os.path.join(output_dir, "grid.png")))
+
+        selected = state["pages"] if pages is None else state["pages"][:pages]
+        rendered_tiles = sum(1 for p in selected for row in p["matrix"] for c in row if c)
+        _measure(results, "sheets",
+                 lambda: [render_page_outputs(cfg, p, store, px_per_mm, export_dpi, output_dir)
+                          for p in selected],
+                 pages=len(selected), tiles=rendered_tiles)
+
+        # пропускная способность
+        def per_s(amount, stage):
+            return round(amount / max(results[stage]["wall_s"], 1e-9), 2)
+        results["load"]["megapixels_per_s"] = per_s(megapixels, "load")
+        results["white_detection"]["megapixels_per_s"] = per_s(megapixels, "white_detection")
+        results["sheets"]["tiles_per_s"] = per_s(rendered_tiles, "sheets")
+    finally:
+        store.close()
+        os.chdir(ROOT)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {"preset": preset, "cols": cols, "rows": rows, "dpi": dpi,
+            "tile_px": tile_px, "megapixels": round(megapixels, 1), "stages": results}
+
+
+# ──────────────────────────────
+# 📊 Сводка и сравнение
+# ──────────────────────────────
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(report):
+    print(f"\n📊 Бенчмарк ({report['meta']['commit'] or 'без git'}):")
+    print(f"  {'пресет':<12}{'этап':<18}{'wall, с':>10}{'CPU, с':>10}{'пик RSS, МБ':>13}")
+    for preset, res in report["results"].items():
+        if "error" in res:
+            print(f"  {preset:<12}❌ {res['error']}")
+            continue
+        for stage, s in res["stages"].items():
+            print(f"  {preset:<12}{stage:<18}{s['wall_s']:>10.2f}{s['cpu_s']:>10.2f}{s['peak_rss_mb']:>13.1f}")
+
+
+def compare(report, baseline):
+    """Печатает отношения к прошлому прогону; возвращает список регрессий."""
+    regressions = []
+    print(f"\n🔁 Сравнение с {baseline['meta'].get('commit')}:")
+    for preset, res in report["results"].items():
+        old = baseline["results"].get(preset)
+        if not old or "stages" not in old or "stages" not in res:
+            continue
+        for stage, s in res["stages"].items():
+            o = old["stages"].get(stage)
+            if not o:
+                continue
+            for metric in ("wall_s", "peak_rss_mb"):
+                ratio = s[metric] / o[metric] if o[metric] else 1.0
+                flag = ""
+                if ratio > REGRESSION_TOLERANCE and s[metric] - o[metric] > 0.05:
+                    flag = "  ⚠️ регрессия"
+                    regressions.append((preset, stage, metric, ratio))
+                print(f"  {preset:<12}{stage:<18}{metric:<13}{o[metric]:>10.2f} → {s[metric]:>10.2f}"
+                      f"  ×{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="📊 Бенчмарк конвейера листов")
+    parser.add_argument("--presets", type=str, default=",".join(DEFAULT_PRESETS),
+                        help=f"Пресеты через запятую: {', '.join(PRESETS)}")
+    parser.add_argument("--pages", type=int, default=1, help="Сколько страниц рендерить (0 — все)")
+    parser.add_argument("--out", type=str, help="Куда сохранить JSON с результатами")
+    parser.add_argument("--compare", type=str, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--keep", action="store_true", help="Не удалять временные проекты")
+    parser.add_argument("--verbose", action="store_true", help="Показывать вывод конвейера")
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--result", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    pages = args.pages or None
+    if args.worker:
+        result = run_preset(args.worker, pages, args.keep)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        return 0
+
+    import PIL
+    import numpy
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": numpy.__version__,
+            "cpu_count": os.cpu_count(),
+            "pages": args.pages,
+        },
+        "results": {},
+    }
+
+    for preset in args.presets.split(","):
+        preset = preset.strip()
+        if preset not in PRESETS:
+            print(f"❌ Неизвестный пресет: {preset}")
+            return 2
+        print(f"⏳ {preset} ...")
+        fd, result_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", preset,
+               "--result", result_path, "--pages", str(args.pages)]
+        if args.keep:
+            cmd.append("--keep")
+        out = None if args.verbose else subprocess.DEVNULL
+        proc = subprocess.run(cmd, stdout=out, stderr=out)
+        if proc.returncode == 0:
+            with open(result_path, "r", encoding="utf-8") as f:
+                report["results"][preset] = json.load(f)
+        else:
+            report["results"][preset] = {"error": f"код выхода {proc.returncode}"}
+        os.remove(result_path)
+
+    print_table(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        print(f"💾 Результаты сохранены → {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
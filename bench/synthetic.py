@@ -0,0 +1,108 @@
+"""
+Синтетические карты для бенчмарков.
+
+Растр пишется прямо в несжатый TIFF полосами по строке тайлов, поэтому даже
+20×28 при 1200 DPI (~1.1 Гпикс) генерируется без держания всей карты в памяти.
+Белые тайлы известны заранее — по ним проверяется detect_white_tiles.
+"""
+import struct
+
+import numpy as np
+
+LETTERS = list("АБВГДЕЖИКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ")
+
+# имя → (cols, rows, dpi); тайл всегда tile_mm миллиметров
+PRESETS = {
+    "9x13@300": (9, 13, 300),
+    "9x13@600": (9, 13, 600),
+    "20x28@300": (20, 28, 300),
+    "20x28@600": (20, 28, 600),
+    "20x28@1200": (20, 28, 1200),
+}
+
+
+def white_coords(cols, rows, seed=0, fraction=0.15):
+    """Детерминированный набор «белых» тайлов: рамка сверху + случайные клетки."""
+    rng = np.random.default_rng(seed)
+    whites = {(0, c) for c in range(cols)}
+    for r in range(1, rows):
+        for c in range(cols):
+            if rng.random() < fraction:
+                whites.add((r, c))
+    return sorted(whites)
+
+
+def _tiff_header(width, height, rows_per_strip, strip_count, dpi):
+    """Заголовок + IFD несжатого RGB TIFF; данные полос идут сразу следом."""
+    entries = 13
+    ifd_size = 2 + entries * 12 + 4
+    extra = 8 + 8 + 6 + 8 * strip_count       # 2×RATIONAL, BitsPerSample, смещения+размеры
+    data_offset = 8 + ifd_size + extra
+    strip_bytes = width * 3 * rows_per_strip
+
+    xres_off = 8 + ifd_size
+    yres_off = xres_off + 8
+    bits_off = yres_off + 8
+    offsets_off = bits_off + 6
+    counts_off = offsets_off + 4 * strip_count
+
+    def entry(tag, typ, count, value):
+        return struct.pack("<HHII", tag, typ, count, value)
+
+    ifd = struct.pack("<H", entries)
+    ifd += entry(256, 4, 1, width)
+    ifd += entry(257, 4, 1, height)
+    ifd += entry(258, 3, 3, bits_off)
+    ifd += entry(259, 3, 1, 1)
+    ifd += entry(262, 3, 1, 2)
+    ifd += entry(273, 4, strip_count, offsets_off)
+    ifd += entry(277, 3, 1, 3)
+    ifd += entry(278, 4, 1, rows_per_strip)
+    ifd += entry(279, 4, strip_count, counts_off)
+    ifd += entry(282, 5, 1, xres_off)
+    ifd += entry(283, 5, 1, yres_off)
+    ifd += entry(284, 3, 1, 1)
+    ifd += entry(296, 3, 1, 2)
+    ifd += struct.pack("<I", 0)
+
+    offsets, counts = [], []
+    for i in range(strip_count):
+        rows = min(rows_per_strip, height - i * rows_per_strip)
+        offsets.append(data_offset + i * strip_bytes)
+        counts.append(width * 3 * rows)
+
+    out = b"II*\x00" + struct.pack("<I", 8) + ifd
+    out += struct.pack("<II", int(dpi), 1) * 2
+    out += struct.pack("<HHH", 8, 8, 8)
+    out += struct.pack(f"<{strip_count}I", *offsets)
+    out += struct.pack(f"<{strip_count}I", *counts)
+    return out
+
+
+def make_synthetic_map(path, cols, rows, dpi, tile_mm=30.0, seed=0):
+    """
+    Пишет карту cols×rows тайлов по tile_mm мм при dpi в несжатый TIFF.
+    Возвращает (список белых координат, размер тайла в пикселях).
+    """
+    tile_px = int(round(tile_mm / 25.4 * dpi))
+    width, height = cols * tile_px, rows * tile_px
+    whites = set(white_coords(cols, rows, seed))
+    rng = np.random.default_rng(seed + 1)
+
+    with open(path, "wb") as f:
+        f.write(_tiff_header(width, height, tile_px, rows, dpi))
+        # uint8 складывается по модулю 256 — полосы без промежуточных int64-массивов
+        x8 = (np.arange(width) % 256).astype(np.uint8)[None, :]
+        y8 = (np.arange(tile_px) % 256).astype(np.uint8)[:, None]
+        for r in range(rows):
+            # «рельеф»: диагональные полосы + шум, яркость заведомо ниже порога белого
+            base = (x8 + y8 + np.uint8(r * 37 % 256)) // 2 + 40
+            band = np.stack([base, np.roll(base, 17, axis=1), np.roll(base, 91, axis=0)], axis=-1)
+            band = band + rng.integers(0, 24, size=band.shape, dtype=np.uint8)
+            for c in range(cols):
+                if (r, c) in whites:
+                    band[:, c * tile_px:(c + 1) * tile_px] = 255
+            f.write(band.tobytes())
+
+    coords = [f"{LETTERS[r]}{c + 1}" for r, c in sorted(whites)]
+    return coords, tile_px
@@ -8,6 +8,33 @@ from PIL import Image
 
 
 class Config:
+    # поля, от которых зависит картинка листов и сетки (ключ кэша рендера)
+    RENDER_KEYS = (
+        "project_name", "cols", "rows", "letters", "grid_line_width", "font_scale",
+        "sheet_w_mm", "sheet_h_mm", "shuffled_tile_mm", "gap_mm", "margin_mm",
+        "answer_scale", "answer_font_scale", "answer_font_min", "answer_outline",
+        "answer_outline_width", "answer_outline_fill", "answer_text_fill",
+        "answer_align_x", "answer_align_y", "answer_margin_px",
+        "circle_diametr_mm", "circle_font_mm", "answers_circle_scale", "circle_fill",
+        "circle_outline", "circle_outline_width", "circle_text_fill",
+        "label_font_mm", "grid_label_font_mm", "label_area_mm",
+        "output_format", "png_compress_level", "tiff_compression", "jpeg_quality", "output_modes",
+        "resample_filters",
+    )
+    # из них — только то, что рисует сетка
+    GRID_KEYS = (
+        "project_name", "cols", "rows", "letters", "grid_line_width", "font_scale",
+        "grid_label_font_mm", "label_area_mm",
+        "output_format", "png_compress_level", "tiff_compression", "jpeg_quality", "output_modes",
+    )
+
+    # поля, от которых зависит раскладка тайлов по страницам (ключ random_state)
+    LAYOUT_KEYS = (
+        "random_seed", "cols", "rows", "letters", "rotate_tiles",
+        "sheet_w_mm", "sheet_h_mm", "sheet_formats", "sheet_export_dpi", "shuffled_tile_mm", "gap_mm",
+        "margin_mm",
+    )
+
     def __init__(self):
         # --- проект ---
         self.project_name = "Новый проект"
@@ -28,12 +55,19 @@ class Config:
         # --- листы ---
         self.sheet_w_mm = 210
         self.sheet_h_mm = 297
+        self.sheet_formats = None        # ["A4", "A3"] или [[w, h], ...] — sheet_planner выберет формат страниц
         self.sheet_export_dpi = 1200
         self.shuffled_tile_mm = 20
         self.gap_mm = 2.5
         self.margin_mm = 3
         self.rotate_tiles = None
 
+        # --- белые тайлы ---
+        self.white_stat = "min"          # min | percentile | mean_std
+        self.white_threshold = 250
+        self.white_percentile = 1.0      # для percentile: доля самых тёмных пикселей, %
+        self.white_std_max = 4.0         # для mean_std: допустимый разброс яркости
+
         # --- ответы ---
         self.answer_scale = 0.25
         self.answer_font_scale = 0.9
@@ -60,11 +94,31 @@ class Config:
         self.grid_label_font_mm = 8.0
         self.label_area_mm = self.grid_label_font_mm
 
+        # --- вывод ---
+        self.output_format = "png"           # png | tiff | jpeg
+        self.png_compress_level = 1          # 0–9: 1 — быстро, 9 — компактно
+        self.tiff_compression = "tiff_lzw"   # tiff_lzw | tiff_adobe_deflate | None
+        self.jpeg_quality = 90               # для пробных оттисков
+        self.output_modes = {                # auto | RGB | RGBA | L | P | 1
+            "shuffled": "auto",
+            "answers": "auto",
+            "grid": "auto",
+        }
+        self.resample_filters = {            # nearest | box | bilinear | hamming | bicubic | lanczos
+            "shuffled": "bicubic",
+            "shuffled_rot": "bicubic",
+            "answers": "bicubic",
+        }
+        self.tile_cache_mb = 2048            # кэш уменьшенных тайлов в .cache/tiles (старые вытесняются)
+        self.sheet_cache_mb = 8192           # кэш готовых листов в .cache/sheets (старые вытесняются)
+        self.writer_threads = 3
+
         # --- служебные пути ---
         self.project_dir = None
         self.random_state_file = None
         self.white_tiles_file = None
         self.config_file = None
+        self.loaded_file_digest = None
 
         Image.MAX_IMAGE_PIXELS = None
 
@@ -74,7 +128,7 @@ class Config:
         base = os.path.join("out", self.project_name)
         os.makedirs(base, exist_ok=True)
         self.project_dir = base
-        self.random_state_file = os.path.join(base, "random_state.json")
+        self.random_state_file = os.path.join(base, "random_state.bin")
         self.white_tiles_file = os.path.join(base, "white_tiles.txt")
         self.config_file = os.path.join(base, "config.json")
         return base
@@ -125,8 +179,11 @@ class Config:
         self.ensure_project_dir()
 
         if os.path.exists(self.config_file):
-            with open(self.config_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with open(self.config_file, "rb") as f:
+                raw = f.read()
+            # байты файла до любого save() — по ним узнаётся random_state старого формата
+            self.loaded_file_digest = hashlib.sha256(raw).hexdigest()
+            data = json.loads(raw.decode("utf-8"))
             for k, v in data.items():
                 if hasattr(self, k):
                     setattr(self, k, v)
@@ -151,7 +208,7 @@ class Config:
 
     def as_dict(self):
         """Возвращает словарь параметров без служебных путей."""
-        exclude = {"project_dir", "random_state_file", "white_tiles_file", "config_file"}
+        exclude = {"project_dir", "random_state_file", "white_tiles_file", "config_file", "loaded_file_digest"}
         return {k: v for k, v in self.__dict__.items() if k not in exclude}
 
     def init_random(self):
@@ -165,12 +222,47 @@ class Config:
             print(f"🎲 Сгенерирован новый сид: {self.random_seed}")
             self.save()
 
+    def _fields_hash(self, keys):
+        """sha256 от канонического JSON выбранных полей — в памяти, без записи на диск."""
+        data = {k: getattr(self, k) for k in keys}
+        blob = json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(blob).hexdigest()
+
+    def layout_hash(self):
+        """Хэш полей раскладки (LAYOUT_KEYS): меняется — random_state устарел."""
+        # без sheet_formats хэш прежний — старые random_state остаются годными
+        return self._fields_hash([k for k in self.LAYOUT_KEYS if k != "sheet_formats" or self.sheet_formats])
+
+    def style_hash(self):
+        """Хэш оформления: поля рендера, не влияющие на раскладку (цвета, шрифты, вывод)."""
+        return self._fields_hash([k for k in self.RENDER_KEYS if k not in self.LAYOUT_KEYS])
+
     def compute_hash(self):
-        """Вычисляет sha256 от config.json."""
-        self.save()
-        with open(self.config_file, "rb") as f:
-            data = f.read()
-        return hashlib.sha256(data).hexdigest()
+        """Ключ random_state — хэш раскладки (см. layout_hash)."""
+        return self.layout_hash()
+
+    def legacy_hash(self):
+        """
+        Старый ключ random_state: sha256 от config.json, каким он лежал на диске
+        при load(). Старый код хэшировал сам файл, поэтому пересобрать ключ из
+        полей нельзя — у конфига с тех пор появились новые. None — конфиг не
+        загружался из файла.
+        """
+        return self.loaded_file_digest
+
+    def render_fingerprint(self, kind=None):
+        """
+        sha256 от полей, влияющих на лист вида kind, — без записи на диск и без
+        зависимости от порядка. answer_* учитываются только для answers-листа,
+        для сетки — только GRID_KEYS.
+        """
+        if kind == "grid":
+            keys = self.GRID_KEYS
+        elif kind in (None, "answers"):
+            keys = self.RENDER_KEYS
+        else:
+            keys = [k for k in self.RENDER_KEYS if not k.startswith("answer")]
+        return self._fields_hash(keys)
 
     def make_output_dir(self):
         """Создаёт временную подпапку для вывода."""
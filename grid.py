@@ -1,77 +1,133 @@
+import os
+
 from PIL import Image, ImageDraw, ImageFont
 from utils import center_in_cell
+from writer import save_image, stream_mode
+from stream_writer import open_stream_writer
+from profiler import stage
+
+
+def estimate_grid_mb(cfg, tile_size, px_per_mm):
+    """Пиковая память потоковой сетки: полоса-холст, строка исходника и копия для записи."""
+    grid_w = tile_size * (cfg.cols + 1)
+    band_h = tile_size + int(cfg.label_area_mm * px_per_mm)
+    return grid_w * band_h * (4 + 4 + 4) / 2**20
 
 
 def make_grid(cfg, img, tile_size, px_per_mm, dpi, output_path):
     """
     Создаёт изображение с сеткой и подписями по данным из cfg.
     Сохраняет результат в указанный файл (например, grid.png).
+
+    Сетка собирается полосами по строке тайлов (первая — подпись и цифры
+    сверху) и каждая полоса сразу уходит в потоковый писатель, поэтому
+    память пропорциональна одной строке тайлов. img — Image, LazyImage или
+    TileStore: из него читается только текущая строка. Линии и подписи
+    соседних строк дорисовываются в полосу, так что результат совпадает
+    с рендером целым холстом. JPEG и палитра полосами не пишутся — для них
+    полосы собираются в целый холст.
     """
     print("📏 Генерация сетки...")
 
     label_area_px = int(cfg.label_area_mm * px_per_mm)
     grid_w = tile_size * cfg.cols + tile_size
     grid_h = tile_size * cfg.rows + tile_size
-    grid_img = Image.new("RGBA", (grid_w, grid_h + label_area_px), (255, 255, 255, 255))
+    total_h = grid_h + label_area_px
+
+    # === шрифты ===
+    font_size_grid = int(tile_size * cfg.font_scale)
+    try:
+        print(f"🧮 grid_label_font_mm={cfg.grid_label_font_mm}, px_per_mm={px_per_mm}, font_px={cfg.grid_label_font_mm * px_per_mm}")
+        font_grid = ImageFont.truetype(cfg.font_path, font_size_grid)
+    except OSError:
+        font_grid = ImageFont.load_default()
+    grid_label_font_size = int(cfg.grid_label_font_mm * px_per_mm)
+    label_font = ImageFont.truetype(cfg.font_path, grid_label_font_size)
+
+    # === куда пишем ===
+    mode = stream_mode(cfg, "grid", img.mode)
+    if mode:
+        stream = open_stream_writer(output_path, grid_w, total_h, mode, dpi, cfg)
+        full = None
+    else:
+        stream = None
+        full = Image.new("RGBA", (grid_w, total_h), (255, 255, 255, 255))
+
+    # полоса 0 — подпись и цифры сверху, полоса r + 1 — строка тайлов r
+    try:
+        for band_idx in range(cfg.rows + 1):
+            y0 = 0 if band_idx == 0 else label_area_px + band_idx * tile_size
+            y1 = label_area_px + (band_idx + 1) * tile_size
+            band_img = Image.new("RGBA", (grid_w, y1 - y0), (255, 255, 255, 255))
+            if band_idx > 0:
+                r = band_idx - 1
+                src = img.crop((0, r * tile_size, tile_size * cfg.cols, (r + 1) * tile_size))
+                band_img.paste(src, (tile_size, 0))
+                del src
+            draw_grid_overlay(cfg, ImageDraw.Draw(band_img), tile_size, label_area_px,
+                              font_grid, label_font, y0, band_idx)
+
+            if stream:
+                stream.write(band_img.convert(mode))
+            else:
+                full.paste(band_img, (0, y0))
+    except BaseException:
+        if stream:
+            stream.abort()
+        raise
+
+    # === сохранение ===
+    if stream:
+        with stage("save", kind="grid", file=os.path.basename(output_path), banded=True) as rec:
+            stream.close()
+            rec["bytes"] = os.path.getsize(output_path)
+    else:
+        save_image(full, output_path, cfg, "grid", dpi)
+    print(f"💾 Сетка сохранена → {output_path}")
 
-    grid_img.paste(img, (tile_size, tile_size + label_area_px))
-    draw = ImageDraw.Draw(grid_img)
+
+def draw_grid_overlay(cfg, draw, tile_size, label_area_px, font_grid, label_font, y0, band_idx):
+    """
+    Линии, цифры, буквы и подпись проекта в полосе band_idx, начинающейся
+    со строки y0 сетки. Рисуется всё, что касается полосы и соседних строк,
+    в том же порядке, что и на целом холсте; лишнее обрезает сам Pillow.
+    """
+    grid_w = tile_size * cfg.cols + tile_size
+    grid_h = tile_size * cfg.rows + tile_size
+    near = range(max(0, band_idx - 2), min(cfg.rows, band_idx + 1))   # строки r рядом с полосой
 
     # === линии сетки ===
     for c in range(cfg.cols + 1):
         x = tile_size + c * tile_size
-        draw.line([(x, tile_size + label_area_px), (x, grid_h + label_area_px)],
+        draw.line([(x, tile_size + label_area_px - y0), (x, grid_h + label_area_px - y0)],
                   fill="black", width=cfg.grid_line_width)
     for r in range(cfg.rows + 1):
         y = tile_size + r * tile_size
-        draw.line([(tile_size, y + label_area_px), (grid_w, y + label_area_px)],
+        if abs(y + label_area_px - y0) > 2 * tile_size + cfg.grid_line_width:
+            continue
+        draw.line([(tile_size, y + label_area_px - y0), (grid_w, y + label_area_px - y0)],
                   fill="black", width=cfg.grid_line_width)
 
-    # === шрифты ===
-    font_size_grid = int(tile_size * cfg.font_scale)
-    try:
-        print(f"🧮 grid_label_font_mm={cfg.grid_label_font_mm}, px_per_mm={px_per_mm}, font_px={cfg.grid_label_font_mm * px_per_mm}")
-        font_grid = ImageFont.truetype(cfg.font_path, font_size_grid)
-    except OSError:
-        font_grid = ImageFont.load_default()
-
-    # === цифры сверху ===
-    for c in range(cfg.cols):
-        txt = str(c + 1)
-        x, y = center_in_cell(draw, txt,
-                              tile_size + c * tile_size, 0,
-                              tile_size, tile_size, font_grid)
-        draw.text((x, y + label_area_px), txt, fill="black", font=font_grid)
+    # === цифры сверху и подпись проекта — только у верхних полос ===
+    if band_idx <= 1:
+        for c in range(cfg.cols):
+            txt = str(c + 1)
+            x, y = center_in_cell(draw, txt,
+                                  tile_size + c * tile_size, 0,
+                                  tile_size, tile_size, font_grid)
+            draw.text((x, y + label_area_px - y0), txt, fill="black", font=font_grid)
 
     # === буквы слева ===
-    for r in range(cfg.rows):
+    for r in near:
         txt = cfg.letters[r]
         x, y = center_in_cell(draw, txt,
                               0, tile_size + r * tile_size,
                               tile_size, tile_size, font_grid)
-        draw.text((x, y + label_area_px), txt, fill="black", font=font_grid)
+        draw.text((x, y + label_area_px - y0), txt, fill="black", font=font_grid)
 
     # === подпись проекта ===
-    
-    grid_label_font_size = int(cfg.grid_label_font_mm * px_per_mm)
-    label_font = ImageFont.truetype(cfg.font_path, grid_label_font_size)
-    bbox = draw.textbbox((0, 0), cfg.project_name, font=label_font)
-    lw, lh = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    draw.text(((grid_w - lw) // 2, (label_area_px - lh) // 2),
-                    cfg.project_name, font=label_font, fill="black")
-    
-    # try:
-    #     label_font = ImageFont.truetype(cfg.font_path, int(cfg.grid_label_font_mm * px_per_mm))
-    # except OSError:
-    #     print("⚠️ Не удалось загрузить шрифт для подписи проекта, будет использован шрифт по умолчанию.")
-    #     label_font = ImageFont.load_default()
-
-    # bbox = label_font.getbbox(cfg.project_name)
-    # lw, lh = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    # draw.text(((grid_w - lw) // 2, (label_area_px - lh) // 2),
-    #         cfg.project_name, font=label_font, fill="black")
-
-
-    # === сохранение ===
-    grid_img.save(output_path, dpi=(dpi, dpi))
-    print(f"💾 Сетка сохранена → {output_path}")
+    if band_idx <= 1:
+        bbox = draw.textbbox((0, 0), cfg.project_name, font=label_font)
+        lw, lh = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        draw.text(((grid_w - lw) // 2, (label_area_px - lh) // 2 - y0),
+                  cfg.project_name, font=label_font, fill="black")
@@ -1,12 +1,201 @@
-from PIL import Image
+import io
+import math
+
+from PIL import Image, TiffImagePlugin, TiffTags
+
+# теги TIFF, нужные для чтения полос
+_IMAGE_LENGTH = 257
+_BITS_PER_SAMPLE = 258
+_COMPRESSION = 259
+_STRIP_OFFSETS = 273
+_ROWS_PER_STRIP = 278
+_STRIP_BYTE_COUNTS = 279
+_PLANAR_CONFIG = 284
+_TILE_WIDTH = 322
+_TILE_LENGTH = 323
+_TILE_OFFSETS = 324
+_TILE_BYTE_COUNTS = 325
+# указатели на под-IFD в «урезанный» TIFF не переносим — их смещения станут неверными
+_SKIP_TAGS = {_STRIP_OFFSETS, _STRIP_BYTE_COUNTS, _TILE_OFFSETS, _TILE_BYTE_COUNTS,
+              330, 34665, 34853, 40965}
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in img.info
+
+
+class LazyImage:
+    """
+    Ленивое изображение: открывается без декодирования, пиксели читаются
+    полосами по запросу (crop / resize).
+
+    Для TIFF читаются только strip'ы/тайлы, задевающие нужные строки:
+    из них собирается маленький TIFF в памяти и декодируется им же (любое
+    сжатие, которое понимает Pillow/libtiff). Для остальных форматов
+    изображение декодируется один раз целиком и дальше режется из памяти.
+
+    Режим результата — RGB, если в источнике нет альфы, иначе RGBA.
+    Пиклится только путь и геометрия, поэтому дёшево передаётся в процессы.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        with Image.open(path) as src:
+            self.format = src.format
+            self.info = dict(src.info)
+            self.mode = "RGBA" if _has_alpha(src) else "RGB"
+            self._src_size = src.size
+        self.size = tuple(size) if size else self._src_size
+        self._band = None      # (y0, y1, Image) — последняя прочитанная полоса
+        self._full = None      # запасной путь: всё изображение в памяти
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_band"] = None
+        state["_full"] = None
+        return state
+
+    # === чтение полос ===
+    def _read_rows(self, y0, y1):
+        """Возвращает полосу строк [y0, y1) во всю ширину исходника, в режиме self.mode."""
+        band = None
+        if self.format == "TIFF" and self._full is None:
+            try:
+                band = self._read_tiff_rows(y0, y1)
+            except Exception as e:
+                print(f"⚠️ Построчное чтение TIFF недоступно ({e}) — декодирую целиком.")
+                self.format = None
+        if band is None:
+            if self._full is None:
+                with Image.open(self.path) as src:
+                    src.load()
+                    self._full = src.copy()
+            band = self._full.crop((0, y0, self._src_size[0], y1))
+        if band.mode != self.mode:
+            band = band.convert(self.mode)
+        return band
+
+    def _read_tiff_rows(self, y0, y1):
+        with Image.open(self.path) as src:
+            tags = src.tag_v2
+            width, height = src.size
+            if tags.get(_PLANAR_CONFIG, 1) != 1:
+                raise ValueError("planar configuration")
+
+            if _TILE_OFFSETS in tags:
+                unit_h = tags[_TILE_LENGTH]
+                per_row = math.ceil(width / tags[_TILE_WIDTH])
+                offsets, counts = tags[_TILE_OFFSETS], tags[_TILE_BYTE_COUNTS]
+                offsets_tag, counts_tag = _TILE_OFFSETS, _TILE_BYTE_COUNTS
+            else:
+                unit_h = tags.get(_ROWS_PER_STRIP, height)
+                per_row = 1
+                offsets, counts = tags[_STRIP_OFFSETS], tags[_STRIP_BYTE_COUNTS]
+                offsets_tag, counts_tag = _STRIP_OFFSETS, _STRIP_BYTE_COUNTS
+            unit_h = min(unit_h, height)
+
+            if tags.get(_COMPRESSION, 1) == 1 and per_row == 1:
+                # без сжатия strip можно резать построчно — читаем ровно нужные строки
+                bits = tags[_BITS_PER_SAMPLE]
+                row_bytes = (width * sum(bits if isinstance(bits, tuple) else (bits,)) + 7) // 8
+                data = bytearray()
+                for y in range(y0, y1):
+                    k, dy = divmod(y, unit_h)
+                    src.fp.seek(offsets[k] + dy * row_bytes)
+                    data += src.fp.read(row_bytes)
+                chunks = [bytes(data)]
+                band_y0, band_h, rows_per_unit = y0, y1 - y0, y1 - y0
+            else:
+                k0, k1 = y0 // unit_h, math.ceil(y1 / unit_h)
+                chunks = []
+                for i in range(k0 * per_row, min(k1 * per_row, len(offsets))):
+                    src.fp.seek(offsets[i])
+                    chunks.append(src.fp.read(counts[i]))
+                band_y0 = k0 * unit_h
+                band_h = min(k1 * unit_h, height) - band_y0
+                rows_per_unit = unit_h
+
+            ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b"II")
+            for tag, value in tags.items():
+                if tag not in _SKIP_TAGS:
+                    ifd[tag] = value
+                    if tag in tags.tagtype:
+                        ifd.tagtype[tag] = tags.tagtype[tag]
+            ifd[_IMAGE_LENGTH] = band_h
+            if offsets_tag == _STRIP_OFFSETS:
+                ifd[_ROWS_PER_STRIP] = rows_per_unit
+
+        # заголовок → IFD → данные полос. Pillow сам сдвигает StripOffsets
+        # за конец IFD, а TileOffsets приходится пересчитывать вручную.
+        rel_offsets, pos = [], 0
+        for chunk in chunks:
+            rel_offsets.append(pos)
+            pos += len(chunk)
+        ifd[offsets_tag] = tuple(rel_offsets)
+        ifd.tagtype[offsets_tag] = TiffTags.LONG
+        ifd[counts_tag] = tuple(len(c) for c in chunks)
+        ifd.tagtype[counts_tag] = TiffTags.LONG
+        ifd_bytes = ifd.tobytes(8)
+        if offsets_tag == _TILE_OFFSETS:
+            ifd[offsets_tag] = tuple(8 + len(ifd_bytes) + o for o in rel_offsets)
+            ifd_bytes = ifd.tobytes(8)
+
+        buf = io.BytesIO()
+        buf.write(b"II*\x00" + (8).to_bytes(4, "little"))
+        buf.write(ifd_bytes)
+        for chunk in chunks:
+            buf.write(chunk)
+        buf.seek(0)
+
+        band = Image.open(buf)
+        band.load()
+        return band.crop((0, y0 - band_y0, width, y1 - band_y0))
+
+    # === интерфейс «как у Image» ===
+    def crop(self, box):
+        """Вырезает область; повторные запросы в пределах одной полосы не перечитывают файл."""
+        x0, y0, x1, y1 = (int(v) for v in box)
+        if self._band is None or not (self._band[0] <= y0 and y1 <= self._band[1]):
+            self._band = (y0, y1, self._read_rows(y0, y1))
+        band_y0, _, band = self._band
+        return band.crop((x0, y0 - band_y0, x1, y1 - band_y0))
+
+    def resize(self, size, resample=Image.NEAREST, band_rows=512):
+        """Уменьшает изображение, читая исходник полосами (для превью и GUI)."""
+        tw, th = size
+        w, h = self.size
+        out = Image.new(self.mode, (tw, th))
+        for dy0 in range(0, th, max(1, band_rows * th // h)):
+            dy1 = min(th, dy0 + max(1, band_rows * th // h))
+            sy0 = math.floor(dy0 * h / th)
+            sy1 = min(h, math.ceil(dy1 * h / th))
+            band = self.crop((0, sy0, w, sy1))
+            part = band.resize((tw, dy1 - dy0), resample,
+                               box=(0, dy0 * h / th - sy0, w, dy1 * h / th - sy0))
+            out.paste(part, (0, dy0))
+        self._band = None
+        return out
+
+    def load(self):
+        """Полностью декодированная копия (только для небольших изображений)."""
+        return self.crop((0, 0, self.width, self.height))
+
 
 def load_image(path, cols, rows):
     """
-    Загружает изображение и подгоняет его под целое число тайлов.
-    Возвращает (img, tile_size, px_per_mm, dpi)
+    Открывает изображение лениво и подгоняет его под целое число тайлов.
+    Возвращает (img, tile_size, px_per_mm, dpi), где img — LazyImage.
     """
     print(f"📂 Загружаем изображение: {path}")
-    img = Image.open(path).convert("RGBA")
+    img = LazyImage(path)
 
     w, h = img.size
     dpi = img.info.get("dpi", (96, 96))[0]
@@ -21,6 +210,6 @@ def load_image(path, cols, rows):
 
     if w != new_w or h != new_h:
         print(f"⚠️ Изображение будет обрезано до {new_w}×{new_h}px")
-        img = img.crop((0, 0, new_w, new_h))
+        img = LazyImage(path, (new_w, new_h))
 
     return img, tile_size, px_per_mm, dpi
@@ -1,11 +1,41 @@
 import os
+import json
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Пишет во временный файл рядом с path и переименовывает его в path только
+    после успешного завершения блока. Упавший на середине процесс оставляет
+    либо старый файл, либо никакого — но не обрезанный.
+
+        with atomic_output(out_path) as tmp:
+            img.save(tmp, format="PNG")
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def save_json_atomic(data, path):
+    """json.dump через временный файл."""
+    with atomic_output(path) as tmp:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+
 
 def save_answers(answers_log, seed, output_path):
     """
     Сохраняет текстовый файл answers.txt с таблицами ответов и сидом.
     """
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
+    with atomic_output(output_path) as tmp, open(tmp, "w", encoding="utf-8") as f:
         if seed is None:
             f.write("Сид: случайный (не задан пользователем)\n\n")
         else:
@@ -1,43 +1,216 @@
 import argparse
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from config import Config
 from image_loader import load_image
 from tiles import split_tiles, load_random_state, generate_random_state
 from white_tiles import detect_white_tiles, save_white_tiles, load_white_tiles
-from grid import make_grid
-from sheets import make_sheets_from_state
+from grid import make_grid, estimate_grid_mb
+from tile_store import TileStore
+from render_cache import RenderCache, input_digests
+from sheets import OUTPUT_KINDS, output_filename, sheet_units, plan_band_rows
+from scheduler import WorkUnit, WORKER_BASE_MB, run_units, worker_count
 from io_helpers import save_answers
+from manifest import RunManifest, artifact_key
+from writer import output_extension
+from pdf_writer import write_project_pdf
+import profiler
+from profiler import stage
 
 
-def task_grid(cfg, img, tile_size, px_per_mm, dpi, output_dir):
+def task_grid(cfg, img, tile_size, px_per_mm, dpi, output_dir, cache=None):
     """Параллельная задача — генерация сетки."""
-    output_path = os.path.join(output_dir, "grid.png")
-    make_grid(cfg, img, tile_size, px_per_mm, dpi, output_path)
+    output_path = os.path.join(output_dir, f"grid{output_extension(cfg)}")
+    key = cache.key("grid") if cache is not None else None
+    if cache is not None and cache.fetch(key, output_path):
+        return f"♻️ Сетка взята из кэша → {output_path}"
+    with stage("make_grid"):
+        make_grid(cfg, img, tile_size, px_per_mm, dpi, output_path)
+    if cache is not None:
+        cache.store(key, output_path)
     return f"💾 Сетка сохранена → {output_path}"
 
 
-def task_sheets(cfg, img_tiles, state, px_per_mm, dpi, output_dir, threads, selected_pages):
-    """Параллельная задача — генерация shuffled и answers-листов."""
-    results = make_sheets_from_state(cfg, img_tiles, state, px_per_mm, dpi, output_dir,
-                                     threads=threads, pages=selected_pages)
-    # results = [(shuffled_path, answers_path), ...]
-    answers_log = [f"{os.path.basename(s)}, {os.path.basename(a)}" for s, a in results]
-
+def write_answers(cfg, pages, output_dir, failed=(), pdf_pages=None):
+    """
+    answers.txt по всем страницам запуска — и тогда, когда часть страниц упала:
+    такие помечаются, их дособирает --resume. pdf_pages — листы собраны в PDF
+    ({номер страницы: {вид: страница PDF}}), в ответах — номера страниц PDF.
+    """
+    ext = output_extension(cfg)
+    answers_log = []
+    for page in pages:
+        idx = page["index"]
+        if pdf_pages:
+            line = f"PDF стр. {pdf_pages[idx]['shuffled']}, PDF стр. {pdf_pages[idx]['answers']}"
+        else:
+            line = f"{output_filename('shuffled', idx, ext)}, {output_filename('answers', idx, ext)}"
+        if idx in failed:
+            line += "  ❌ не собран (перезапустите с --resume)"
+        answers_log.append(line)
     answers_txt = os.path.join(output_dir, "answers.txt")
     save_answers(answers_log, cfg.random_seed, answers_txt)
     return f"💾 Сгенерированы shuffled/answers-листы → {answers_txt}"
 
 
+def load_project_image(cfg):
+    """Загружает исходник проекта и считает авто-DPI листов: (img, tile_size, px_per_mm, export_dpi)."""
+    with stage("load_image"):
+        img, tile_size, px_per_mm, dpi = load_image(cfg.input_file, cfg.cols, cfg.rows)
+    # === Авто-DPI как в старом коде ===
+    w_px, h_px = img.size
+    dpi_x = w_px / (cfg.sheet_w_mm / 25.4)
+    dpi_y = h_px / (cfg.sheet_h_mm / 25.4)
+    export_dpi = (dpi_x + dpi_y) / 2
+    px_per_mm = export_dpi / 25.4
+
+    print(f"📐 Авто-DPI для печати: {export_dpi:.2f}")
+    print(f"ℹ️ px_per_mm: {px_per_mm:.3f}")
+    return img, tile_size, px_per_mm, export_dpi
+
+
+def plan_project(cfg, img, tile_size, px_per_mm, dpi, output_dir, reshuffle=False, page_indices=None,
+                 threads=None, max_memory=None, use_cache=True, manifest=None):
+    """
+    Раскладывает тайлы в общую память, готовит random_state и режет работу
+    проекта на задачи общего пула. Файлы, которые manifest считает готовыми
+    и целыми (--resume), в задачи не попадают.
+    Возвращает (img_tiles, units, budget_mb, pages); img_tiles закрывает вызывающий.
+    """
+    # Разделяем только на случай, если ты всё же хочешь разное
+    px_per_mm_grid = px_per_mm
+    px_per_mm_sheets = px_per_mm
+    dpi_grid = dpi
+    dpi_sheets = dpi
+
+    # === Загружаем white_tiles и state ===
+    exclude_coords = load_white_tiles(cfg)
+    # тайлы живут в общей памяти: воркеры подключаются к ней, а не получают копию словаря
+    with stage("tile_store"):
+        img_tiles = TileStore.from_image(img, tile_size, cfg, exclude_coords)
+    try:
+        with stage("split_tiles"):
+            tiles = split_tiles(img_tiles, cfg, exclude_coords)
+
+        state = load_random_state(cfg)
+        if reshuffle or not state:
+            with stage("generate_random_state"):
+                state = generate_random_state(cfg, tiles)
+
+        # === Список страниц (если указан) ===
+        if page_indices:
+            # из random_state.bin читаются только нужные страницы
+            pages = (state.pages_by_index(page_indices) if hasattr(state, "pages_by_index")
+                     else [p for p in state["pages"] if p["index"] in page_indices])
+        else:
+            pages = list(state["pages"])
+
+        # === Кэш рендера: неизменившиеся листы не рендерятся заново ===
+        cache = RenderCache(cfg, px_per_mm_sheets, dpi_sheets) if use_cache else None
+
+        # === Один общий пул: сетка + листы, разбитые на задачи ===
+        workers = threads or os.cpu_count() or 1
+        budget_mb = band_rows = None
+        if max_memory:
+            # общая память тайлов и сам главный процесс — из бюджета
+            budget_mb = max_memory - img_tiles.nbytes / 2**20 - WORKER_BASE_MB
+            unit_kinds = OUTPUT_KINDS if len(pages) >= workers else ("shuffled",)
+            # самый большой лист (форматы страниц может выбрать sheet_planner)
+            largest = max(pages, key=lambda p: len(p["matrix"]) * len(p["matrix"][0]))
+            band_rows = plan_band_rows(cfg, largest, px_per_mm_sheets, unit_kinds,
+                                       budget_mb / workers - WORKER_BASE_MB)
+            print(f"🧮 Бюджет памяти {max_memory} МБ: "
+                  f"{f'полосы по {band_rows} ряд(а) тайлов' if band_rows else 'листы целиком'}")
+        # === --resume: готовое и целое не пересобираем ===
+        ext = output_extension(cfg)
+        done, grid_done = set(), False
+        if manifest is not None:
+            manifest.cleanup_tmp()
+            digests = input_digests(cfg)
+            for page in pages:
+                for kind in OUTPUT_KINDS:
+                    filename = output_filename(kind, page["index"], ext)
+                    verified = manifest.verify(filename, artifact_key(cfg, kind, page, digests))
+                    if verified:
+                        done.add((page["index"], kind))
+                    elif verified is False and cache is not None:
+                        # испорченный лист мог прийти из кэша — эту запись кэша не берём
+                        cache.drop(cache.key(kind, page), filename)
+            verified = manifest.verify(f"grid{ext}", artifact_key(cfg, "grid", digests=digests))
+            grid_done = bool(verified)
+            if verified is False and cache is not None:
+                cache.drop(cache.key("grid"), f"grid{ext}")
+            if done or grid_done:
+                print(f"⏩ Уже готово и проверено: {len(done) + grid_done} файл(ов)")
+
+        units = sheet_units(cfg, img_tiles, pages, px_per_mm_sheets, dpi_sheets, output_dir, workers,
+                            cache, band_rows, done)
+        n_tiles = cfg.cols * cfg.rows
+        # сетка читает строки тайлов из общей памяти и пишет полосами — нужна память на одну строку
+        if not grid_done:
+            units.append(WorkUnit("grid", task_grid,
+                                  (cfg, img_tiles, tile_size, px_per_mm_grid, dpi_grid, output_dir, cache),
+                                  cost=n_tiles, mem_mb=estimate_grid_mb(cfg, tile_size, px_per_mm_grid)))
+        if budget_mb is not None:
+            over = [u.name for u in units if u.mem_mb + WORKER_BASE_MB > budget_mb]
+            if over:
+                print(f"⚠️ Не укладываются в бюджет даже поодиночке: {', '.join(over)}")
+    except BaseException:
+        img_tiles.close()
+        raise
+    return img_tiles, units, budget_mb, pages
+
+
+def run_project(cfg, units, pages, output_dir, workers, budget_mb=None, pool=None, manifest=None):
+    """
+    Гонит задачи проекта через пул. Упавшая задача не останавливает
+    остальные; каждый готовый файл сразу попадает в manifest, answers.txt
+    пишется в любом случае. Возвращает (пути готовых файлов, упавшие задачи).
+    """
+    print(f"🚀 Запуск параллельной генерации: {len(units)} задач на {workers} процессах...")
+    ext = output_extension(cfg)
+    if manifest is None:
+        manifest = RunManifest(output_dir, cfg)
+    outputs, failed = [], []
+    digests = input_digests(cfg)
+
+    def on_error(unit, exc):
+        print(f"❌ Задача «{unit.name}» упала: {type(exc).__name__}: {exc}")
+        failed.append(unit)
+
+    for unit, result in run_units(units, workers, budget_mb, pool, on_error):
+        if unit.name == "grid":
+            print(result)
+            path = os.path.join(output_dir, f"grid{ext}")
+            manifest.record(path, "grid", artifact_key(cfg, "grid", digests=digests))
+            outputs.append(path)
+        else:
+            by_index = {page["index"]: page for page in unit.args[2]}
+            for (page_idx, kind), path in result.items():
+                manifest.record(path, kind, artifact_key(cfg, kind, by_index[page_idx], digests),
+                                page_idx)
+                outputs.append(path)
+
+    failed_pages = {page["index"] for u in failed if u.name != "grid" for page in u.args[2]}
+    print(write_answers(cfg, pages, output_dir, failed_pages))
+    return outputs, failed
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="🧩 Генератор листов проекта")
     parser.add_argument("--project", type=str, help="Имя проекта (папка в out/)")
     parser.add_argument("--detect-whites", action="store_true", help="Только поиск белых тайлов")
-    parser.add_argument("--reshuffle", action="store_true", help="Пересоздать random_state.json")
+    parser.add_argument("--reshuffle", action="store_true", help="Пересоздать random_state")
     parser.add_argument("--pages", type=str, help="Список страниц через запятую (например 1,3,5)")
-    parser.add_argument("--threads", type=int, default=None, help="Количество потоков для листов")
+    parser.add_argument("--threads", type=int, default=None, help="Сколько процессов в пуле (по умолчанию — по ядрам и памяти)")
+    parser.add_argument("--max-memory", type=int, default=None,
+                        help="Бюджет памяти в МБ: листы собираются полосами, число процессов подстраивается")
+    parser.add_argument("--resume", type=str, metavar="DIR",
+                        help="Дособрать прерванный запуск в этой папке: только недостающие и битые листы")
+    parser.add_argument("--no-cache", action="store_true", help="Не брать готовые листы из кэша рендера")
+    parser.add_argument("--profile", action="store_true", help="Замеры по этапам + trace.json (Chrome trace)")
+    parser.add_argument("--pdf", action="store_true",
+                        help="Сетка и все листы одним PDF (тайлы встраиваются один раз, текст — шрифтом)")
 
     args = parser.parse_args()
 
@@ -52,65 +225,56 @@ if __name__ == "__main__":
         print(f"❌ Ошибка: файл '{cfg.input_file}' не найден.")
         exit(1)
 
-    # === Загружаем изображение ===
-    img, tile_size, px_per_mm, dpi = load_image(cfg.input_file, cfg.cols, cfg.rows)
-    output_dir = cfg.make_output_dir()
-    # === Авто-DPI как в старом коде ===
-    w_px, h_px = img.size
-    dpi_x = w_px / (cfg.sheet_w_mm / 25.4)
-    dpi_y = h_px / (cfg.sheet_h_mm / 25.4)
-    export_dpi = (dpi_x + dpi_y) / 2
-    px_per_mm = export_dpi / 25.4
-
-    # Разделяем только на случай, если ты всё же хочешь разное
-    px_per_mm_grid = px_per_mm
-    px_per_mm_sheets = px_per_mm
-    dpi_grid = export_dpi
-    dpi_sheets = export_dpi
-
-    print(f"📐 Авто-DPI для печати: {export_dpi:.2f}")
-    print(f"ℹ️ px_per_mm: {px_per_mm:.3f}")
+    if args.resume:
+        if not os.path.isdir(args.resume):
+            print(f"❌ Папка запуска '{args.resume}' не найдена.")
+            exit(1)
+        output_dir = args.resume
+        print(f"🔁 Продолжаем запуск в {output_dir}")
+    else:
+        output_dir = cfg.make_output_dir()
+    manifest = RunManifest(output_dir, cfg)
+    if args.profile:
+        profiler.enable(os.path.join(output_dir, "profile"))
 
+    # === Загружаем изображение ===
+    img, tile_size, px_per_mm, export_dpi = load_project_image(cfg)
 
     # === Режим: поиск белых тайлов ===
     if args.detect_whites:
-        whites = detect_white_tiles(img, cfg)
+        with stage("detect_white_tiles"):
+            whites = detect_white_tiles(img, cfg)
         save_white_tiles(cfg, whites)
         print("✅ Белые тайлы сохранены. Завершено.")
+        profiler.finish(os.path.join(output_dir, "trace.json"))
         exit(0)
 
-    # === Загружаем white_tiles и state ===
-    exclude_coords = load_white_tiles(cfg)
-    tiles = split_tiles(img, cfg, exclude_coords)
-    img_tiles = {coord: tile for (_, coord, tile) in tiles}
-
-    state = load_random_state(cfg)
-    if args.reshuffle or not state:
-        state = generate_random_state(cfg, tiles)
+    page_indices = [int(x) for x in args.pages.split(",")] if args.pages else None
+    img_tiles, units, budget_mb, pages = plan_project(
+        cfg, img, tile_size, px_per_mm, export_dpi, output_dir,
+        reshuffle=args.reshuffle, page_indices=page_indices, threads=args.threads,
+        max_memory=args.max_memory, use_cache=not args.no_cache,
+        manifest=manifest if args.resume else None)
+    workers = worker_count(units, args.threads, budget_mb)
 
-    # === Список страниц (если указан) ===
-    if args.pages:
-        selected_indices = [int(x) for x in args.pages.split(",")]
-        selected_pages = [p for p in state["pages"] if p["index"] in selected_indices]
-    else:
-        selected_pages = None
-
-    print("🚀 Запуск параллельной генерации...")
-
-    # === Параллельно запускаем grid и sheets ===
-    tasks = []
-    with ProcessPoolExecutor(max_workers=2) as pool:
-        # GRID рендерим со своим dpi_grid/px_per_mm_grid
-        tasks.append(pool.submit(task_grid, cfg, img, tile_size, px_per_mm_grid, dpi_grid, output_dir))
-
-        # SHEETS рендерим с dpi_sheets/px_per_mm_sheets
-        tasks.append(pool.submit(task_sheets, cfg, img_tiles, state,
-                                px_per_mm_sheets, dpi_sheets, output_dir,
-                                args.threads, selected_pages))
-
-
-        for fut in as_completed(tasks):
-            print(fut.result())
+    failed = []
+    try:
+        if args.pdf:
+            # один последовательный файл — задачи пула не нужны
+            with stage("write_pdf"):
+                pdf_path, pdf_pages = write_project_pdf(cfg, img_tiles, pages, px_per_mm, export_dpi, output_dir)
+            manifest.record(pdf_path, "pdf", artifact_key(cfg, None))
+            print(write_answers(cfg, pages, output_dir, pdf_pages=pdf_pages))
+        else:
+            _, failed = run_project(cfg, units, pages, output_dir, workers, budget_mb, manifest=manifest)
+    finally:
+        img_tiles.close()
 
+    profiler.finish(os.path.join(output_dir, "trace.json"))
+    if failed:
+        print(f"\n⚠️ Не собрано задач: {len(failed)}. Дособрать: python main.py --project "
+              f"{cfg.project_name} --resume {output_dir}")
+        print(f"📂 Папка проекта: {output_dir}")
+        exit(1)
     print("\n✅ Готово!")
     print(f"📂 Папка проекта: {output_dir}")
@@ -0,0 +1,98 @@
+import os
+import json
+import glob
+import hashlib
+import datetime
+
+from render_cache import file_digest, input_digests
+from io_helpers import save_json_atomic
+
+MANIFEST_NAME = "manifest.json"
+
+
+def artifact_key(cfg, kind, page=None, digests=None):
+    """
+    Что должно совпасть, чтобы готовый файл годился при --resume: поля
+    конфига, влияющие на этот вид листа, дайджесты исходника и шрифта
+    (как в RenderCache) и раскладка и формат страницы. digests —
+    уже посчитанные input_digests(cfg), чтобы не читать их на каждый лист.
+    """
+    payload = {"fingerprint": cfg.render_fingerprint(kind), **(digests or input_digests(cfg))}
+    if page is not None:
+        payload["matrix"] = page["matrix"]
+        payload["rotation"] = page.get("rotation_matrix")
+        if page.get("sheet"):
+            payload["sheet"] = page["sheet"]
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+class RunManifest:
+    """
+    manifest.json в папке запуска: каждый готовый файл с sha256, размером
+    и ключом (artifact_key). Файл дописывается после каждого листа, так что
+    после падения посередине видно, что уже готово, а --resume пересобирает
+    только недостающее или испорченное.
+    """
+
+    def __init__(self, output_dir, cfg=None):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        else:
+            self.data = {
+                "project": cfg.project_name if cfg else None,
+                "seed": cfg.random_seed if cfg else None,
+                "layout_hash": cfg.layout_hash() if cfg else None,
+                "style_hash": cfg.style_hash() if cfg else None,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "artifacts": {},
+            }
+
+    @property
+    def artifacts(self):
+        return self.data["artifacts"]
+
+    def record(self, path, kind, key, page=None):
+        """Отмечает файл готовым (считает контрольную сумму) и сразу сохраняет манифест."""
+        self.artifacts[os.path.basename(path)] = {
+            "kind": kind,
+            "page": page,
+            "key": key,
+            "bytes": os.path.getsize(path),
+            "sha256": file_digest(path),
+        }
+        self.save()
+
+    def verify(self, filename, key):
+        """
+        Проверка готового файла: True — есть, не битый (размер и sha256 как
+        в манифесте) и собран с тем же ключом; False — собран с тем же ключом,
+        но пропал или испорчен; None — записи нет или ключ другой.
+        """
+        entry = self.artifacts.get(filename)
+        if not entry or entry["key"] != key:
+            return None
+        path = os.path.join(self.output_dir, filename)
+        if not os.path.exists(path) or os.path.getsize(path) != entry["bytes"]:
+            return False
+        return file_digest(path) == entry["sha256"]
+
+    def is_done(self, filename, key):
+        """Файл есть, не битый и собран с тем же ключом (см. verify)."""
+        return self.verify(filename, key) is True
+
+    def forget(self, filename):
+        self.artifacts.pop(filename, None)
+
+    def cleanup_tmp(self):
+        """Убирает временные файлы и куски листов, оставшиеся от упавших воркеров."""
+        for pattern in ("*.tmp", "*.part"):
+            for path in glob.glob(os.path.join(self.output_dir, pattern)):
+                os.remove(path)
+
+    def save(self):
+        self.data["updated"] = datetime.datetime.now().isoformat(timespec="seconds")
+        save_json_atomic(self.data, self.path)
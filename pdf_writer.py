@@ -0,0 +1,453 @@
+"""
+Весь проект одним многостраничным PDF: сетка и листы всех страниц
+(прямой, с поворотом, answers), каждый — в физическом размере листа.
+
+Растр каждого тайла встраивается один раз как image XObject и ставится на
+все листы, где он встречается, матрицей преобразования (сдвиг, поворот,
+масштаб). Кружки рисуются векторно, номера, координаты и подписи — настоящим
+текстом шрифтом cfg.font_path (OTF/TTF встраивается целиком, Type0 /
+Identity-H). Геометрия та же, что у растровых листов (compute_layout,
+tile_position, RenderContext.circle_geometry), так что раскладка совпадает.
+
+Объекты пишутся в файл по мере готовности: в памяти — только текущий лист.
+
+    python main.py --project demo --pdf
+"""
+import os
+import re
+import zlib
+import struct
+
+import numpy as np
+from PIL import ImageColor
+
+from io_helpers import atomic_output
+from stream_writer import png_sub_filter
+from rotation import rotation_cos_sin, fit_scale
+from sheets import (OUTPUT_KINDS, compute_layout, sheet_size, tile_position, position_in_cell,
+                    get_render_context, load_font, page_config, resample_filter, RESAMPLE_FILTERS)
+
+PDF_NAME = "sheets.pdf"
+# кривая Безье, приближающая четверть окружности
+_KAPPA = 0.5522847498
+
+
+def _n(v):
+    """Число в content stream: без лишних нулей."""
+    return f"{v:.3f}".rstrip("0").rstrip(".") or "0"
+
+
+def _rgb(color):
+    """Цвет Pillow ("white", "#ff0000", (r, g, b)) → 'r g b' в долях единицы."""
+    if isinstance(color, (list, tuple)):
+        rgb = color[:3]
+    else:
+        rgb = ImageColor.getrgb(color)[:3]
+    return " ".join(_n(c / 255) for c in rgb)
+
+
+# ──────────────────────────────
+# 🔤 Шрифт для встраивания
+# ──────────────────────────────
+class SfntFont:
+    """
+    Минимальный разбор OTF/TTF для PDF: cmap, ширины глифов и метрики.
+    Файл встраивается целиком; в PDF текст пишется номерами глифов
+    (Identity-H), а ToUnicode позволяет его искать и копировать.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        d = self.data
+        self.cff = d[:4] == b"OTTO"
+        tables = {}
+        for i in range(struct.unpack_from(">H", d, 4)[0]):
+            tag, _, offset, _ = struct.unpack_from(">4sIII", d, 12 + 16 * i)
+            tables[tag] = offset
+
+        self.units_per_em = struct.unpack_from(">H", d, tables[b"head"] + 18)[0]
+        self.bbox = struct.unpack_from(">hhhh", d, tables[b"head"] + 36)
+        self.ascent, self.descent = struct.unpack_from(">hh", d, tables[b"hhea"] + 4)
+        n_metrics = struct.unpack_from(">H", d, tables[b"hhea"] + 34)[0]
+        self.advances = struct.unpack_from(f">{n_metrics * 2}H", d, tables[b"hmtx"])[::2]
+        self.cmap = self._read_cmap(d, tables[b"cmap"])
+        self.name = re.sub(r"[^A-Za-z0-9-]", "", os.path.splitext(os.path.basename(path))[0]) or "Font"
+        self.used = {}      # номер глифа → символ
+
+    @staticmethod
+    def _read_cmap(d, base):
+        subtables = {}
+        for i in range(struct.unpack_from(">H", d, base + 2)[0]):
+            platform, encoding, offset = struct.unpack_from(">HHI", d, base + 4 + 8 * i)
+            subtables[(platform, encoding)] = base + offset
+
+        for key in ((3, 10), (0, 4), (0, 6)):
+            if key in subtables and struct.unpack_from(">H", d, subtables[key])[0] == 12:
+                t = subtables[key]
+                cmap = {}
+                for g in range(struct.unpack_from(">I", d, t + 12)[0]):
+                    start, end, glyph = struct.unpack_from(">III", d, t + 16 + 12 * g)
+                    for code in range(start, end + 1):
+                        cmap[code] = glyph + code - start
+                return cmap
+
+        for key in ((3, 1), (0, 3), (0, 1), (0, 0)):
+            if key in subtables and struct.unpack_from(">H", d, subtables[key])[0] == 4:
+                t = subtables[key]
+                seg2 = struct.unpack_from(">H", d, t + 6)[0]
+                ends = struct.unpack_from(f">{seg2 // 2}H", d, t + 14)
+                starts = struct.unpack_from(f">{seg2 // 2}H", d, t + 16 + seg2)
+                deltas = struct.unpack_from(f">{seg2 // 2}h", d, t + 16 + 2 * seg2)
+                range_pos = t + 16 + 3 * seg2
+                cmap = {}
+                for i, (start, end) in enumerate(zip(starts, ends)):
+                    range_offset = struct.unpack_from(">H", d, range_pos + 2 * i)[0]
+                    for code in range(start, min(end, 0xFFFE) + 1):
+                        if range_offset:
+                            glyph = struct.unpack_from(">H", d, range_pos + 2 * i + range_offset
+                                                       + 2 * (code - start))[0]
+                            glyph = (glyph + deltas[i]) & 0xFFFF if glyph else 0
+                        else:
+                            glyph = (code + deltas[i]) & 0xFFFF
+                        if glyph:
+                            cmap[code] = glyph
+                return cmap
+        raise ValueError("в шрифте нет юникодной cmap")
+
+    def encode(self, text):
+        """Текст → hex-строка номеров глифов для Tj; запоминает использованные глифы."""
+        out = []
+        for ch in text:
+            glyph = self.cmap.get(ord(ch), 0)
+            self.used.setdefault(glyph, ch)
+            out.append(f"{glyph:04X}")
+        return "<" + "".join(out) + ">"
+
+    def width(self, glyph):
+        """Ширина глифа в единицах PDF (1/1000 кегля)."""
+        return round(self.advances[min(glyph, len(self.advances) - 1)] * 1000 / self.units_per_em)
+
+    def write(self, pdf, font_id):
+        """Дописывает в PDF объекты шрифта: Type0 → CIDFont → дескриптор → файл шрифта, ToUnicode."""
+        scale = 1000 / self.units_per_em
+        glyphs = sorted(self.used)
+        widths = " ".join(f"{g} [{self.width(g)}]" for g in glyphs)
+
+        if self.cff:
+            file_id = pdf.stream("/Subtype /OpenType", self.data)
+            subtype, file_key, extra = "CIDFontType0", "FontFile3", ""
+        else:
+            file_id = pdf.stream(f"/Length1 {len(self.data)}", self.data)
+            subtype, file_key, extra = "CIDFontType2", "FontFile2", " /CIDToGIDMap /Identity"
+        bbox = " ".join(str(round(v * scale)) for v in self.bbox)
+        descriptor_id = pdf.obj(
+            f"<< /Type /FontDescriptor /FontName /{self.name} /Flags 4 /FontBBox [{bbox}] "
+            f"/ItalicAngle 0 /Ascent {round(self.ascent * scale)} /Descent {round(self.descent * scale)} "
+            f"/CapHeight {round(self.ascent * scale)} /StemV 80 /{file_key} {file_id} 0 R >>")
+        cid_id = pdf.obj(
+            f"<< /Type /Font /Subtype /{subtype} /BaseFont /{self.name} "
+            f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            f"/FontDescriptor {descriptor_id} 0 R /W [{widths}]{extra} >>")
+
+        pairs = [f"<{g:04X}> <{''.join(f'{u:04X}' for u in _utf16(ch))}>" for g, ch in self.used.items()]
+        # в одном блоке bfchar — не больше 100 пар
+        mapping = "".join(f"{len(pairs[i:i + 100])} beginbfchar\n" + "\n".join(pairs[i:i + 100]) + "\nendbfchar\n"
+                          for i in range(0, len(pairs), 100))
+        to_unicode = (
+            "/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+            "/CMapName /Adobe-Identity-UCS def /CMapType 2 def\n"
+            "1 begincodespacerange <0000> <FFFF> endcodespacerange\n"
+            f"{mapping}"
+            "endcmap CMapName currentdict /CMap defineresource pop end end\n")
+        unicode_id = pdf.stream("", to_unicode.encode("ascii"), compress=True)
+        pdf.obj(f"<< /Type /Font /Subtype /Type0 /BaseFont /{self.name} /Encoding /Identity-H "
+                f"/DescendantFonts [{cid_id} 0 R] /ToUnicode {unicode_id} 0 R >>", font_id)
+
+
+def _utf16(ch):
+    data = ch.encode("utf-16-be")
+    return struct.unpack(f">{len(data) // 2}H", data)
+
+
+# ──────────────────────────────
+# 📄 Файл PDF
+# ──────────────────────────────
+class PdfFile:
+    """Объекты пишутся в открытый файл сразу; таблица xref — в close()."""
+
+    def __init__(self, f, compress_level=6):
+        self.f = f
+        self.compress_level = compress_level
+        self.offsets = {}
+        self.next_id = 1
+        f.write(b"%PDF-1.6\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self):
+        """Номер объекта, который будет записан позже (на него уже можно ссылаться)."""
+        oid = self.next_id
+        self.next_id += 1
+        return oid
+
+    def obj(self, body, oid=None):
+        oid = oid or self.reserve()
+        self.offsets[oid] = self.f.tell()
+        if isinstance(body, str):
+            body = body.encode("latin-1")
+        self.f.write(f"{oid} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+        return oid
+
+    def stream(self, attrs, data, oid=None, compress=False):
+        """Поток; compress=True — сжать FlateDecode (иначе data уже в нужном виде)."""
+        if compress:
+            data = zlib.compress(data, self.compress_level)
+            attrs += " /Filter /FlateDecode"
+        head = f"<< {attrs} /Length {len(data)} >>\nstream\n".encode("latin-1")
+        return self.obj(head + data + b"\nendstream", oid)
+
+    def image(self, tile):
+        """Image XObject из тайла (RGB или RGBA — альфа уходит в SMask); возвращает номер."""
+        w, h = tile.size
+        smask = ""
+        if tile.mode == "RGBA":
+            alpha = np.asarray(tile.getchannel("A"), dtype=np.uint8)
+            smask_id = self.stream(self._image_attrs(w, h, "DeviceGray", 1),
+                                   zlib.compress(png_sub_filter(alpha, 1).tobytes(), self.compress_level))
+            smask = f" /SMask {smask_id} 0 R"
+        rgb = np.asarray(tile.convert("RGB") if tile.mode != "RGB" else tile, dtype=np.uint8).reshape(h, w * 3)
+        data = zlib.compress(png_sub_filter(rgb, 3).tobytes(), self.compress_level)
+        return self.stream(self._image_attrs(w, h, "DeviceRGB", 3) + smask, data)
+
+    @staticmethod
+    def _image_attrs(w, h, colorspace, colors):
+        return (f"/Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace /{colorspace} "
+                f"/BitsPerComponent 8 /Filter /FlateDecode "
+                f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {w} >>")
+
+    def close(self, root_id):
+        xref = self.f.tell()
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[i]:010d} 00000 n \n" for i in range(1, self.next_id)]
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root {root_id} 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+        self.f.write("".join(lines).encode("ascii"))
+
+
+# ──────────────────────────────
+# 🖌️ Содержимое листа
+# ──────────────────────────────
+class SheetContent:
+    """
+    Content stream одного листа в пиксельных координатах растрового листа
+    (ось y вниз): общая матрица в начале переводит их в пункты страницы.
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.ops = []
+        self.xobjects = {}      # имя → номер объекта
+
+    def image(self, name, oid, x, y, size, angle=0):
+        """Тайл в клетке (x, y, size) с поворотом против часовой, как rotation.rotate_tile."""
+        self.xobjects[name] = oid
+        half = size / 2
+        ops = f"q 1 0 0 1 {_n(x + half)} {_n(y + half)} cm "
+        if angle:
+            cos, sin = rotation_cos_sin(angle)
+            # непрямой угол: повёрнутый квадрат вписывается в клетку (как rotate_tile)
+            half /= fit_scale(angle)
+            ops += f"{_n(cos)} {_n(-sin)} {_n(sin)} {_n(cos)} 0 0 cm "
+        self.ops.append(ops + f"{_n(2 * half)} 0 0 {_n(-2 * half)} {_n(-half)} {_n(half)} cm /{name} Do Q")
+
+    def circle(self, cx, cy, r, fill, outline, width):
+        """Кружок как ImageDraw.ellipse((cx-r, cy-r, cx+r, cy+r)): обводка внутри границы."""
+        cx, cy, r = cx + 0.5, cy + 0.5, r + 0.5
+        if fill is not None:
+            self.ops.append(f"{_rgb(fill)} rg {_circle_path(cx, cy, r)} f")
+        if outline is not None and outline != fill and width:
+            self.ops.append(f"{_rgb(outline)} RG {_n(width)} w {_circle_path(cx, cy, r - width / 2)} S")
+
+    def text(self, text, x, y, pil_font, fill, outline=None, outline_width=0):
+        """Текст в точке draw.text((x, y)): базовая линия на ascent шрифта ниже."""
+        size = pil_font.size
+        base = y + pil_font.getmetrics()[0]
+        run = f"BT /F1 {_n(size)} Tf 1 0 0 -1 {_n(x)} {_n(base)} Tm {self.font.encode(text)} Tj ET"
+        if outline is not None and outline_width:
+            # обводка шириной outline_width с каждой стороны — как «раздутая» маска в utils
+            # копия под обводку — оформление, не текст (поиск и копирование её пропускают)
+            self.ops.append(f"/Artifact BMC q 1 j {_rgb(outline)} RG {_n(2 * outline_width)} w 1 Tr {run} Q EMC")
+        self.ops.append(f"{_rgb(fill)} rg {run}")
+
+    def line(self, x0, y0, x1, y1, width, color):
+        self.ops.append(f"{_rgb(color)} RG {_n(width)} w {_n(x0)} {_n(y0)} m {_n(x1)} {_n(y1)} l S")
+
+    def write(self, pdf, parent_id, font_id, size_px, dpi):
+        """Пишет поток и объект страницы; size_px — размер растрового листа."""
+        k = 72 / dpi
+        w_pt, h_pt = size_px[0] * k, size_px[1] * k
+        body = f"q {_n(k)} 0 0 {_n(-k)} 0 {_n(h_pt)} cm\n" + "\n".join(self.ops) + "\nQ\n"
+        content_id = pdf.stream("", body.encode("latin-1"), compress=True)
+        xobjects = " ".join(f"/{name} {oid} 0 R" for name, oid in self.xobjects.items())
+        return pdf.obj(f"<< /Type /Page /Parent {parent_id} 0 R /MediaBox [0 0 {_n(w_pt)} {_n(h_pt)}] "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> /XObject << {xobjects} >> >> "
+                       f"/Contents {content_id} 0 R >>")
+
+
+def _circle_path(cx, cy, r):
+    k = _KAPPA * r
+    pts = [(cx + r, cy + k, cx + k, cy + r, cx, cy + r),
+           (cx - k, cy + r, cx - r, cy + k, cx - r, cy),
+           (cx - r, cy - k, cx - k, cy - r, cx, cy - r),
+           (cx + k, cy - r, cx + r, cy - k, cx + r, cy)]
+    return f"{_n(cx + r)} {_n(cy)} m " + " ".join(" ".join(_n(v) for v in p) + " c" for p in pts)
+
+
+# ──────────────────────────────
+# 🧩 Листы проекта
+# ──────────────────────────────
+class TileImages:
+    """
+    XObject'ы тайлов: каждый тайл пишется в PDF при первом использовании
+    и дальше только упоминается. Разрешение — исходное, но не больше
+    клетки shuffled-листа (растровый лист уменьшает тайл так же).
+    """
+
+    def __init__(self, pdf, img_tiles, cfg, tile_px):
+        self.pdf = pdf
+        self.img_tiles = img_tiles
+        self.letters = list(cfg.letters)
+        self.tile_px = tile_px
+        self.resample = RESAMPLE_FILTERS[resample_filter(cfg, "shuffled")]
+        self.ids = {}
+
+    def get(self, row, col):
+        """(имя ресурса, номер объекта) тайла."""
+        if (row, col) not in self.ids:
+            tile = self.img_tiles.tile_at(row, col)
+            if tile.width > self.tile_px:
+                tile = tile.resize((self.tile_px, self.tile_px), self.resample)
+            self.ids[(row, col)] = self.pdf.image(tile)
+        return f"T{row}_{col}", self.ids[(row, col)]
+
+    def by_coord(self, coord):
+        return self.get(self.letters.index(coord[0]), int(coord[1:]) - 1)
+
+
+def sheet_content(cfg, ctx, page, kind, tiles, font, img_tiles):
+    """Лист вида kind для страницы page — то же, что render_page_outputs рисует в растр."""
+    cfg = page_config(cfg, page)
+    matrix = page["matrix"]
+    rotation = page.get("rotation_matrix", [[0] * len(matrix[0]) for _ in matrix])
+    answers = kind == "answers"
+    layout = compute_layout(cfg, matrix, ctx.px_per_mm, cfg.answer_scale if answers else 1.0)
+    cell = layout["tile_px"]
+    n_cols = layout["tiles_per_row"]
+    fonts = ctx.fonts
+    content = SheetContent(font)
+
+    for r, row in enumerate(matrix):
+        for c, coord in enumerate(row):
+            if not coord or coord not in img_tiles:
+                continue
+            x, y = tile_position(layout, r, c)
+            angle = rotation[r][c] if kind != "shuffled" else 0
+            content.image(*tiles.by_coord(coord), x, y, cell, angle)
+
+            number = str(r * n_cols + c + 1)
+            cx, cy, circle_r, tx, ty, font_name = ctx.circle_geometry(number, cell, answers)
+            content.circle(x + cx, y + cy, circle_r, cfg.circle_fill, cfg.circle_outline,
+                           cfg.circle_outline_width)
+            content.text(number, x + tx, y + ty, fonts[font_name], cfg.circle_text_fill)
+
+            if answers:
+                ax, ay = position_in_cell(None, coord, x, y, cell, cell, fonts["answer"],
+                                          align_x=cfg.answer_align_x, align_y=cfg.answer_align_y,
+                                          margin_px=cfg.answer_margin_px,
+                                          bbox=ctx.text_bbox("answer", coord))
+                content.text(coord, ax, ay, fonts["answer"], cfg.answer_text_fill,
+                             cfg.answer_outline_fill if cfg.answer_outline else None,
+                             cfg.answer_outline_width)
+
+    # подпись над сеткой — как draw_sheet_label
+    label_font = "answer_label" if answers else "label"
+    suffix = "  с поворотом" if kind == "shuffled_rot" else ""
+    text = f"{cfg.project_name} - Лист {page['index']}{suffix}"
+    bbox = ctx.text_bbox(label_font, text)
+    sheet_w = sheet_size(cfg, ctx.px_per_mm, layout["scale"])[0]
+    content.text(text, (sheet_w - (bbox[2] - bbox[0])) // 2, (layout["label_area"] - (bbox[3] - bbox[1])) // 2,
+                 fonts[label_font], "black")
+    return content, sheet_size(cfg, ctx.px_per_mm, layout["scale"])
+
+
+def grid_content(cfg, tile_size, px_per_mm, tiles, font):
+    """Страница сетки — геометрия make_grid / draw_grid_overlay, тайлы — те же XObject'ы."""
+    label_area = int(cfg.label_area_mm * px_per_mm)
+    grid_w = tile_size * (cfg.cols + 1)
+    grid_h = tile_size * (cfg.rows + 1)
+    font_grid = load_font(cfg.font_path, int(tile_size * cfg.font_scale))
+    label_font = load_font(cfg.font_path, int(cfg.grid_label_font_mm * px_per_mm))
+    content = SheetContent(font)
+
+    for r in range(cfg.rows):
+        for c in range(cfg.cols):
+            content.image(*tiles.get(r, c), tile_size * (c + 1), label_area + tile_size * (r + 1), tile_size)
+
+    # ImageDraw.line шириной w закрашивает пиксели x - (w-1)//2 … x + w//2
+    shift = 1.0 if cfg.grid_line_width % 2 == 0 else 0.5
+    for c in range(cfg.cols + 1):
+        x = tile_size * (c + 1) + shift
+        content.line(x, tile_size + label_area, x, grid_h + label_area, cfg.grid_line_width, "black")
+    for r in range(cfg.rows + 1):
+        y = tile_size * (r + 1) + label_area + shift
+        content.line(tile_size, y, grid_w, y, cfg.grid_line_width, "black")
+
+    def centered(text, x0, y0):
+        bbox = font_grid.getbbox(text)
+        tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        content.text(text, x0 + (tile_size - tw) // 2 - bbox[0], y0 + (tile_size - th) // 2 - bbox[1],
+                     font_grid, "black")
+
+    for c in range(cfg.cols):
+        centered(str(c + 1), tile_size * (c + 1), label_area)
+    for r in range(cfg.rows):
+        centered(cfg.letters[r], 0, label_area + tile_size * (r + 1))
+
+    bbox = label_font.getbbox(cfg.project_name)
+    content.text(cfg.project_name, (grid_w - (bbox[2] - bbox[0])) // 2, (label_area - (bbox[3] - bbox[1])) // 2,
+                 label_font, "black")
+    return content, (grid_w, grid_h + label_area)
+
+
+def write_project_pdf(cfg, img_tiles, pages, px_per_mm, dpi, output_dir, grid_dpi=None):
+    """
+    Пишет sheets.pdf: страница сетки, затем для каждой страницы проекта
+    листы OUTPUT_KINDS по порядку. Возвращает (путь, {номер страницы: {вид: страница PDF}}).
+    """
+    ctx = get_render_context(cfg, px_per_mm)
+    font = SfntFont(cfg.font_path)
+    path = os.path.join(output_dir, PDF_NAME)
+    tile_px = int(cfg.shuffled_tile_mm * px_per_mm)
+    page_map = {}
+
+    with atomic_output(path) as tmp, open(tmp, "wb") as f:
+        pdf = PdfFile(f, cfg.png_compress_level)
+        catalog_id, parent_id, font_id = pdf.reserve(), pdf.reserve(), pdf.reserve()
+        tiles = TileImages(pdf, img_tiles, cfg, tile_px)
+        kids = []
+
+        content, size = grid_content(cfg, img_tiles.tile_size, px_per_mm, tiles, font)
+        kids.append(content.write(pdf, parent_id, font_id, size, grid_dpi or dpi))
+        for page in pages:
+            for kind in OUTPUT_KINDS:
+                content, size = sheet_content(cfg, ctx, page, kind, tiles, font, img_tiles)
+                kids.append(content.write(pdf, parent_id, font_id, size, dpi))
+                page_map.setdefault(page["index"], {})[kind] = len(kids)
+            print(f"📄 PDF: лист {page['index']} готов")
+
+        font.write(pdf, font_id)
+        pdf.obj(f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>", parent_id)
+        pdf.obj(f"<< /Type /Catalog /Pages {parent_id} 0 R >>", catalog_id)
+        pdf.close(catalog_id)
+
+    print(f"💾 PDF сохранён → {path} ({len(kids)} стр., тайлов встроено: {len(tiles.ids)})")
+    return path, page_map
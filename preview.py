@@ -0,0 +1,228 @@
+"""
+Живой предпросмотр листов при экранном DPI.
+
+    python preview.py --project demo            # http://127.0.0.1:8765
+    python preview.py --project demo --dpi 150 --port 9000
+
+Лист рендерится тем же render_page_outputs, что и в main.py, но из уменьшенной
+копии тайлов. Параметры в пикселях (обводки, отступы, толщина линий) заданы
+для печатного разрешения и масштабируются вместе с листом. config.json
+перечитывается при изменении — страница в браузере обновляется сама.
+"""
+import os
+import copy
+import json
+import time
+import argparse
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+from config import Config
+from main import load_project_image
+from tile_store import TileStore
+from tiles import split_tiles, load_random_state, generate_random_state
+from white_tiles import load_white_tiles
+from sheets import OUTPUT_KINDS, render_page_outputs, clear_render_contexts
+
+# параметры, заданные в пикселях печатного листа
+PX_PARAMS = ("answer_margin_px", "answer_outline_width", "circle_outline_width", "grid_line_width")
+
+
+def scale_px_params(cfg, factor):
+    """Копия конфига с пиксельными параметрами, пересчитанными под другой DPI."""
+    scaled = copy.copy(cfg)
+    for name in PX_PARAMS:
+        value = getattr(cfg, name)
+        if value:
+            setattr(scaled, name, max(1, round(value * factor)))
+    # предпросмотр кодируем быстро
+    scaled.output_format = "png"
+    scaled.png_compress_level = 1
+    return scaled
+
+
+class Preview:
+    """Состояние сервера: конфиг, уменьшенные тайлы, раскладка; всё перестраивается по mtime config.json."""
+
+    def __init__(self, project_name, dpi):
+        self.project_name = project_name
+        self.px_per_mm = dpi / 25.4
+        self.dpi = dpi
+        self.out_dir = tempfile.mkdtemp(prefix="quest_preview_")
+        self.lock = threading.Lock()
+        self.store = None
+        self.store_key = None
+        self.mtime = None
+        self.version = 0
+
+        self.img = None
+        self.image_key = None
+
+        self.cfg = Config().load(project_name)
+        # белые тайлы не меняются, пока жив сервер
+        self.whites = load_white_tiles(self.cfg)
+        self.reload()
+
+    def reload(self):
+        """Перечитывает config.json; раскладку строит заново, только если она изменилась."""
+        self.mtime = os.path.getmtime(self.cfg.config_file)
+        cfg = Config().load(self.project_name)
+        # контексты рендера (шрифты, штампы) ключуются конфигом — старые больше не понадобятся
+        clear_render_contexts()
+        if self.image_key != (cfg.cols, cfg.rows):
+            # размер тайла и авто-DPI зависят от сетки — исходник перечитывается
+            self.img, self.tile_size, _, self.export_dpi = load_project_image(cfg)
+            self.image_key = (cfg.cols, cfg.rows)
+        factor = self.px_per_mm / (self.export_dpi / 25.4)
+        self.cfg = scale_px_params(cfg, factor)
+
+        tile_px = max(8, int(cfg.shuffled_tile_mm * self.px_per_mm))
+        if self.store_key != (tile_px, cfg.cols, cfg.rows):
+            self._build_store(tile_px)
+        state = load_random_state(cfg)
+        if not state:
+            # раскладка в конфиге поменялась — новая только в памяти
+            state = generate_random_state(cfg, split_tiles(self.store, cfg, self.whites), save=False)
+        self.pages = list(state["pages"])
+        self.version += 1
+
+    def _build_store(self, tile_px):
+        """Тайлы, уменьшенные сразу до клетки листа: рендер берёт их без лишнего ресайза."""
+        cfg, t = self.cfg, self.tile_size
+        small = Image.new("RGBA" if "A" in self.img.mode else "RGB", (cfg.cols * tile_px, cfg.rows * tile_px))
+        for r in range(cfg.rows):
+            band = self.img.crop((0, r * t, cfg.cols * t, (r + 1) * t))
+            small.paste(band.resize((cfg.cols * tile_px, tile_px), Image.LANCZOS), (0, r * tile_px))
+        if self.store is not None:
+            self.store.close()
+        self.store = TileStore.from_image(small, tile_px, cfg, self.whites)
+        self.store_key = (tile_px, cfg.cols, cfg.rows)
+
+    def check_reload(self):
+        if os.path.getmtime(self.cfg.config_file) != self.mtime:
+            print("🔄 config.json изменился — перечитываю")
+            self.reload()
+
+    def render(self, page_idx, kind):
+        """PNG выбранного листа и время рендера в мс."""
+        with self.lock:
+            self.check_reload()
+            page = self.pages[max(1, min(page_idx, len(self.pages))) - 1]
+            t0 = time.perf_counter()
+            path = render_page_outputs(self.cfg, page, self.store, self.px_per_mm, self.dpi,
+                                       self.out_dir, (kind,))[kind]
+            ms = (time.perf_counter() - t0) * 1000
+            with open(path, "rb") as f:
+                return f.read(), ms
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+PAGE_HTML = """<!doctype html>
+<meta charset="utf-8">
+<title>Предпросмотр — {project}</title>
+<style>
+  body {{ font-family: sans-serif; margin: 12px; background: #ddd; }}
+  img {{ background: white; box-shadow: 0 0 6px #888; max-height: 90vh; }}
+  #info {{ color: #555; margin-left: 12px; }}
+</style>
+<div>
+  Лист <input id="page" type="number" min="1" max="{pages}" value="1" style="width:4em">
+  <select id="kind">{kinds}</select>
+  <span id="info"></span>
+</div>
+<p><img id="sheet"></p>
+<script>
+  let version = null;
+  function show() {{
+    const t0 = performance.now();
+    const img = document.getElementById("sheet");
+    img.onload = () => document.getElementById("info").textContent =
+        `${{Math.round(performance.now() - t0)}} мс`;
+    img.src = `/sheet?page=${{page.value}}&kind=${{kind.value}}&v=${{Date.now()}}`;
+  }}
+  async function poll() {{
+    try {{
+      const v = await (await fetch("/version")).json();
+      if (v.version !== version) {{ version = v.version; page.max = v.pages; show(); }}
+    }} catch (e) {{}}
+    setTimeout(poll, 500);
+  }}
+  page.onchange = kind.onchange = show;
+  poll();
+</script>
+"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    preview = None
+
+    def _send(self, code, body, content_type, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        pv = self.preview
+        try:
+            if url.path == "/":
+                kinds = "".join(f'<option value="{k}">{k}</option>' for k in OUTPUT_KINDS)
+                html = PAGE_HTML.format(project=pv.project_name, pages=len(pv.pages), kinds=kinds)
+                self._send(200, html.encode("utf-8"), "text/html; charset=utf-8")
+            elif url.path == "/version":
+                with pv.lock:
+                    pv.check_reload()
+                    body = json.dumps({"version": pv.version, "pages": len(pv.pages)})
+                self._send(200, body.encode("utf-8"), "application/json")
+            elif url.path == "/sheet":
+                kind = query.get("kind", ["shuffled"])[0]
+                if kind not in OUTPUT_KINDS:
+                    self._send(400, b"unknown kind", "text/plain")
+                    return
+                png, ms = pv.render(int(query.get("page", ["1"])[0]), kind)
+                self._send(200, png, "image/png", {"X-Render-Ms": f"{ms:.0f}"})
+            else:
+                self._send(404, b"not found", "text/plain")
+        except Exception as e:  # ошибка в конфиге не должна ронять сервер
+            self._send(500, f"{type(e).__name__}: {e}".encode("utf-8"), "text/plain; charset=utf-8")
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="👀 Живой предпросмотр листов")
+    parser.add_argument("--project", type=str, help="Имя проекта (папка в out/)")
+    parser.add_argument("--dpi", type=float, default=100, help="Разрешение предпросмотра")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    args = parser.parse_args()
+
+    project_name = args.project or Config.get_last_project() or input("Введите имя проекта: ").strip()
+    Handler.preview = preview = Preview(project_name, args.dpi)
+    server = HTTPServer((args.host, args.port), Handler)
+    print(f"👀 Предпросмотр: http://{args.host}:{args.port}  (Ctrl+C — выход)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        preview.close()
+
+
+if __name__ == "__main__":
+    main()
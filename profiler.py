@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import glob
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# папка трассировки передаётся воркерам через окружение — его наследуют и fork, и spawn
+PROFILE_ENV = "QUEST_PROFILE_DIR"
+
+_lock = threading.Lock()
+
+
+def enable(trace_dir):
+    """Включает замеры для этого процесса и всех дочерних."""
+    os.makedirs(trace_dir, exist_ok=True)
+    os.environ[PROFILE_ENV] = os.path.abspath(trace_dir)
+
+
+def enabled():
+    return bool(os.environ.get(PROFILE_ENV))
+
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса в МБ (None, если платформа не умеет)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+@contextmanager
+def stage(name, **args):
+    """
+    Замеряет этап: wall, CPU процесса, пиковый RSS. Внутри блока можно
+    дописать в запись байты: `with stage("save") as rec: ...; rec["bytes"] = n`.
+    Событие пишется в формате Chrome trace (ph="X") в trace_<pid>.jsonl.
+    """
+    rec = dict(args)
+    if not enabled():
+        yield rec
+        return
+
+    ts = time.time()
+    wall0 = time.perf_counter()
+    cpu0 = time.process_time()
+    try:
+        yield rec
+    finally:
+        rec["wall_s"] = round(time.perf_counter() - wall0, 6)
+        rec["cpu_s"] = round(time.process_time() - cpu0, 6)
+        rec["peak_rss_mb"] = peak_rss_mb()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": int(ts * 1e6),
+            "dur": int(rec["wall_s"] * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": rec,
+        }
+        path = os.path.join(os.environ[PROFILE_ENV], f"trace_{os.getpid()}.jsonl")
+        with _lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def collect():
+    """Все события всех процессов текущего запуска."""
+    events = []
+    for path in sorted(glob.glob(os.path.join(os.environ[PROFILE_ENV], "trace_*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    return sorted(events, key=lambda e: e["ts"])
+
+
+def summarize(events):
+    """Сводка по этапам: {name: {count, wall_s, cpu_s, peak_rss_mb, bytes}}."""
+    summary = {}
+    for e in events:
+        a = e["args"]
+        s = summary.setdefault(e["name"], {"count": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                           "peak_rss_mb": 0.0, "bytes": 0})
+        s["count"] += 1
+        s["wall_s"] += a.get("wall_s", 0.0)
+        s["cpu_s"] += a.get("cpu_s", 0.0)
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], a.get("peak_rss_mb") or 0.0)
+        s["bytes"] += a.get("bytes", 0)
+    return summary
+
+
+def print_summary(summary):
+    print("\n⏱️ Профиль по этапам:")
+    print(f"  {'этап':<24}{'раз':>5}{'wall, с':>10}{'CPU, с':>10}{'пик RSS, МБ':>13}{'записано, МБ':>14}")
+    for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["wall_s"]):
+        print(f"  {name:<24}{s['count']:>5}{s['wall_s']:>10.2f}{s['cpu_s']:>10.2f}"
+              f"{s['peak_rss_mb']:>13.1f}{s['bytes'] / 2**20:>14.1f}")
+
+
+def finish(trace_path):
+    """Собирает события в один Chrome trace (chrome://tracing, Perfetto) и печатает сводку."""
+    if not enabled():
+        return None
+    events = collect()
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    for path in glob.glob(os.path.join(os.environ[PROFILE_ENV], "trace_*.jsonl")):
+        os.remove(path)
+    if not os.listdir(os.environ[PROFILE_ENV]):
+        os.rmdir(os.environ[PROFILE_ENV])
+
+    summary = summarize(events)
+    print_summary(summary)
+    print(f"💾 Трасса сохранена → {trace_path}")
+    return summary
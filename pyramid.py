@@ -0,0 +1,94 @@
+import os
+import math
+
+from PIL import Image
+
+from io_helpers import atomic_output
+from render_cache import source_key
+
+# сторона самого подробного уровня, который держим в кэше и в памяти
+PYRAMID_MAX_SIDE = 4096
+# самый грубый уровень — не меньше этого
+PYRAMID_MIN_SIDE = 256
+# сколько пикселей исходника (полоса во всю ширину) можно читать ради одного кадра
+SOURCE_READ_PIXELS = 64_000_000
+
+
+class ImagePyramid:
+    """
+    Mipmap-пирамида исходника для GUI: уровень k — изображение, уменьшенное
+    в 2**k раз. Первый уровень строится одним проходом по исходнику полосами
+    (LazyImage.resize), следующие — уполовиниванием предыдущего. Уровни
+    кэшируются в out/<project>/.cache/pyramid/<ключ>/, повторный запуск GUI
+    только открывает PNG.
+
+    view() отдаёт видимую область нужного размера с уровня, который ближе
+    всего к экранному масштабу; при сильном приближении читает исходник.
+    """
+
+    def __init__(self, img, cache_dir):
+        self.img = img
+        self.size = img.size
+        longest = max(img.size)
+        self.first = math.ceil(math.log2(longest / PYRAMID_MAX_SIDE)) if longest > PYRAMID_MAX_SIDE else 0
+        self.last = self.first
+        while max(self._level_size(self.last)) > PYRAMID_MIN_SIDE:
+            self.last += 1
+        self.cache_dir = os.path.join(cache_dir, source_key(img))
+        self.levels = self._load() or self._build()
+
+    def _level_size(self, k):
+        w, h = self.size
+        return -(-w // 2 ** k), -(-h // 2 ** k)
+
+    def _level_path(self, k):
+        return os.path.join(self.cache_dir, f"level_{k}.png")
+
+    def _load(self):
+        paths = {k: self._level_path(k) for k in range(self.first, self.last + 1)}
+        if not all(os.path.exists(p) for p in paths.values()):
+            return None
+        levels = {}
+        for k, path in paths.items():
+            with Image.open(path) as im:
+                im.load()
+                levels[k] = im.copy()
+        print(f"📖 Пирамида изображения загружена из кэша ({len(levels)} уровней)")
+        return levels
+
+    def _build(self):
+        print(f"🏗️ Строю пирамиду изображения ({self.last - self.first + 1} уровней)...")
+        if self.first == 0:
+            top = self.img.load()
+        else:
+            top = self.img.resize(self._level_size(self.first), Image.BOX)
+        levels = {self.first: top}
+        for k in range(self.first + 1, self.last + 1):
+            levels[k] = levels[k - 1].reduce(2)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for k, level in levels.items():
+            with atomic_output(self._level_path(k)) as tmp:
+                level.save(tmp, format="PNG", compress_level=1)
+        print(f"💾 Пирамида сохранена → {self.cache_dir}")
+        return levels
+
+    def view(self, box, out_size):
+        """
+        Область box (в пикселях исходника) размером out_size для экрана.
+        Берётся самый грубый уровень, ещё не мельче экрана.
+        """
+        x0, y0, x1, y1 = box
+        ow, oh = out_size
+        factor = (x1 - x0) / ow                     # пикселей исходника на экранный пиксель
+        k = int(math.floor(math.log2(factor))) if factor >= 1 else 0
+        if k < self.first and (y1 - y0) * self.size[0] <= SOURCE_READ_PIXELS:
+            region = self.img.crop((math.floor(x0), math.floor(y0), math.ceil(x1), math.ceil(y1)))
+            return region.resize(out_size, Image.NEAREST if factor < 1 else Image.BILINEAR,
+                                 box=(x0 - math.floor(x0), y0 - math.floor(y0),
+                                      x1 - math.floor(x0), y1 - math.floor(y0)))
+        k = min(max(k, self.first), self.last)
+        f = 2 ** k
+        level = self.levels[k]
+        return level.resize(out_size, Image.NEAREST if factor < f else Image.BILINEAR,
+                            box=(x0 / f, y0 / f, min(x1 / f, level.width), min(y1 / f, level.height)))
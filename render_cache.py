@@ -0,0 +1,277 @@
+import os
+import json
+import struct
+import shutil
+import hashlib
+
+from PIL import Image
+
+from io_helpers import save_json_atomic, atomic_output
+
+
+# ──────────────────────────────
+# 🔑 Дайджесты файлов
+# ──────────────────────────────
+def file_state(path):
+    """«путь|размер|mtime» — дешёвый признак того, что файл не менялся."""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def source_key(img, *extra):
+    """
+    Короткий ключ кэша производных исходника (пирамида GUI, статистика
+    тайлов): состояние файла img.path, геометрия изображения после обрезки
+    под тайлы и extra — всё, от чего ещё зависит результат.
+    """
+    raw = "|".join([file_state(img.path), f"{img.width}x{img.height}", *map(str, extra)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def file_digest(path, memo_file=None):
+    """
+    sha256 файла. Если задан memo_file, результат запоминается по
+    (путь, размер, mtime), чтобы многогигабайтный исходник не перечитывать
+    при каждом запуске.
+    """
+    memo_key = file_state(path)
+
+    memo = {}
+    if memo_file and os.path.exists(memo_file):
+        with open(memo_file, "r", encoding="utf-8") as f:
+            memo = json.load(f)
+        if memo_key in memo:
+            return memo[memo_key]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    if memo_file:
+        memo[memo_key] = digest
+        os.makedirs(os.path.dirname(memo_file), exist_ok=True)
+        save_json_atomic(memo, memo_file)
+    return digest
+
+
+def input_digests(cfg):
+    """Дайджесты исходника и шрифта проекта (шрифта может не быть — None)."""
+    memo_file = os.path.join(cfg.project_dir, ".cache", "digests.json")
+    font = file_digest(cfg.font_path, memo_file) if os.path.exists(cfg.font_path) else None
+    return {"source": file_digest(cfg.input_file, memo_file), "font": font}
+
+
+def copy_file(src, dst):
+    """
+    Копия src в dst через временный файл. Именно копия, а не жёсткая ссылка:
+    испорченный или поправленный руками лист в одной папке запуска не должен
+    портить кэш и другие запуски.
+    """
+    with atomic_output(dst) as tmp:
+        shutil.copyfile(src, tmp)
+
+
+def trim_lru(cache_dir, max_bytes, suffixes):
+    """
+    Удаляет самые давно читанные записи кэша (LRU по mtime: попадание
+    обновляет mtime), пока cache_dir не уложится в max_bytes. Запись — файлы
+    с одним именем до точки и расширением из suffixes (лист и его .json).
+    """
+    groups = {}
+    for entry in os.scandir(cache_dir):
+        if os.path.splitext(entry.name)[1] not in suffixes:
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        group = groups.setdefault(entry.name.split(".")[0], [0, 0, []])
+        group[0] = max(group[0], st.st_mtime_ns)
+        group[1] += st.st_size
+        group[2].append(entry.path)
+    total = sum(size for _, size, _ in groups.values())
+    if total <= max_bytes:
+        return
+    for _, size, paths in sorted(groups.values(), key=lambda g: g[0]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        if total <= max_bytes:
+            break
+
+
+# ──────────────────────────────
+# ♻️ Кэш готовых листов
+# ──────────────────────────────
+class RenderCache:
+    """
+    Контентно-адресуемый кэш листов в out/<project>/.cache/sheets/.
+
+    Ключ листа — sha256 от (матрица страницы, матрица поворотов, формат листа,
+    вид листа, влияющие на этот вид листа поля конфига, дайджест исходника,
+    дайджест шрифта, px_per_mm, dpi). Если ключ уже есть в кэше, лист не рендерится, а
+    копируется в папку вывода.
+
+    Размер ограничен cfg.sheet_cache_mb, вытесняются давно не читанные листы
+    (как в TileCache): лишнее удаляется при создании кэша и по ходу записи.
+    """
+    SUFFIXES = (".png", ".tif", ".jpg", ".json")
+
+    def __init__(self, cfg, px_per_mm, dpi):
+        self.cache_dir = os.path.join(cfg.project_dir, ".cache", "sheets")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = int(cfg.sheet_cache_mb * 2**20)
+        self._written = 0
+        self.trim()
+
+        digests = input_digests(cfg)
+        self.fingerprints = {kind: cfg.render_fingerprint(kind)
+                             for kind in ("grid", "shuffled", "shuffled_rot", "answers")}
+        self.tiles = TileCache(os.path.join(cfg.project_dir, ".cache", "tiles"), digests["source"],
+                               cfg.tile_cache_mb)
+        self.base = {
+            **digests,
+            "px_per_mm": round(px_per_mm, 6),
+            "dpi": round(dpi, 6),
+        }
+
+    def key(self, kind, page=None):
+        """Ключ листа вида kind (для сетки page=None)."""
+        payload = dict(self.base, kind=kind, config=self.fingerprints[kind])
+        if page is not None:
+            payload.update(index=page["index"],
+                           matrix=page["matrix"],
+                           rotation_matrix=page.get("rotation_matrix"))
+            if page.get("sheet"):
+                payload["sheet"] = page["sheet"]
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(blob).hexdigest()
+
+    def _path(self, key, filename):
+        return os.path.join(self.cache_dir, f"{key}{os.path.splitext(filename)[1]}")
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def has(self, key, filename):
+        """Есть ли в кэше лист с этим ключом (filename — имя файла листа, ради расширения)."""
+        return os.path.exists(self._path(key, filename)) and os.path.exists(self._meta_path(key))
+
+    def _intact(self, key, cached):
+        """Лист в кэше совпадает по размеру и sha256 с тем, что записал store."""
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if os.path.getsize(cached) != meta.get("bytes"):
+            return False
+        return file_digest(cached) == meta.get("sha256")
+
+    def fetch(self, key, out_path):
+        """
+        Кладёт лист из кэша в out_path. Возвращает True при попадании.
+        Запись, не прошедшая проверку размера и sha256, удаляется — лист
+        рендерится заново.
+        """
+        cached = self._path(key, out_path)
+        if not os.path.exists(cached):
+            return False
+        if not self._intact(key, cached):
+            print(f"⚠️ {os.path.basename(out_path)}: лист в кэше повреждён — рендерится заново")
+            self.drop(key, out_path)
+            return False
+        copy_file(cached, out_path)
+        for path in (cached, self._meta_path(key)):
+            os.utime(path)
+        return True
+
+    def store(self, key, out_path):
+        """Запоминает только что отрендеренный лист вместе с его размером и sha256."""
+        cached = self._path(key, out_path)
+        copy_file(out_path, cached)
+        size = os.path.getsize(cached)
+        save_json_atomic({"bytes": size, "sha256": file_digest(cached)}, self._meta_path(key))
+        self._written += size
+        if self._written > self.max_bytes // 16:
+            self.trim()
+
+    def trim(self):
+        """Удаляет самые давно читанные листы, пока кэш не уложится в max_bytes."""
+        self._written = 0
+        trim_lru(self.cache_dir, self.max_bytes, self.SUFFIXES)
+
+    def drop(self, key, filename):
+        """Убирает лист из кэша (filename — имя файла листа, ради расширения)."""
+        for path in (self._path(key, filename), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# ──────────────────────────────
+# 🗜️ Кэш уменьшенных тайлов
+# ──────────────────────────────
+TILE_HEADER = struct.Struct("<4sII")
+
+
+class TileCache:
+    """
+    Уменьшенные (и повёрнутые) тайлы в out/<project>/.cache/tiles/ — сырые
+    пиксели с коротким заголовком, чтобы чтение не стоило декодирования.
+
+    Ключ — sha256 от (дайджест исходника, размер тайла в исходнике,
+    координата, размер в пикселях, фильтр, угол). Нужен, когда лист целиком
+    в RenderCache не нашёлся (поменялись цвета, подписи, формат вывода):
+    тайлы тогда не пересчитываются из исходника.
+
+    Размер ограничен max_mb, вытесняются давно не читанные (LRU по mtime:
+    попадание обновляет mtime файла). Лишнее удаляется при создании кэша
+    и по ходу записи — каждый воркер следит за тем, что записал сам.
+    """
+
+    def __init__(self, cache_dir, source_digest, max_mb):
+        self.cache_dir = cache_dir
+        self.source_digest = source_digest
+        self.max_bytes = int(max_mb * 2**20)
+        self._written = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.trim()
+
+    def key(self, tile_size, coord, px, resample, angle=0):
+        raw = f"{self.source_digest}|{tile_size}|{coord}|{px}|{resample}|{angle}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.tile")
+
+    def get(self, key):
+        """Тайл из кэша или None. Файл, удалённый соседним процессом, — просто промах."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        mode, w, h = TILE_HEADER.unpack_from(data)
+        return Image.frombytes(mode.decode("ascii").strip(), (w, h), data[TILE_HEADER.size:])
+
+    def put(self, key, tile):
+        data = TILE_HEADER.pack(tile.mode.ljust(4).encode("ascii"), *tile.size) + tile.tobytes()
+        with atomic_output(self._path(key)) as tmp, open(tmp, "wb") as f:
+            f.write(data)
+        self._written += len(data)
+        if self._written > self.max_bytes // 16:
+            self.trim()
+
+    def trim(self):
+        """Удаляет самые давно читанные тайлы, пока кэш не уложится в max_bytes."""
+        self._written = 0
+        trim_lru(self.cache_dir, self.max_bytes, (".tile",))
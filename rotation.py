@@ -0,0 +1,82 @@
+"""
+Повороты тайлов на листах.
+
+Прямые углы (90/180/270 — всё, что даёт generate_random_state по умолчанию)
+делаются Image.transpose: перестановка пикселей без интерполяции, размер
+клетки сохраняется. Произвольные углы из rotate_tiles — одно аффинное
+преобразование, которое сразу вписывает повёрнутый квадрат в клетку
+(вместо rotate(expand=True) и отдельного resize обратно). Поворачивается
+уже уменьшенный тайл, так что повёрнутый лист стоит почти столько же,
+сколько прямой.
+"""
+import math
+
+from PIL import Image
+
+TRANSPOSE = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+# фильтр для непрямых углов: повёрнутый тайл ужимается не больше чем в √2 раз
+AFFINE_RESAMPLE = Image.Resampling.BILINEAR
+
+
+def normalize_angle(angle):
+    """Угол в [0, 360); целые — int, чтобы 90.0 и -270 попадали в TRANSPOSE."""
+    angle = angle % 360
+    return int(angle) if float(angle).is_integer() else angle
+
+
+def is_right_angle(angle):
+    return normalize_angle(angle) in (0, 90, 180, 270)
+
+
+def rotation_cos_sin(angle):
+    """cos и sin угла; для прямых углов — точные 0/±1 (без 6e-17 в матрицах PDF)."""
+    angle = normalize_angle(angle)
+    exact = {0: (1, 0), 90: (0, 1), 180: (-1, 0), 270: (0, -1)}
+    if angle in exact:
+        return exact[angle]
+    a = math.radians(angle)
+    return math.cos(a), math.sin(a)
+
+
+def fit_scale(angle):
+    """Во сколько раз уменьшается повёрнутый квадрат, чтобы вписаться в свою клетку."""
+    cos, sin = rotation_cos_sin(angle)
+    return abs(cos) + abs(sin)
+
+
+def rotate_tile(tile, angle, size=None):
+    """
+    Квадратный тайл, повёрнутый на angle градусов против часовой (как
+    Image.rotate) и вписанный в клетку size × size (по умолчанию — его размер).
+    При непрямом угле результат всегда RGBA: углы клетки вне тайла прозрачные,
+    и лист под ними остаётся белым (вставлять с маской, см. paste_tile).
+    """
+    size = size or tile.width
+    angle = normalize_angle(angle)
+    if angle in TRANSPOSE or angle == 0:
+        rotated = tile.transpose(TRANSPOSE[angle]) if angle else tile
+        return rotated if rotated.size == (size, size) else rotated.resize((size, size))
+
+    if tile.mode != "RGBA":
+        tile = tile.convert("RGBA")
+    # обратное отображение: пиксель клетки → точка исходного тайла
+    cos, sin = rotation_cos_sin(angle)
+    k = fit_scale(angle) * tile.width / size
+    half_out, half_in = size / 2, tile.width / 2
+    a, b = cos * k, -sin * k
+    d, e = sin * k, cos * k
+    c = half_in - a * half_out - b * half_out
+    f = half_in - d * half_out - e * half_out
+    return tile.transform((size, size), Image.Transform.AFFINE, (a, b, c, d, e, f), AFFINE_RESAMPLE)
+
+
+def paste_tile(canvas, tile, xy, angle=0):
+    """Вставляет тайл в клетку; повёрнутый на непрямой угол — по своей альфе, поверх фона листа."""
+    if is_right_angle(angle):
+        canvas.paste(tile, xy)
+    else:
+        canvas.paste(tile, xy, tile)
@@ -0,0 +1,156 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# память самого воркера (интерпретатор, Pillow, шрифты) без холстов, МБ
+WORKER_BASE_MB = 120
+# сколько памяти оставить системе и главному процессу, МБ
+RESERVE_MB = 512
+
+
+class WorkUnit:
+    """
+    Единица работы для общего пула: функция верхнего уровня + аргументы.
+    cost — относительная оценка времени (крупные задачи запускаются первыми),
+    mem_mb — оценка пиковой памяти воркера на этой задаче,
+    after — задачи, которые должны завершиться до запуска этой (склейка полос).
+    """
+
+    def __init__(self, name, fn, args=(), cost=1.0, mem_mb=0.0, after=()):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.cost = cost
+        self.mem_mb = mem_mb
+        self.after = tuple(after)
+
+    def __repr__(self):
+        return f"WorkUnit({self.name!r}, cost={self.cost:.0f}, mem_mb={self.mem_mb:.0f})"
+
+
+def available_memory_mb():
+    """Доступная память системы в МБ (None, если узнать нельзя)."""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def worker_count(units, threads=None, budget_mb=None):
+    """
+    Сколько процессов запускать: по числу ядер (или threads, если задано),
+    но не больше задач и не больше, чем влезает в память. Без бюджета —
+    по доступной памяти системы при самой тяжёлой задаче на каждом воркере;
+    с бюджетом (--max-memory) — чтобы в него влезали сами воркеры и самая
+    лёгкая задача, а тяжёлые придерживает run_units.
+    """
+    n = threads or os.cpu_count() or 1
+    n = min(n, max(1, len(units)))
+    if budget_mb is not None:
+        lightest = min((u.mem_mb for u in units), default=0.0) + WORKER_BASE_MB
+        return max(1, min(n, int(budget_mb // lightest)))
+    heaviest = max((u.mem_mb for u in units), default=0.0) + WORKER_BASE_MB
+    avail = available_memory_mb()
+    if avail is not None:
+        n = min(n, max(1, int((avail - RESERVE_MB) // heaviest)))
+    return max(1, n)
+
+
+def run_units(units, workers, budget_mb=None, pool=None, on_error=None):
+    """
+    Выполняет задачи в одном пуле процессов. Порядок запуска — от самых
+    дорогих к дешёвым (LPT), чтобы в конце не оставалось одной длинной
+    задачи на простаивающих ядрах. С бюджетом памяти задача запускается,
+    только если вместе с уже идущими укладывается в budget_mb; иначе вперёд
+    пропускаются более лёгкие. Задача, которая не влезает даже одна,
+    идёт в одиночку. pool — уже запущенный пул (batch.py держит один на все
+    проекты); без него пул создаётся на время вызова.
+    Отдаёт (unit, результат) по готовности. Задача с after ждёт, пока
+    готовы все её предшественники; если кто-то из них упал, падает и она.
+
+    on_error(unit, exc) — не останавливаться на упавших задачах, а сообщать
+    о них и продолжать. Если воркер убит (чаще всего OOM), пул ломается целиком:
+    свой пул пересоздаётся, а задачи, шедшие в тот момент, повторяются один раз
+    и по одной, чтобы упала только виноватая. Чужой сломанный пул — ошибка
+    вызывающему.
+    """
+    own = pool is None
+    if own:
+        pool = ProcessPoolExecutor(max_workers=workers)
+
+    pending = sorted(units, key=lambda u: u.cost, reverse=True)
+    limit = None if budget_mb is None else budget_mb - workers * WORKER_BASE_MB
+    running, retried = {}, set()
+    finished, failed = set(), set()
+    try:
+        while pending or running:
+            used = sum(u.mem_mb for u in running.values())
+            for unit in list(pending):
+                if any(id(u) in failed for u in unit.after):
+                    pending.remove(unit)
+                    failed.add(id(unit))
+                    on_error(unit, RuntimeError("не выполнены задачи, от которых она зависит"))
+                    continue
+                if len(running) >= workers:
+                    break
+                if any(id(u) not in finished for u in unit.after):
+                    continue
+                # повтор после гибели пула идёт в одиночку: так ясно, кто виноват
+                if any(id(u) in retried for u in running.values()):
+                    break
+                if running and id(unit) in retried:
+                    continue
+                if running and limit is not None and used + unit.mem_mb > limit:
+                    continue
+                pending.remove(unit)
+                running[pool.submit(unit.fn, *unit.args)] = unit
+                used += unit.mem_mb
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                unit = running.pop(fut)
+                try:
+                    result = fut.result()
+                except BrokenProcessPool as e:
+                    if on_error is None or not own:
+                        raise
+                    # пул мёртв: дожидаемся остальных и начинаем заново с потерянными
+                    wait(running)
+                    lost = [unit]
+                    for other_fut, other in running.items():
+                        if other_fut.exception() is None:
+                            finished.add(id(other))
+                            yield other, other_fut.result()
+                        else:
+                            lost.append(other)
+                    for other in lost:
+                        if id(other) in retried:
+                            failed.add(id(other))
+                            on_error(other, e)
+                        else:
+                            retried.add(id(other))
+                            pending.append(other)
+                    pending.sort(key=lambda u: u.cost, reverse=True)
+                    running = {}
+                    pool.shutdown(wait=True)
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                    break
+                except Exception as e:
+                    if on_error is None:
+                        # остальные запущенные задачи дорабатывают: пул может быть общим
+                        wait(running)
+                        raise
+                    failed.add(id(unit))
+                    on_error(unit, e)
+                    continue
+                finished.add(id(unit))
+                yield unit, result
+    finally:
+        if own:
+            pool.shutdown(wait=True)
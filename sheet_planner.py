@@ -0,0 +1,115 @@
+"""
+Планировщик форматов листов для random_state.
+
+Без sheet_formats в конфиге все страницы — sheet_w_mm × sheet_h_mm, как
+раньше. Со списком форматов (["A4", "A3"] или [[210, 297], [297, 420]])
+каждый пробуется в книжной и альбомной ориентации; выбирается план
+с наименьшим числом листов, а при равенстве — с наименьшей площадью бумаги.
+Последняя страница, на которую обычно остаётся несколько тайлов, печатается
+на самом маленьком формате, куда они помещаются.
+
+Формат страницы записывается в random_state (page["sheet"]), рендер его
+только читает.
+"""
+import math
+from collections import Counter
+
+# стандартные форматы, мм (книжная ориентация)
+PAPER_SIZES = {
+    "A5": (148, 210),
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "A2": (420, 594),
+    "A1": (594, 841),
+    "A0": (841, 1189),
+    "LETTER": (216, 279),
+    "LEGAL": (216, 356),
+    "TABLOID": (279, 432),
+}
+
+
+def sheet_capacity(cfg, sheet=None):
+    """
+    Сколько тайлов помещается на лист: (tiles_per_row, tiles_per_col) при
+    sheet_export_dpi. sheet — (w_mm, h_mm), по умолчанию лист из конфига.
+    """
+    w_mm, h_mm = sheet or (cfg.sheet_w_mm, cfg.sheet_h_mm)
+    px_per_mm = cfg.sheet_export_dpi / 25.4
+    shuffled_tile_px = int(cfg.shuffled_tile_mm * px_per_mm)
+    gap_px = int(cfg.gap_mm * px_per_mm)
+    margin_px = int(cfg.margin_mm * px_per_mm)
+    sheet_w_px = int(w_mm * px_per_mm)
+    sheet_h_px = int(h_mm * px_per_mm)
+
+    tiles_per_row = (sheet_w_px - 2 * margin_px + gap_px) // (shuffled_tile_px + gap_px)
+    tiles_per_col = (sheet_h_px - 2 * margin_px + gap_px) // (shuffled_tile_px + gap_px)
+    return tiles_per_row, tiles_per_col
+
+
+def parse_format(fmt):
+    """«A4» (без учёта регистра) или [w, h] в мм → (w, h)."""
+    if isinstance(fmt, str):
+        size = PAPER_SIZES.get(fmt.strip().upper())
+        if size is None:
+            raise ValueError(f"неизвестный формат листа {fmt!r}, известны: {', '.join(PAPER_SIZES)}")
+        return size
+    w, h = fmt
+    return w, h
+
+
+def format_name(sheet):
+    """(297, 210) → «A4 альбомная», нестандартный — «250×350 мм»."""
+    w, h = sheet
+    portrait = (min(w, h), max(w, h))
+    name = next((n for n, size in PAPER_SIZES.items() if size == portrait), None)
+    if name is None:
+        return f"{w}×{h} мм"
+    return f"{name} {'альбомная' if w > h else 'книжная'}"
+
+
+def candidate_sheets(cfg):
+    """Форматы из sheet_formats в обеих ориентациях: [(sheet, tiles_per_row, tiles_per_col), ...]."""
+    seen, candidates = set(), []
+    for fmt in cfg.sheet_formats:
+        w, h = parse_format(fmt)
+        for sheet in ((w, h), (h, w)):
+            if sheet in seen:
+                continue
+            seen.add(sheet)
+            tpr, tpc = sheet_capacity(cfg, sheet)
+            if tpr > 0 and tpc > 0:
+                candidates.append((sheet, tpr, tpc))
+    if not candidates:
+        raise ValueError("ни на один формат из sheet_formats не помещается ни одного тайла")
+    return candidates
+
+
+def plan_sheets(cfg, n_tiles):
+    """
+    Формат каждой страницы для n_tiles тайлов: [(sheet, tiles_per_row, tiles_per_col), ...].
+    sheet=None — лист из конфига (sheet_formats не задан).
+    """
+    if not n_tiles:
+        return []
+    if not cfg.sheet_formats:
+        tpr, tpc = sheet_capacity(cfg)
+        return [(None, tpr, tpc)] * math.ceil(n_tiles / (tpr * tpc))
+
+    candidates = candidate_sheets(cfg)
+    best = None
+    for primary in candidates:
+        capacity = primary[1] * primary[2]
+        n_pages = math.ceil(n_tiles / capacity)
+        rest = n_tiles - (n_pages - 1) * capacity
+        # на последнюю страницу — самый маленький лист, куда помещается остаток
+        last = min((c for c in candidates if c[1] * c[2] >= rest), key=lambda c: c[0][0] * c[0][1])
+        area = (n_pages - 1) * primary[0][0] * primary[0][1] + last[0][0] * last[0][1]
+        if best is None or (n_pages, area) < best[:2]:
+            best = (n_pages, area, [primary] * (n_pages - 1) + [last])
+
+    n_pages, area, plan = best
+    used = n_tiles * cfg.shuffled_tile_mm ** 2
+    counts = Counter(plan)
+    summary = " + ".join(f"{n} × {format_name(sheet)} ({tpr}×{tpc})" for (sheet, tpr, tpc), n in counts.items())
+    print(f"📐 План листов: {summary}; под тайлами {used / area:.0%} бумаги")
+    return plan
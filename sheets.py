@@ -1,19 +1,38 @@
 import time as timemod  # ← важно: переименовали, чтобы избежать конфликта с datetime.time
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+from concurrent.futures import Future
 from PIL import Image, ImageDraw, ImageFont
-from utils import center_in_cell, draw_text_with_outline
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import center_in_cell, draw_text_with_outline, clear_outline_cache
+from writer import get_writer, output_extension, stream_mode, save_image
+from stream_writer import open_stream_writer, write_band_part, read_band_part, join_band_parts
+from rotation import rotate_tile, paste_tile
+from profiler import stage
+from scheduler import WorkUnit, run_units, worker_count
 
 # ──────────────────────────────
 # 🔤 Подготовка шрифтов
 # ──────────────────────────────
-def prepare_fonts(cfg, px_per_mm):
-    def load(size_px):
+_fonts = {}
+
+
+def load_font(font_path, size_px):
+    """
+    ImageFont.truetype с кэшем на процесс: воркер, собирающий листы
+    нескольких проектов подряд (batch.py), не перечитывает один и тот же OTF.
+    """
+    key = (font_path, int(size_px))
+    if key not in _fonts:
         try:
-            return ImageFont.truetype(cfg.font_path, int(size_px))
+            _fonts[key] = ImageFont.truetype(font_path, int(size_px))
         except OSError:
-            return ImageFont.load_default()
+            _fonts[key] = ImageFont.load_default()
+    return _fonts[key]
+
+
+def prepare_fonts(cfg, px_per_mm):
+    def load(size_px):
+        return load_font(cfg.font_path, size_px)
 
     # базовый размер клетки (в пикселях для answer-листа)
     tile_px = cfg.shuffled_tile_mm * px_per_mm * cfg.answer_scale
@@ -36,178 +55,467 @@ def prepare_fonts(cfg, px_per_mm):
 # ──────────────────────────────
 # 🧱 Создание пустых листов
 # ──────────────────────────────
-def create_blank_sheet(cfg, px_per_mm, scale=1.0):
+def sheet_size(cfg, px_per_mm, scale=1.0):
+    """Размер листа в пикселях вместе с полосой подписи."""
     w = int(cfg.sheet_w_mm * px_per_mm * scale)
     h = int(cfg.sheet_h_mm * px_per_mm * scale)
     label_area = int(cfg.label_area_mm * px_per_mm * scale)
-    return Image.new("RGBA", (w, h + label_area), (255, 255, 255, 255)), label_area
+    return w, h + label_area
+
+
+def create_blank_sheet(cfg, px_per_mm, scale=1.0):
+    label_area = int(cfg.label_area_mm * px_per_mm * scale)
+    return Image.new("RGBA", sheet_size(cfg, px_per_mm, scale), (255, 255, 255, 255)), label_area
 
 
 # ──────────────────────────────
-# 🎨 Отрисовка одного тайла на shuffled-листе
+# 🧰 Контекст рендера процесса
 # ──────────────────────────────
-def draw_tile_on_sheet(cfg, draw, tile_number, base_x, base_y, tile_px, px_per_mm, font_circle,
-                       scale=1.0, circle_scale=1.0):
-    """Рисует кружок с номером в правом верхнем углу тайла (универсально для shuffled и answers)."""
-    circle_r = int((cfg.circle_diametr_mm / 2) * px_per_mm * scale * circle_scale)
-    cx = base_x + tile_px - circle_r - 4
-    cy = base_y + circle_r + 4
-
-    # белый кружок
-    draw.ellipse(
-        (cx - circle_r, cy - circle_r, cx + circle_r, cy + circle_r),
-        fill=cfg.circle_fill,
-        outline=cfg.circle_outline,
-        width=cfg.circle_outline_width
-    )
+class CircleStamp:
+    """
+    Заранее растеризованный кружок с номером: маски заливки, обводки и цифр.
+    Накладывается через draw.bitmap — тот же путь, которым Pillow рисует
+    ellipse/text, поэтому результат совпадает с прямой отрисовкой кружка
+    в геометрии RenderContext.circle_geometry.
+    """
 
-    # текст с корректировкой bbox[1]
-    bbox = draw.textbbox((0, 0), tile_number, font=font_circle)
-    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    tx = cx - tw // 2
-    ty = cy - th // 2 - bbox[1]
-    draw.text((tx, ty), tile_number, font=font_circle, fill=cfg.circle_text_fill)
+    def __init__(self, layers, dx, dy):
+        self.layers = layers   # [(mask "L", цвет)]
+        self.dx, self.dy = dx, dy
+
+    def apply(self, draw, base_x, base_y):
+        for mask, fill in self.layers:
+            draw.bitmap((base_x + self.dx, base_y + self.dy), mask, fill=fill)
+
+
+class RenderContext:
+    """
+    То, что не зависит от страницы и строится один раз на процесс:
+    шрифты, размеры надписей (номера тайлов, координаты) и штампы кружков.
+    """
+
+    def __init__(self, cfg, px_per_mm):
+        self.cfg = cfg
+        self.px_per_mm = px_per_mm
+        self.fonts = prepare_fonts(cfg, px_per_mm)
+        self._bboxes = {}
+        self._stamps = {}
+        self._measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+    def text_bbox(self, font_name, text):
+        """draw.textbbox((0, 0), text) с запоминанием."""
+        key = (font_name, text)
+        if key not in self._bboxes:
+            self._bboxes[key] = self._measure.textbbox((0, 0), text, font=self.fonts[font_name])
+        return self._bboxes[key]
+
+    def circle_stamp(self, number, tile_px, answers=False):
+        """Штамп кружка с номером для клетки tile_px (shuffled или answers)."""
+        key = (number, tile_px, answers)
+        if key not in self._stamps:
+            self._stamps[key] = self._build_stamp(number, tile_px, answers)
+        return self._stamps[key]
+
+    def circle_geometry(self, number, tile_px, answers=False):
+        """
+        Кружок с номером в правом верхнем углу клетки (shuffled или answers),
+        координаты относительно угла клетки: (cx, cy, circle_r, tx, ty,
+        font_name), (tx, ty) — точка draw.text с поправкой на bbox[1].
+        """
+        cfg = self.cfg
+        scale = cfg.answer_scale if answers else 1.0
+        circle_scale = cfg.answers_circle_scale if answers else 1.0
+        font_name = "circle_answer" if answers else "circle"
+
+        circle_r = int((cfg.circle_diametr_mm / 2) * self.px_per_mm * scale * circle_scale)
+        cx = tile_px - circle_r - 4
+        cy = circle_r + 4
+        bbox = self.text_bbox(font_name, number)
+        tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        tx = cx - tw // 2
+        ty = cy - th // 2 - bbox[1]
+        return cx, cy, circle_r, tx, ty, font_name
+
+    def _build_stamp(self, number, tile_px, answers):
+        cfg = self.cfg
+        cx, cy, circle_r, tx, ty, font_name = self.circle_geometry(number, tile_px, answers)
+        bbox = self.text_bbox(font_name, number)
+
+        pad = cfg.circle_outline_width + 1
+        x0 = min(cx - circle_r, tx + bbox[0]) - pad
+        y0 = min(cy - circle_r, ty + bbox[1]) - pad
+        x1 = max(cx + circle_r, tx + bbox[2]) + pad
+        y1 = max(cy + circle_r, ty + bbox[3]) + pad
+        size = (x1 - x0 + 1, y1 - y0 + 1)
+        box = (cx - circle_r - x0, cy - circle_r - y0, cx + circle_r - x0, cy + circle_r - y0)
+
+        layers = []
+        if cfg.circle_fill is not None:
+            fill_mask = Image.new("L", size, 0)
+            ImageDraw.Draw(fill_mask).ellipse(box, fill=255)
+            layers.append((fill_mask, cfg.circle_fill))
+        # ellipse() не рисует обводку того же цвета, что и заливка
+        if (cfg.circle_outline is not None and cfg.circle_outline != cfg.circle_fill
+                and cfg.circle_outline_width):
+            outline_mask = Image.new("L", size, 0)
+            ImageDraw.Draw(outline_mask).ellipse(box, outline=255, width=cfg.circle_outline_width)
+            layers.append((outline_mask, cfg.circle_outline))
+        text_mask = Image.new("L", size, 0)
+        ImageDraw.Draw(text_mask).text((tx - x0, ty - y0), number, font=self.fonts[font_name], fill=255)
+        layers.append((text_mask, cfg.circle_text_fill))
+
+        return CircleStamp(layers, x0, y0)
+
+
+_contexts = {}
+
+
+def get_render_context(cfg, px_per_mm):
+    """Контекст рендера текущего процесса для данного конфига и масштаба."""
+    key = (cfg.render_fingerprint(), cfg.font_path, round(px_per_mm, 6))
+    if key not in _contexts:
+        _contexts[key] = RenderContext(cfg, px_per_mm)
+    return _contexts[key]
+
+
+def clear_render_contexts():
+    """
+    Забывает контексты рендера процесса и маски подписей. Для долгоживущих
+    процессов (preview.py), где после каждой правки конфига прежние уже не нужны.
+    """
+    _contexts.clear()
+    clear_outline_cache()
 
 
 # ──────────────────────────────
-# 🖼️ Генерация одного shuffled-листа
+# 📐 Геометрия листа
 # ──────────────────────────────
-def render_page(cfg, page, img_tiles, px_per_mm, dpi, output_dir,
-                use_rotation_matrix=False):
+OUTPUT_KINDS = ("shuffled", "shuffled_rot", "answers")
+
+
+def output_filename(kind, page_idx, ext=".png"):
+    """Имя файла листа данного вида."""
+    if kind == "shuffled":
+        return f"shuffled_{page_idx}{ext}"
+    if kind == "shuffled_rot":
+        return f"shuffled_{page_idx}_rot{ext}"
+    return f"answers_sheet_{page_idx}{ext}"
+
+
+def page_config(cfg, page):
     """
-    Рендер одного shuffled-листа.
-    Если use_rotation_matrix=True — применяются углы из page["rotation_matrix"].
-    Если False — без поворотов (прямая версия).
+    Конфиг под формат листа страницы: sheet_planner записывает в page["sheet"]
+    размер [w, h] в мм. Без него или с тем же размером — cfg как есть.
     """
-    fonts = prepare_fonts(cfg, px_per_mm)
-    sheet, label_area_px = create_blank_sheet(cfg, px_per_mm)
-    draw = ImageDraw.Draw(sheet)
-
-    matrix = page["matrix"]
-    rotation_matrix = page.get("rotation_matrix", [[0] * len(matrix[0]) for _ in matrix])
-    page_idx = page["index"]
+    sheet = page.get("sheet")
+    if not sheet or (cfg.sheet_w_mm, cfg.sheet_h_mm) == tuple(sheet):
+        return cfg
+    page_cfg = copy.copy(cfg)
+    page_cfg.sheet_w_mm, page_cfg.sheet_h_mm = sheet
+    return page_cfg
+
+
+def compute_layout(cfg, matrix, px_per_mm, scale=1.0):
+    """Размер клетки, зазор и смещение сетки тайлов на листе заданного масштаба."""
+    sheet_w = int(cfg.sheet_w_mm * px_per_mm * scale)
+    sheet_h = int(cfg.sheet_h_mm * px_per_mm * scale)  # без полосы подписи
+    label_area = int(cfg.label_area_mm * px_per_mm * scale)
 
-    shuffled_tile_px = int(cfg.shuffled_tile_mm * px_per_mm)
-    gap_px = int(cfg.gap_mm * px_per_mm)
-    margin_px = int(cfg.margin_mm * px_per_mm)
+    tile_px = int(cfg.shuffled_tile_mm * px_per_mm * scale)
+    gap_px = int(cfg.gap_mm * px_per_mm * scale)
+    margin_px = int(cfg.margin_mm * px_per_mm * scale)
     tiles_per_row = len(matrix[0])
     tiles_per_col = len(matrix)
 
-    grid_w = tiles_per_row * shuffled_tile_px + (tiles_per_row - 1) * gap_px
-    grid_h = tiles_per_col * shuffled_tile_px + (tiles_per_col - 1) * gap_px
-    offset_x = margin_px + (sheet.width - 2 * margin_px - grid_w) // 2
-    offset_y = margin_px + (sheet.height - label_area_px - 2 * margin_px - grid_h) // 2
-
-    for r in range(tiles_per_col):
-        for c in range(tiles_per_row):
-            coord = matrix[r][c]
-            if not coord or coord not in img_tiles:
-                continue
+    grid_w = tiles_per_row * tile_px + (tiles_per_row - 1) * gap_px
+    grid_h = tiles_per_col * tile_px + (tiles_per_col - 1) * gap_px
+    return {
+        "scale": scale,
+        "tile_px": tile_px,
+        "gap_px": gap_px,
+        "label_area": label_area,
+        "offset_x": margin_px + (sheet_w - 2 * margin_px - grid_w) // 2,
+        "offset_y": margin_px + (sheet_h - 2 * margin_px - grid_h) // 2,
+        "tiles_per_row": tiles_per_row,
+        "tiles_per_col": tiles_per_col,
+    }
 
-            tile = img_tiles[coord].copy()
-            ang = rotation_matrix[r][c] if use_rotation_matrix else 0
-            if ang:
-                tile = tile.rotate(ang, expand=True)
-            tile_resized = tile.resize((shuffled_tile_px, shuffled_tile_px))
 
-            x = offset_x + c * (shuffled_tile_px + gap_px)
-            y = offset_y + r * (shuffled_tile_px + gap_px) + label_area_px
-            sheet.paste(tile_resized, (x, y))
+def tile_position(layout, r, c):
+    """Левый верхний угол клетки (r, c) на листе."""
+    step = layout["tile_px"] + layout["gap_px"]
+    return (layout["offset_x"] + c * step,
+            layout["offset_y"] + r * step + layout["label_area"])
 
-            draw_tile_on_sheet(cfg, draw, str(r * tiles_per_row + c + 1),
-                               x, y, shuffled_tile_px, px_per_mm,
-                               fonts["circle"], scale=1.0, circle_scale=1.0)
 
-    # подпись
-    suffix = "  с поворотом" if use_rotation_matrix else ""
-    label_text = f"{cfg.project_name} - Лист {page_idx}{suffix}"
-    bbox = draw.textbbox((0, 0), label_text, font=fonts["label"])
+def draw_sheet_label(draw, sheet_w, label_area, text, font):
+    """Подпись листа по центру полосы над сеткой."""
+    bbox = draw.textbbox((0, 0), text, font=font)
     lw, lh = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    draw.text(((sheet.width - lw) // 2, (label_area_px - lh) // 2),
-              label_text, font=fonts["label"], fill="black")
+    draw.text(((sheet_w - lw) // 2, (label_area - lh) // 2),
+              text, font=font, fill="black")
 
-    suffix_file = "_rot" if use_rotation_matrix else ""
-    out_path = os.path.join(output_dir, f"shuffled_{page_idx}{suffix_file}.png")
-    sheet.save(out_path, dpi=(dpi, dpi))
 
-    print(f"💾 Сохранён {os.path.basename(out_path)}")
-    return out_path
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "box": Image.Resampling.BOX,
+    "bilinear": Image.Resampling.BILINEAR,
+    "hamming": Image.Resampling.HAMMING,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
 
-# ──────────────────────────────
-# 🧩 Генерация answers-листа
-# ──────────────────────────────
-def render_page_answers(cfg, page, img_tiles, px_per_mm, dpi, output_dir):
-    scale = cfg.answer_scale
-    fonts = prepare_fonts(cfg, px_per_mm)
-    font_ans = fonts["answer"]
-    font_ans_label = fonts["answer_label"]
 
-    img, label_area = create_blank_sheet(cfg, px_per_mm, scale)
-    draw = ImageDraw.Draw(img)
+def resample_filter(cfg, kind):
+    """Имя фильтра уменьшения тайлов для вида листа (cfg.resample_filters, по умолчанию bicubic)."""
+    name = str(cfg.resample_filters.get(kind, "bicubic")).lower()
+    if name not in RESAMPLE_FILTERS:
+        raise ValueError(f"resample_filters[{kind!r}]: неизвестный фильтр {name!r}, "
+                         f"допустимы: {', '.join(RESAMPLE_FILTERS)}")
+    return name
 
-    matrix = page["matrix"]
-    rotation = page["rotation_matrix"]
-    page_idx = page["index"]
 
-    shuffled_tile_px = int(cfg.shuffled_tile_mm * px_per_mm * scale)
-    gap_px = int(cfg.gap_mm * px_per_mm * scale)
-    margin_px = int(cfg.margin_mm * px_per_mm * scale)
-    tiles_per_row = len(matrix[0])
-    tiles_per_col = len(matrix)
+class TileVariants:
+    """
+    Варианты одного тайла на странице: (размер, фильтр, угол) → Image.
+    Каждый вариант считается один раз из исходного тайла (или берётся из
+    TileCache), повёрнутый — из уже уменьшенного того же размера и фильтра
+    (rotation.rotate_tile).
+    """
 
-    grid_w = tiles_per_row * shuffled_tile_px + (tiles_per_row - 1) * gap_px
-    grid_h = tiles_per_col * shuffled_tile_px + (tiles_per_col - 1) * gap_px
-    offset_x = margin_px + (img.width - 2 * margin_px - grid_w) // 2
-    offset_y = margin_px + (img.height - label_area - 2 * margin_px - grid_h) // 2
+    def __init__(self, source, coord, tile_size, cache=None):
+        self.source = source
+        self.coord = coord
+        self.tile_size = tile_size
+        self.cache = cache
+        self._made = {}
+
+    def get(self, px, resample, angle=0):
+        variant = (px, resample, angle)
+        if variant not in self._made:
+            key = self.cache.key(self.tile_size, self.coord, px, resample, angle) if self.cache else None
+            tile = self.cache.get(key) if key else None
+            if tile is None:
+                if angle:
+                    tile = rotate_tile(self.get(px, resample), angle)
+                else:
+                    tile = self.source.resize((px, px), RESAMPLE_FILTERS[resample])
+                if key:
+                    self.cache.put(key, tile)
+            self._made[variant] = tile
+        return self._made[variant]
+
+
+def tile_row_bands(n_rows, band_rows=None):
+    """Ряды тайлов [(r0, r1), ...] по band_rows в полосе (None — весь лист одной полосой)."""
+    if not band_rows or band_rows >= n_rows:
+        return [(0, n_rows)]
+    return [(r0, min(r0 + band_rows, n_rows)) for r0 in range(0, n_rows, band_rows)]
+
+
+def band_span(layout, sheet_h, r0, r1):
+    """Строки листа [y0, y1), которые занимает полоса рядов тайлов [r0, r1)."""
+    y0 = 0 if r0 == 0 else tile_position(layout, r0, 0)[1]
+    y1 = sheet_h if r1 >= layout["tiles_per_col"] else tile_position(layout, r1, 0)[1]
+    return y0, y1
 
-    for r in range(tiles_per_col):
-        for c in range(tiles_per_row):
+
+# ──────────────────────────────
+# 🖼️ Однопроходный рендер всех листов страницы
+# ──────────────────────────────
+def draw_tile_rows(cfg, ctx, page, img_tiles, layouts, canvases, shifts, r0, r1, banded=(), tile_cache=None):
+    """
+    Рисует ряды тайлов [r0, r1) страницы на холсты видов листов (canvases —
+    {kind: Image}, shifts — на сколько строк холст вида сдвинут от верха
+    листа). Для видов из banded холст — только полоса, и кружки с подписями
+    соседних рядов, заходящие в неё, дорисовываются. Над первым рядом —
+    подпись листа.
+    """
+    fonts = ctx.fonts
+    matrix = page["matrix"]
+    rotation = page.get("rotation_matrix", [[0] * len(matrix[0]) for _ in matrix])
+    page_idx = page["index"]
+    kinds = tuple(canvases)
+    any_layout = next(iter(layouts.values()))
+    n_rows, n_cols = any_layout["tiles_per_col"], any_layout["tiles_per_row"]
+    filters = {kind: resample_filter(cfg, kind) for kind in kinds}
+    draws = {kind: ImageDraw.Draw(canvases[kind]) for kind in kinds}
+
+    # соседние ряды — только ради кружков и подписей, заходящих в полосу
+    for r in range(max(0, r0 - 1), min(n_rows, r1 + 1)):
+        in_band = r0 <= r < r1
+        for c in range(n_cols):
             coord = matrix[r][c]
             if not coord or coord not in img_tiles:
                 continue
-            tile = img_tiles[coord].copy()
-            ang = rotation[r][c]
-            if ang:
-                tile = tile.rotate(ang, expand=True)
-            tile_resized = tile.resize((shuffled_tile_px, shuffled_tile_px))
-            x = offset_x + c * (shuffled_tile_px + gap_px)
-            y = offset_y + r * (shuffled_tile_px + gap_px) + label_area
-            img.paste(tile_resized, (x, y))
-            # --- кружок с номером в правом верхнем углу ---
-            draw_tile_on_sheet(cfg, draw, str(r * tiles_per_row + c + 1),
-                            x, y, shuffled_tile_px, px_per_mm,
-                            fonts["circle_answer"],
-                            scale=cfg.answer_scale,
-                            circle_scale=cfg.answers_circle_scale)
-
-
-
-            tx, ty = position_in_cell(
-                draw, coord, x, y,
-                shuffled_tile_px, shuffled_tile_px, font_ans,
-                align_x=cfg.answer_align_x,
-                align_y=cfg.answer_align_y,
-                margin_px=cfg.answer_margin_px
-            )
-
-
-            if cfg.answer_outline:
-                draw_text_with_outline(draw, (tx, ty), coord, font_ans,
-                                       fill=cfg.answer_text_fill,
-                                       outline_fill=cfg.answer_outline_fill,
-                                       outline_width=cfg.answer_outline_width)
+
+            number = str(r * n_cols + c + 1)
+            if in_band:
+                variants = TileVariants(img_tiles[coord], coord, img_tiles.tile_size, tile_cache)
+
+            for kind in kinds:
+                if not in_band and kind not in banded:
+                    continue
+                draw = draws[kind]
+                cell = layouts[kind]["tile_px"]
+                x, y = tile_position(layouts[kind], r, c)
+                y -= shifts[kind]
+                if kind == "answers":
+                    if in_band:
+                        paste_tile(canvases[kind], variants.get(cell, filters[kind], rotation[r][c]),
+                                   (x, y), rotation[r][c])
+                    # --- кружок с номером в правом верхнем углу ---
+                    ctx.circle_stamp(number, cell, answers=True).apply(draw, x, y)
+                    draw_answer_coord(cfg, draw, coord, x, y, cell, fonts["answer"],
+                                      ctx.text_bbox("answer", coord))
+                else:
+                    if in_band:
+                        angle = rotation[r][c] if kind == "shuffled_rot" else 0
+                        paste_tile(canvases[kind], variants.get(cell, filters[kind], angle), (x, y), angle)
+                    ctx.circle_stamp(number, cell).apply(draw, x, y)
+
+    # подписи — в полосе над сеткой
+    if r0 == 0:
+        for kind in kinds:
+            sheet_w = canvases[kind].width
+            if kind == "answers":
+                draw_sheet_label(draws[kind], sheet_w, layouts[kind]["label_area"],
+                                 f"{cfg.project_name} - Лист {page_idx}", fonts["answer_label"])
             else:
-                draw.text((tx, ty), coord, fill=cfg.answer_text_fill, font=font_ans)
+                suffix = "  с поворотом" if kind == "shuffled_rot" else ""
+                draw_sheet_label(draws[kind], sheet_w, layouts[kind]["label_area"],
+                                 f"{cfg.project_name} - Лист {page_idx}{suffix}", fonts["label"])
 
-    label_text = f"{cfg.project_name} - Лист {page_idx}"
-    bbox = draw.textbbox((0, 0), label_text, font=font_ans_label)
-    lw, lh = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    draw.text(((img.width - lw) // 2, (label_area - lh) // 2),
-              label_text, font=font_ans_label, fill="black")
 
-    out_path = os.path.join(output_dir, f"answers_sheet_{page_idx}.png")
-    img.save(out_path, dpi=(dpi, dpi))
-    return out_path
+def kind_layout(cfg, page, px_per_mm, kind):
+    """Раскладка и размер листа вида kind для страницы (cfg — уже под формат страницы)."""
+    layout = compute_layout(cfg, page["matrix"], px_per_mm, cfg.answer_scale if kind == "answers" else 1.0)
+    return layout, sheet_size(cfg, px_per_mm, layout["scale"])
+
+
+def render_page_outputs(cfg, page, img_tiles, px_per_mm, dpi, output_dir, kinds=OUTPUT_KINDS,
+                        band_rows=None, tile_cache=None, wait=True):
+    """
+    Рендерит выбранные виды листов страницы за один проход по тайлам:
+    раскладка считается один раз, шрифты и штампы берутся из контекста
+    рендера процесса, каждый тайл уменьшается из исходника один раз на
+    размер клетки и фильтр (cfg.resample_filters), а повёрнутый вариант
+    получается уже из уменьшенного. tile_cache (TileCache) — уменьшенные
+    тайлы с диска вместо пересчёта.
+
+    band_rows — режим ограниченной памяти: лист собирается полосами
+    по band_rows рядов тайлов, и каждая полоса сразу дописывается в файл
+    потоковым писателем (PNG/TIFF). Кружки и подписи соседних рядов
+    дорисовываются в полосу, поэтому результат совпадает с целым холстом.
+    Виды, которые полосами не пишутся (JPEG, палитра), собираются целиком.
+    Возвращает {kind: путь}. wait=False — не ждать кодирования целых
+    холстов: вместо их путей — Future пула записи (см. resolve_outputs).
+    """
+    ctx = get_render_context(cfg, px_per_mm)
+    cfg = page_config(cfg, page)
+    page_idx = page["index"]
+
+    layouts, sizes = {}, {}
+    for kind in kinds:
+        layouts[kind], sizes[kind] = kind_layout(cfg, page, px_per_mm, kind)
+    paths = {kind: os.path.join(output_dir, output_filename(kind, page_idx, output_extension(cfg)))
+             for kind in kinds}
+    bands = tile_row_bands(len(page["matrix"]), band_rows)
+
+    # потоковые писатели для видов, которые можно писать полосами
+    streams = {}
+    if len(bands) > 1:
+        for kind in kinds:
+            mode = stream_mode(cfg, kind, img_tiles.mode)
+            if mode:
+                streams[kind] = (open_stream_writer(paths[kind], *sizes[kind], mode, dpi, cfg), mode)
+            else:
+                print(f"⚠️ {os.path.basename(paths[kind])}: {cfg.output_format} в этом режиме "
+                      f"полосами не пишется — лист собирается целиком")
+    sheets = {kind: Image.new("RGBA", sizes[kind], (255, 255, 255, 255))
+              for kind in kinds if kind not in streams}
+
+    try:
+        for r0, r1 in bands:
+            canvases, shifts = {}, {}
+            for kind in kinds:
+                if kind in streams:
+                    y0, y1 = band_span(layouts[kind], sizes[kind][1], r0, r1)
+                    canvases[kind] = Image.new("RGBA", (sizes[kind][0], y1 - y0), (255, 255, 255, 255))
+                    shifts[kind] = y0
+                else:
+                    canvases[kind], shifts[kind] = sheets[kind], 0
+            draw_tile_rows(cfg, ctx, page, img_tiles, layouts, canvases, shifts, r0, r1, streams, tile_cache)
+
+            for kind, (stream, mode) in streams.items():
+                stream.write(canvases[kind].convert(mode))
+    except BaseException:
+        # недописанные полосами файлы не оставляем
+        for stream, _ in streams.values():
+            stream.abort()
+        raise
+
+    results = {}
+    for kind, (stream, _) in streams.items():
+        with stage("save", kind=kind, file=os.path.basename(paths[kind]), banded=True) as rec:
+            results[kind] = stream.close()
+            rec["bytes"] = os.path.getsize(results[kind])
+
+    # целые холсты — кодирование уходит в пул записи процесса
+    writer = get_writer(cfg)
+    for kind in kinds:
+        if kind not in streams:
+            results[kind] = writer.submit(sheets.pop(kind), paths[kind], cfg, kind, dpi)
+    outputs = {kind: results[kind] for kind in kinds}
+    return outputs if not wait else resolve_outputs(outputs)
+
+
+def resolve_outputs(outputs):
+    """{kind: путь или Future пула записи} → {kind: путь}, дождавшись кодирования."""
+    paths = {kind: out.result() if isinstance(out, Future) else out for kind, out in outputs.items()}
+    for path in paths.values():
+        print(f"💾 Сохранён {os.path.basename(path)}")
+    return paths
+
+
+def draw_answer_coord(cfg, draw, coord, x, y, tile_px, font, bbox=None):
+    """Координата тайла в клетке answers-листа (с обводкой, если включена)."""
+    tx, ty = position_in_cell(
+        draw, coord, x, y,
+        tile_px, tile_px, font,
+        align_x=cfg.answer_align_x,
+        align_y=cfg.answer_align_y,
+        margin_px=cfg.answer_margin_px,
+        bbox=bbox
+    )
+
+    if cfg.answer_outline:
+        draw_text_with_outline(draw, (tx, ty), coord, font,
+                               fill=cfg.answer_text_fill,
+                               outline_fill=cfg.answer_outline_fill,
+                               outline_width=cfg.answer_outline_width)
+    else:
+        draw.text((tx, ty), coord, fill=cfg.answer_text_fill, font=font)
+
+
+# ──────────────────────────────
+# 🖼️ Генерация одного shuffled-листа
+# ──────────────────────────────
+def render_page(cfg, page, img_tiles, px_per_mm, dpi, output_dir,
+                use_rotation_matrix=False):
+    """
+    Рендер одного shuffled-листа.
+    Если use_rotation_matrix=True — применяются углы из page["rotation_matrix"].
+    Если False — без поворотов (прямая версия).
+    """
+    kind = "shuffled_rot" if use_rotation_matrix else "shuffled"
+    return render_page_outputs(cfg, page, img_tiles, px_per_mm, dpi, output_dir, (kind,))[kind]
+
+# ──────────────────────────────
+# 🧩 Генерация answers-листа
+# ──────────────────────────────
+def render_page_answers(cfg, page, img_tiles, px_per_mm, dpi, output_dir):
+    return render_page_outputs(cfg, page, img_tiles, px_per_mm, dpi, output_dir, ("answers",))["answers"]
 
 
 # ──────────────────────────────
@@ -215,75 +523,335 @@ def render_page_answers(cfg, page, img_tiles, px_per_mm, dpi, output_dir):
 # ──────────────────────────────
 
 
-def render_sheet_pair(cfg, img_tiles, page, px_per_mm, dpi, output_dir):
+def render_page_unit(cfg, img_tiles, pages, px_per_mm, dpi, output_dir, kinds=OUTPUT_KINDS, cache=None,
+                     band_rows=None):
     """
-    Рендерит shuffled и answers параллельно для одного листа.
-    Работает внутри отдельного процесса (по одному на страницу).
+    Задача общего пула: рендерит выбранные виды листов страниц pages, каждую
+    одним проходом. Листы, уже лежащие в кэше рендера (cache), не рендерятся,
+    а берутся оттуда. Кодирование листов страницы идёт в пуле записи, пока
+    рендерится следующая: его ждут только после старта следующей страницы
+    (и в конце задачи). Возвращает {(номер страницы, вид): путь}.
     """
+    results, encoding = {}, None
+    for page in pages:
+        started = _start_page(cfg, img_tiles, page, px_per_mm, dpi, output_dir, kinds, cache, band_rows)
+        if encoding is not None:
+            results.update(_finish_page(*encoding, cache))
+        encoding = started
+    if encoding is not None:
+        results.update(_finish_page(*encoding, cache))
+    return results
+
+
+def _start_page(cfg, img_tiles, page, px_per_mm, dpi, output_dir, kinds, cache, band_rows):
+    """Берёт листы страницы из кэша и рендерит недостающие, не дожидаясь кодирования."""
     page_id = page["index"]
     pid = os.getpid()
 
-    print(f"🟢 [PID {pid}] ▶️ Старт страницы {page_id} ({timemod.strftime('%H:%M:%S')})")
+    print(f"🟢 [PID {pid}] ▶️ Старт страницы {page_id} {'/'.join(kinds)} ({timemod.strftime('%H:%M:%S')})")
 
-    # Создаём потоки для двух задач — shuffled и answers
-    with ThreadPoolExecutor(max_workers=2) as pool:
-        futures = {
-            pool.submit(render_page, cfg, page, img_tiles, px_per_mm, dpi, output_dir, False): "shuffled",
-            pool.submit(render_page, cfg, page, img_tiles, px_per_mm, dpi, output_dir, True): "shuffled_rot",
-            pool.submit(render_page_answers, cfg, page, img_tiles, px_per_mm, dpi, output_dir): "answers",
-        }
+    cached, keys, missing = {}, {}, []
+    for kind in kinds:
+        out_path = os.path.join(output_dir, output_filename(kind, page_id, output_extension(cfg)))
+        if cache is not None:
+            keys[kind] = cache.key(kind, page)
+            if cache.fetch(keys[kind], out_path):
+                print(f"   ♻️ [PID {pid}] {os.path.basename(out_path)} взят из кэша")
+                cached[kind] = out_path
+                continue
+        missing.append(kind)
+
+    outputs = {}
+    if missing:
+        try:
+            with stage("render_page", page=page_id, kinds=missing):
+                outputs = render_page_outputs(cfg, page, img_tiles, px_per_mm, dpi, output_dir,
+                                              tuple(missing), band_rows,
+                                              cache.tiles if cache is not None else None, wait=False)
+        except Exception as e:
+            print(f"   ❌ [PID {pid}] Ошибка страницы {page_id}: {e}")
+            raise
+    return page, kinds, keys, cached, outputs
+
+
+def _finish_page(page, kinds, keys, cached, outputs, cache):
+    """Дожидается кодирования листов страницы и кладёт их в кэш рендера."""
+    page_id = page["index"]
+    pid = os.getpid()
+    try:
+        rendered = resolve_outputs(outputs)
+    except Exception as e:
+        print(f"   ❌ [PID {pid}] Ошибка записи страницы {page_id}: {e}")
+        raise
+    if cache is not None:
+        for kind, path in rendered.items():
+            cache.store(keys[kind], path)
+
+    print(f"🏁 [PID {pid}] Завершена страница {page_id} {'/'.join(kinds)} ({timemod.strftime('%H:%M:%S')})")
+    return {(page_id, kind): path for kind, path in {**cached, **rendered}.items()}
+
+
+def band_part_path(output_dir, kind, page_idx, r0, cfg):
+    """Кусок листа с рядами тайлов от r0 — до склейки в join_bands_unit."""
+    return os.path.join(output_dir, f"{output_filename(kind, page_idx, output_extension(cfg))}.rows{r0}.part")
+
+
+def render_band_unit(cfg, img_tiles, pages, px_per_mm, dpi, output_dir, kind, r0, r1, tile_cache=None):
+    """
+    Задача общего пула: ряды тайлов [r0, r1) одного вида листа одной страницы
+    (pages — из одной страницы). Полоса рисуется как в полосном режиме
+    render_page_outputs и сохраняется куском (для PNG — уже сжатым), который
+    потом склеивает join_bands_unit. Готовых листов не возвращает.
+    """
+    page = pages[0]
+    ctx = get_render_context(cfg, px_per_mm)
+    cfg = page_config(cfg, page)
+    layout, (w, h) = kind_layout(cfg, page, px_per_mm, kind)
+    y0, y1 = band_span(layout, h, r0, r1)
+    canvas = Image.new("RGBA", (w, y1 - y0), (255, 255, 255, 255))
+    with stage("render_band", page=page["index"], kind=kind, rows=[r0, r1]):
+        draw_tile_rows(cfg, ctx, page, img_tiles, {kind: layout}, {kind: canvas}, {kind: y0},
+                       r0, r1, (kind,), tile_cache)
+        write_band_part(band_part_path(output_dir, kind, page["index"], r0, cfg), canvas,
+                        stream_mode(cfg, kind, img_tiles.mode), cfg)
+    return {}
+
+
+def join_bands_unit(cfg, img_tiles, pages, px_per_mm, dpi, output_dir, kind, starts, cache=None):
+    """
+    Задача общего пула: склеивает куски render_band_unit (starts — первые
+    ряды полос по порядку) в файл листа и кладёт его в кэш рендера.
+    Возвращает {(номер страницы, вид): путь}.
+    """
+    page = pages[0]
+    cfg = page_config(cfg, page)
+    _, (w, h) = kind_layout(cfg, page, px_per_mm, kind)
+    out_path = os.path.join(output_dir, output_filename(kind, page["index"], output_extension(cfg)))
+    parts = [band_part_path(output_dir, kind, page["index"], r0, cfg) for r0 in starts]
+    mode = stream_mode(cfg, kind, img_tiles.mode)
+
+    with stage("join_bands", page=page["index"], kind=kind, parts=len(parts)):
+        if mode:
+            join_band_parts(out_path, parts, w, h, mode, dpi, cfg)
+        else:
+            # JPEG, палитра, 1 бит — кодируются только целым холстом
+            sheet, y = Image.new("RGBA", (w, h)), 0
+            for part in parts:
+                part_mode, part_w, rows, _, _, data = read_band_part(part)
+                sheet.paste(Image.frombytes(part_mode, (part_w, rows), data), (0, y))
+                y += rows
+            save_image(sheet, out_path, cfg, kind, dpi)
+    for part in parts:
+        os.remove(part)
+    if cache is not None:
+        cache.store(cache.key(kind, page), out_path)
+    print(f"💾 Сохранён {os.path.basename(out_path)} (полос: {len(parts)})")
+    return {(page["index"], kind): out_path}
+
+
+def render_sheet_pair(cfg, img_tiles, page, px_per_mm, dpi, output_dir, cache=None):
+    """Рендерит shuffled, shuffled_rot и answers одной страницы; возвращает (shuffled, answers)."""
+    results = render_page_unit(cfg, img_tiles, [page], px_per_mm, dpi, output_dir, OUTPUT_KINDS, cache)
+    return results.get((page["index"], "shuffled")), results.get((page["index"], "answers"))
+
+
+# ──────────────────────────────
+# 🧮 Разбиение на задачи для общего пула
+# ──────────────────────────────
+def estimate_sheet_mb(cfg, px_per_mm, kinds):
+    """Грубая оценка пиковой памяти на холсты страницы: RGBA + копия при сохранении."""
+    total = 0.0
+    for kind in kinds:
+        scale = cfg.answer_scale if kind == "answers" else 1.0
+        w = cfg.sheet_w_mm * px_per_mm * scale
+        h = (cfg.sheet_h_mm + cfg.label_area_mm) * px_per_mm * scale
+        total += w * h * (4 + 3) / 2**20
+    return total
+
+
+def estimate_page_mb(cfg, page, px_per_mm, kinds, band_rows=None):
+    """
+    Оценка пиковой памяти задачи страницы. В полосном режиме считается
+    самая высокая полоса (первая — с подписью и верхним полем); виды,
+    которые полосами не пишутся, по-прежнему держат целый холст.
+    """
+    cfg = page_config(cfg, page)
+    if not band_rows:
+        return estimate_sheet_mb(cfg, px_per_mm, kinds)
+    total = 0.0
+    for kind in kinds:
+        scale = cfg.answer_scale if kind == "answers" else 1.0
+        w, h = sheet_size(cfg, px_per_mm, scale)
+        if stream_mode(cfg, kind, "RGBA"):
+            layout = compute_layout(cfg, page["matrix"], px_per_mm, scale)
+            h = max(y1 - y0 for y0, y1 in (band_span(layout, h, r0, r1)
+                                           for r0, r1 in tile_row_bands(layout["tiles_per_col"], band_rows)))
+        total += w * h * (4 + 4) / 2**20
+    return total
+
+
+def plan_band_rows(cfg, page, px_per_mm, kinds, unit_mb):
+    """
+    Сколько рядов тайлов брать в полосу, чтобы задача страницы уложилась
+    в unit_mb. None — лист целиком и так влезает.
+    """
+    cfg = page_config(cfg, page)
+    if estimate_sheet_mb(cfg, px_per_mm, kinds) <= unit_mb:
+        return None
+    n_rows = len(page["matrix"])
+    for band_rows in range(n_rows - 1, 1, -1):
+        if estimate_page_mb(cfg, page, px_per_mm, kinds, band_rows) <= unit_mb:
+            return band_rows
+    return 1
 
-        results = {}
 
-        for fut in as_completed(futures):
-            task = futures[fut]
-            try:
-                results[task] = fut.result()
-                print(f"   ✅ [PID {pid}] {task} готов для страницы {page_id} ({timemod.strftime('%H:%M:%S')})")
-            except Exception as e:
-                print(f"   ❌ [PID {pid}] Ошибка в {task} страницы {page_id}: {e}")
-                results[task] = None
+PAGES_PER_UNIT = 4
+
+
+def sheet_units(cfg, img_tiles, pages, px_per_mm, dpi, output_dir, workers, cache=None,
+                band_rows=None, done=()):
+    """
+    Задачи рендера листов. Обычно одна задача — несколько страниц подряд
+    (до PAGES_PER_UNIT), каждая целиком (тайлы уменьшаются один раз на все
+    виды листов), чтобы кодирование страницы шло во время рендера
+    следующей (см. render_page_unit). Если страниц меньше, чем
+    воркеров, каждый лист режется на полосы рядов тайлов — задачи
+    (страница, полоса, вид) — и склеивается отдельной задачей после них,
+    чтобы загрузить все ядра даже на проектах из 2–3 страниц. Листы из
+    кэша рендера тогда не режутся: их задача только забирает файл.
+    band_rows — полосный режим (см. render_page_outputs), он же
+    ограничивает высоту полос. done — уже готовые (номер страницы, вид)
+    при --resume: они в задачи не попадают.
+    """
+    def weight(kind):
+        # площадь answers-листа — answer_scale² от shuffled
+        return cfg.answer_scale ** 2 if kind == "answers" else 1.0
+
+    def tile_count(page):
+        return sum(1 for row in page["matrix"] for coord in row if coord)
+
+    units = []
+    if len(pages) >= workers:
+        # по несколько страниц в задаче, но не меньше двух задач на воркер — для баланса
+        per_unit = min(PAGES_PER_UNIT, max(1, len(pages) // (2 * workers)))
+        groups = []
+        for page in pages:
+            kinds = tuple(k for k in OUTPUT_KINDS if (page["index"], k) not in done)
+            if not kinds:
+                continue
+            if groups and groups[-1][0] == kinds and len(groups[-1][1]) < per_unit:
+                groups[-1][1].append(page)
+            else:
+                groups.append((kinds, [page]))
+
+        for kinds, group in groups:
+            mem = max(estimate_page_mb(cfg, page, px_per_mm, kinds, band_rows) for page in group)
+            if len(group) > 1:
+                # целые холсты страницы ещё кодируются, пока рендерится следующая
+                whole = tuple(k for k in kinds if not band_rows or not stream_mode(cfg, k, img_tiles.mode))
+                if whole:
+                    mem += max(estimate_sheet_mb(page_config(cfg, page), px_per_mm, whole) for page in group)
+            first, last = group[0]["index"], group[-1]["index"]
+            units.append(WorkUnit(
+                f"page{'s' if len(group) > 1 else ''} {first}{f'-{last}' if len(group) > 1 else ''} "
+                f"{'/'.join(kinds)}",
+                render_page_unit,
+                (cfg, img_tiles, group, px_per_mm, dpi, output_dir, kinds, cache, band_rows),
+                cost=sum(tile_count(page) for page in group) * sum(weight(k) for k in kinds),
+                mem_mb=mem,
+            ))
+        return units
+
+    sheets = [(page, kind) for page in pages for kind in OUTPUT_KINDS if (page["index"], kind) not in done]
+    total = sum(tile_count(page) * weight(kind) for page, kind in sheets) or 1
+    for page, kind in sheets:
+        cost = tile_count(page) * weight(kind)
+        n_rows = len(page["matrix"])
+        n_bands = min(n_rows, max(1, round(workers * cost / total)))
+        rows_per_band = -(-n_rows // n_bands)
+        if band_rows:
+            rows_per_band = min(rows_per_band, band_rows)
+        cached = cache is not None and cache.has(
+            cache.key(kind, page), output_filename(kind, page["index"], output_extension(cfg)))
+        if cached or rows_per_band >= n_rows:
+            units.append(WorkUnit(
+                f"page {page['index']} {kind}",
+                render_page_unit,
+                (cfg, img_tiles, [page], px_per_mm, dpi, output_dir, (kind,), cache, band_rows),
+                cost=0 if cached else cost,
+                mem_mb=estimate_page_mb(cfg, page, px_per_mm, (kind,), band_rows),
+            ))
+            continue
+
+        bands = tile_row_bands(n_rows, rows_per_band)
+        band_units = [WorkUnit(
+            f"page {page['index']} {kind} rows {r0 + 1}-{r1}",
+            render_band_unit,
+            (cfg, img_tiles, [page], px_per_mm, dpi, output_dir, kind, r0, r1,
+             cache.tiles if cache is not None else None),
+            cost=cost * (r1 - r0) / n_rows,
+            mem_mb=estimate_page_mb(cfg, page, px_per_mm, (kind,), rows_per_band),
+        ) for r0, r1 in bands]
+        units.extend(band_units)
+        # склейка PNG/TIFF — потоком кусок за куском, остальное — целым холстом
+        join_mb = 0.0 if stream_mode(cfg, kind, img_tiles.mode) else estimate_sheet_mb(
+            page_config(cfg, page), px_per_mm, (kind,))
+        units.append(WorkUnit(
+            f"page {page['index']} {kind} join",
+            join_bands_unit,
+            (cfg, img_tiles, [page], px_per_mm, dpi, output_dir, kind, [r0 for r0, _ in bands], cache),
+            cost=0,
+            mem_mb=join_mb,
+            after=band_units,
+        ))
+    return units
+
+
+def collect_page_results(done):
+    """[(unit, {(страница, вид): путь}), ...] → [(shuffled, answers), ...] по порядку страниц."""
+    by_page = {}
+    for unit, results in done:
+        for (page_idx, kind), path in results.items():
+            by_page.setdefault(page_idx, {})[kind] = path
+    return [(by_page[i].get("shuffled"), by_page[i].get("answers")) for i in sorted(by_page)]
 
-    print(f"🏁 [PID {pid}] Завершена страница {page_id} ({timemod.strftime('%H:%M:%S')})")
 
-    return results.get("shuffled"), results.get("answers")
 # ──────────────────────────────
 # 🚀 Параллельная генерация всех листов
 # ──────────────────────────────
-def render_all_pages(cfg, img_tiles, state, px_per_mm, dpi, output_dir, pages=None, threads=None):
+def render_all_pages(cfg, img_tiles, state, px_per_mm, dpi, output_dir, pages=None, threads=None,
+                     cache=None):
     os.makedirs(output_dir, exist_ok=True)
     pages_to_render = pages or state["pages"]
 
-    results = []
-    with ProcessPoolExecutor(max_workers=threads) as pool:
-        futures = [
-            pool.submit(render_sheet_pair, cfg, img_tiles, page, px_per_mm, dpi, output_dir)
-            for page in pages_to_render
-        ]
-        for fut in as_completed(futures):
-            shuffled, answers = fut.result()
-            print(f"💾 {os.path.basename(shuffled)}, {os.path.basename(answers)} готовы")
-            results.append((shuffled, answers))
-
+    workers = threads or os.cpu_count() or 1
+    units = sheet_units(cfg, img_tiles, pages_to_render, px_per_mm, dpi, output_dir, workers, cache)
+    done = list(run_units(units, worker_count(units, threads)))
+    results = collect_page_results(done)
+    for shuffled, answers in results:
+        print(f"💾 {os.path.basename(shuffled)}, {os.path.basename(answers)} готовы")
     return results
 
 
 # ──────────────────────────────
 # 🧩 Публичная точка входа
 # ──────────────────────────────
-def make_sheets_from_state(cfg, img_tiles, state, px_per_mm, dpi, output_dir, threads=None, pages=None):
+def make_sheets_from_state(cfg, img_tiles, state, px_per_mm, dpi, output_dir, threads=None, pages=None,
+                           cache=None):
     print("🧩 Генерация shuffled и answers-листов (параллельно)...")
-    return render_all_pages(cfg, img_tiles, state, px_per_mm, dpi, output_dir, pages, threads)
+    return render_all_pages(cfg, img_tiles, state, px_per_mm, dpi, output_dir, pages, threads, cache)
 
 def position_in_cell(draw, text, x, y, w, h, font,
-                     align_x="center", align_y="center", margin_px=24):
+                     align_x="center", align_y="center", margin_px=24, bbox=None):
     """
     Возвращает координаты для текста внутри ячейки по двум осям.
     align_x: 'left' | 'center' | 'right'
     align_y: 'top'  | 'center' | 'bottom'
     margin_px — отступ от краёв (в пикселях).
+    bbox — заранее посчитанный textbbox (из контекста рендера), чтобы не мерить заново.
     """
-    bbox = draw.textbbox((0, 0), text, font=font)
+    if bbox is None:
+        bbox = draw.textbbox((0, 0), text, font=font)
     tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
 
     # === Горизонталь ===
@@ -311,30 +879,8 @@ def render_page_set(cfg, page, img_tiles, px_per_mm, dpi, output_dir,
     Генерирует выбранные типы листов для страницы.
     what — кортеж: ('shuffled', 'answers', 'shuffled_rot', ...)
     """
-    results = {}
-
-    with ThreadPoolExecutor(max_workers=len(what)) as pool:
-        futures = {}
-
-        for kind in what:
-            if kind == "shuffled":
-                futures[pool.submit(render_page, cfg, page, img_tiles, px_per_mm, dpi, output_dir,
-                                    type="shuffled", rotated=False)] = "shuffled"
-
-            elif kind == "shuffled_rot":
-                futures[pool.submit(render_page, cfg, page, img_tiles, px_per_mm, dpi, output_dir,
-                                    type="shuffled", rotated=True)] = "shuffled_rot"
-
-            elif kind == "answers":
-                futures[pool.submit(render_page, cfg, page, img_tiles, px_per_mm, dpi, output_dir,
-                                    type="answers", rotated=False)] = "answers"
-
-        for fut in as_completed(futures):
-            kind = futures[fut]
-            try:
-                results[kind] = fut.result()
-                print(f"✅ {kind} готов: {os.path.basename(results[kind])}")
-            except Exception as e:
-                print(f"❌ Ошибка при генерации {kind}: {e}")
-
+    kinds = tuple(k for k in OUTPUT_KINDS if k in what)
+    results = render_page_outputs(cfg, page, img_tiles, px_per_mm, dpi, output_dir, kinds)
+    for kind, path in results.items():
+        print(f"✅ {kind} готов: {os.path.basename(path)}")
     return results
@@ -0,0 +1,207 @@
+"""
+Компактный random_state.bin и ленивое чтение страниц.
+
+    [magic "QRS1"][u32 длина meta][meta JSON]
+    [индекс: page_count × (u64 смещение, u16 rows, u16 cols)]
+    [страницы: u32 номер, u8 флаги, u16[rows*cols] коды координат,
+               упакованные коды поворотов]
+
+Флаги страницы: бит 0 — есть повороты, биты 1–7 — номер формата листа
+в meta["sheets"] плюс один (0 — лист из конфига, sheet_planner не включён).
+
+Код координаты — row * cols + col по cfg.letters × cfg.cols, 0xFFFF — пустая
+клетка. Код поворота — индекс в таблице углов из meta: для обычных 0/90/180/270
+это 2 бита на клетку, для произвольных наборов rotate_tiles — 8 бит.
+Страница читается по смещению из индекса, остальные не трогаются.
+
+    python state_file.py <проект> [out.json]    # экспорт в JSON для просмотра
+"""
+import os
+import sys
+import json
+import struct
+from collections.abc import Sequence
+
+import numpy as np
+
+from io_helpers import atomic_output, save_json_atomic
+
+MAGIC = b"QRS1"
+EMPTY = 0xFFFF
+INDEX_ENTRY = struct.Struct("<QHH")
+PAGE_HEADER = struct.Struct("<IB")
+FLAG_ROTATED = 1
+SHEET_SHIFT = 1
+MAX_SHEETS = 127
+
+
+def _bits_for(angles):
+    return 2 if len(angles) <= 4 else 8
+
+
+def _pack_codes(codes, bits):
+    if bits == 8:
+        return codes.astype(np.uint8).tobytes()
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    q = padded.reshape(-1, 4)
+    return (q[:, 0] | (q[:, 1] << 2) | (q[:, 2] << 4) | (q[:, 3] << 6)).astype(np.uint8).tobytes()
+
+
+def _unpack_codes(data, n, bits):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if bits == 8:
+        return raw[:n]
+    return np.stack([(raw >> s) & 3 for s in (0, 2, 4, 6)], axis=1).reshape(-1)[:n]
+
+
+def _record_size(rows, cols, bits):
+    n = rows * cols
+    return PAGE_HEADER.size + 2 * n + (n if bits == 8 else -(-n // 4))
+
+
+def write_state(path, state, letters, cols):
+    """Пишет state (словарь как у generate_random_state) в random_state.bin."""
+    angles = sorted({a for p in state["pages"] for row in p["rotation_matrix"] for a in row} | {0})
+    if len(angles) > 256:
+        raise ValueError("слишком много разных углов поворота для random_state.bin")
+    bits = _bits_for(angles)
+    angle_code = {a: i for i, a in enumerate(angles)}
+    letter_row = {l: i for i, l in enumerate(letters)}
+    sheets = []
+    for page in state["pages"]:
+        if page.get("sheet") and list(page["sheet"]) not in sheets:
+            sheets.append(list(page["sheet"]))
+    if len(sheets) > MAX_SHEETS:
+        raise ValueError("слишком много разных форматов листов для random_state.bin")
+
+    meta = {k: v for k, v in state.items() if k != "pages"}
+    meta.update({"letters": list(letters), "cols": cols, "angles": angles, "sheets": sheets,
+                 "page_count": len(state["pages"])})
+    meta_blob = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+
+    records = []
+    for page in state["pages"]:
+        rows, pcols = len(page["matrix"]), len(page["matrix"][0])
+        coords = np.full(rows * pcols, EMPTY, dtype="<u2")
+        rots = np.zeros(rows * pcols, dtype=np.uint8)
+        for r, row in enumerate(page["matrix"]):
+            for c, coord in enumerate(row):
+                if coord:
+                    coords[r * pcols + c] = letter_row[coord[0]] * cols + int(coord[1:]) - 1
+                rots[r * pcols + c] = angle_code[page["rotation_matrix"][r][c]]
+        flags = FLAG_ROTATED if page.get("rotated") else 0
+        if page.get("sheet"):
+            flags |= (sheets.index(list(page["sheet"])) + 1) << SHEET_SHIFT
+        records.append((rows, pcols, PAGE_HEADER.pack(page["index"], flags)
+                        + coords.tobytes() + _pack_codes(rots, bits)))
+
+    head = MAGIC + struct.pack("<I", len(meta_blob)) + meta_blob
+    offset = len(head) + INDEX_ENTRY.size * len(records)
+    index = b""
+    for rows, pcols, blob in records:
+        index += INDEX_ENTRY.pack(offset, rows, pcols)
+        offset += len(blob)
+
+    with atomic_output(path) as tmp, open(tmp, "wb") as f:
+        f.write(head + index)
+        for _, _, blob in records:
+            f.write(blob)
+
+
+class LazyPages(Sequence):
+    """Страницы random_state.bin: каждая декодируется при первом обращении."""
+
+    def __init__(self, path, meta, index):
+        self._path = path
+        self._meta = meta
+        self._index = index
+        self._bits = _bits_for(meta["angles"])
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i not in self._cache:
+            self._cache[i] = self._read(i)
+        return self._cache[i]
+
+    def by_index(self, page_indices):
+        """Страницы с номерами page["index"] из page_indices (номера с 1, как в --pages)."""
+        return [self[i - 1] for i in sorted(set(page_indices)) if 1 <= i <= len(self)]
+
+    def _read(self, i):
+        offset, rows, cols = self._index[i]
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            blob = f.read(_record_size(rows, cols, self._bits))
+        page_idx, flags = PAGE_HEADER.unpack_from(blob)
+        n = rows * cols
+        coords = np.frombuffer(blob, dtype="<u2", count=n, offset=PAGE_HEADER.size)
+        rots = _unpack_codes(blob[PAGE_HEADER.size + 2 * n:], n, self._bits)
+
+        letters, src_cols, angles = self._meta["letters"], self._meta["cols"], self._meta["angles"]
+        matrix, rotation = [], []
+        for r in range(rows):
+            matrix.append([None if code == EMPTY else f"{letters[code // src_cols]}{code % src_cols + 1}"
+                           for code in coords[r * cols:(r + 1) * cols].tolist()])
+            rotation.append([angles[code] for code in rots[r * cols:(r + 1) * cols].tolist()])
+        page = {"index": page_idx, "rotated": bool(flags & FLAG_ROTATED),
+                "matrix": matrix, "rotation_matrix": rotation}
+        sheet_code = flags >> SHEET_SHIFT
+        if sheet_code:
+            page["sheet"] = list(self._meta["sheets"][sheet_code - 1])
+        return page
+
+
+class RandomState(dict):
+    """
+    random_state как словарь (config_hash, seed, tiles_per_row, ...), но
+    state["pages"] — LazyPages: файл целиком не читается.
+    """
+
+    def pages_by_index(self, page_indices):
+        return self["pages"].by_index(page_indices)
+
+
+def read_state(path):
+    """Открывает random_state.bin: читает только meta и индекс страниц."""
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"{path}: не random_state.bin")
+        (meta_len,) = struct.unpack("<I", f.read(4))
+        meta = json.loads(f.read(meta_len).decode("utf-8"))
+        raw = f.read(INDEX_ENTRY.size * meta["page_count"])
+    index = [INDEX_ENTRY.unpack_from(raw, k * INDEX_ENTRY.size) for k in range(meta["page_count"])]
+
+    state = RandomState({k: v for k, v in meta.items() if k not in ("letters", "cols", "angles", "sheets", "page_count")})
+    state["pages"] = LazyPages(path, meta, index)
+    return state
+
+
+def export_json(state, path):
+    """Полный random_state в JSON — для просмотра и сравнения глазами."""
+    data = dict(state)
+    data["pages"] = list(state["pages"])
+    save_json_atomic(data, path)
+
+
+if __name__ == "__main__":
+    from config import Config
+
+    if len(sys.argv) < 2:
+        print("Использование: python state_file.py <проект> [out.json]")
+        sys.exit(2)
+    cfg = Config()
+    cfg.project_name = sys.argv[1]
+    cfg.ensure_project_dir()
+    out = sys.argv[2] if len(sys.argv) > 2 else os.path.join(cfg.project_dir, "random_state.export.json")
+    export_json(read_state(cfg.random_state_file), out)
+    print(f"💾 random_state экспортирован → {out}")
@@ -0,0 +1,310 @@
+"""
+Потоковая запись больших листов полосами: PNG (IDAT-чанки через zlib)
+и TIFF (полосы-strip'ы с IFD в конце файла). Весь холст в памяти не нужен —
+рендер отдаёт полосы сверху вниз через write(), close() дописывает файл.
+Пишется во временный файл рядом; под своим именем файл появляется только
+после close(), так что оборванный рендер не оставляет битых листов.
+"""
+import io
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from io_helpers import atomic_output
+from writer import output_format, STREAM_TIFF_COMPRESSIONS
+
+# режимы, которые умеют потоковые писатели
+STREAM_MODES = {"L": 1, "RGB": 3, "RGBA": 4}
+# сколько сжатых байт копить перед выпуском IDAT-чанка
+PNG_CHUNK_BYTES = 1 << 20
+# целевой размер одного TIFF-strip'а до сжатия
+TIFF_STRIP_BYTES = 4 << 20
+# заголовок куска листа: режим, ширина, строк, adler32 и длина несжатых данных (для PNG)
+BAND_PART = struct.Struct("<4sIIII")
+# заголовок zlib-потока без подсказки об уровне и пустой финальный deflate-блок
+ZLIB_HEADER = b"\x78\x01"
+DEFLATE_END = b"\x03\x00"
+ADLER_BASE = 65521
+
+
+def png_sub_filter(rows, bpp):
+    """
+    Строки (h, w * bpp) uint8 с PNG-фильтром Sub: байт фильтра и разности
+    с соседним пикселем слева. То же ждёт FlateDecode с /Predictor 15 в PDF.
+    """
+    filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 1                                       # Sub
+    filtered[:, 1:bpp + 1] = rows[:, :bpp]
+    np.subtract(rows[:, bpp:], rows[:, :-bpp], out=filtered[:, bpp + 1:])
+    return filtered
+
+
+def deflate_png_rows(band, mode, compress_level=6):
+    """
+    Полоса PNG, сжатая отдельно от остальных: строки с фильтром Sub
+    (он не смотрит на соседние строки) → сырой deflate с SYNC_FLUSH,
+    который можно приклеить к кускам других процессов в один zlib-поток.
+    Возвращает (данные, adler32 несжатых, длина несжатых).
+    """
+    bpp = STREAM_MODES[mode]
+    a = np.asarray(band, dtype=np.uint8).reshape(band.height, band.width * bpp)
+    raw = png_sub_filter(a, bpp).tobytes()
+    z = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    return z.compress(raw) + z.flush(zlib.Z_SYNC_FLUSH), zlib.adler32(raw), len(raw)
+
+
+def adler32_combine(adler1, adler2, len2):
+    """adler32 склейки двух кусков по их контрольным суммам (как adler32_combine в zlib)."""
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - rem) % ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+class _StreamFile:
+    """Временный файл рядом с итоговым: переименовывается в close(), удаляется в abort()."""
+
+    def _open_tmp(self, path):
+        self.path = path
+        self._tmp = f"{path}.{os.getpid()}.tmp"
+        self._f = open(self._tmp, "wb")
+
+    def _finish(self):
+        self._f.close()
+        os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self):
+        """Бросает недописанный файл (рендер упал на середине)."""
+        self._f.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class PngStreamWriter(_StreamFile):
+    """PNG, записываемый полосами строк. Фильтр Sub считается в numpy."""
+
+    COLOR_TYPES = {"L": 0, "RGB": 2, "RGBA": 6}
+
+    def __init__(self, path, width, height, mode, dpi, compress_level=6):
+        self.width, self.height, self.mode = width, height, mode
+        self.bpp = STREAM_MODES[mode]
+        self.rows_written = 0
+        self._z = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_len = 0
+
+        self._open_tmp(path)
+        self._f.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8,
+                                         self.COLOR_TYPES[mode], 0, 0, 0))
+        ppm = int(dpi / 0.0254 + 0.5)
+        self._chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+
+    def _chunk(self, tag, data):
+        self._f.write(struct.pack(">I", len(data)) + tag + data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xFFFFFFFF))
+
+    def _emit(self, data, force=False):
+        if data:
+            self._pending.append(data)
+            self._pending_len += len(data)
+        if self._pending_len >= PNG_CHUNK_BYTES or (force and self._pending_len):
+            self._chunk(b"IDAT", b"".join(self._pending))
+            self._pending, self._pending_len = [], 0
+
+    def write(self, band):
+        """Дописывает полосу (Image того же режима и ширины)."""
+        a = np.asarray(band, dtype=np.uint8).reshape(band.height, self.width * self.bpp)
+        self._emit(self._z.compress(png_sub_filter(a, self.bpp).tobytes()))
+        self.rows_written += band.height
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"{self.path}: записано {self.rows_written} строк из {self.height}")
+        self._emit(self._z.flush(), force=True)
+        self._chunk(b"IEND", b"")
+        return self._finish()
+
+
+class PngPartsWriter(PngStreamWriter):
+    """PNG из полос, сжатых по отдельности deflate_png_rows — например, в разных процессах."""
+
+    def __init__(self, path, width, height, mode, dpi, compress_level=6):
+        super().__init__(path, width, height, mode, dpi, compress_level)
+        self._adler = 1
+        self._emit(ZLIB_HEADER)
+
+    def write_deflated(self, data, adler, length, rows):
+        """Дописывает уже сжатую полосу из rows строк."""
+        self._emit(data)
+        self._adler = adler32_combine(self._adler, adler, length)
+        self.rows_written += rows
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"{self.path}: записано {self.rows_written} строк из {self.height}")
+        self._emit(DEFLATE_END + struct.pack(">I", self._adler), force=True)
+        self._chunk(b"IEND", b"")
+        return self._finish()
+
+
+class TiffStripWriter(_StreamFile):
+    """
+    TIFF, записываемый полосами. Строки копятся до strip'а фиксированной высоты,
+    каждый strip сжимается Pillow (та же compression, что и в save_image),
+    а IFD со смещениями пишется в конце и подставляется в заголовок.
+    """
+
+    def __init__(self, path, width, height, mode, dpi, compression=None):
+        if compression not in STREAM_TIFF_COMPRESSIONS:
+            raise ValueError(f"сжатие TIFF {compression!r} полосами не пишется, "
+                             f"допустимы: {', '.join(map(str, STREAM_TIFF_COMPRESSIONS))}")
+        self.width, self.height, self.mode = width, height, mode
+        self.bpp = STREAM_MODES[mode]
+        self.dpi = dpi
+        self.compression = compression
+        self.rows_per_strip = max(1, min(height, TIFF_STRIP_BYTES // (width * self.bpp)))
+        self.rows_written = 0
+        self._buf = np.empty((0, width * self.bpp), dtype=np.uint8)
+        self._offsets, self._counts = [], []
+        self._compression_tag = 1
+
+        self._open_tmp(path)
+        self._f.write(b"II*\x00" + struct.pack("<I", 0))   # смещение IFD — в close()
+
+    def _encode_strip(self, rows):
+        img = Image.frombytes(self.mode, (self.width, rows.shape[0]), rows.tobytes())
+        out = io.BytesIO()
+        img.save(out, format="TIFF", compression=self.compression, strip_size=rows.nbytes + 1)
+        out.seek(0)
+        with Image.open(out) as tif:
+            offsets, counts = tif.tag_v2[273], tif.tag_v2[279]
+            self._compression_tag = tif.tag_v2.get(259, 1)
+        data = out.getvalue()
+        return b"".join(data[o:o + n] for o, n in zip(offsets, counts))
+
+    def _flush_strips(self, final=False):
+        while len(self._buf) >= self.rows_per_strip or (final and len(self._buf)):
+            rows, self._buf = self._buf[:self.rows_per_strip], self._buf[self.rows_per_strip:]
+            data = self._encode_strip(rows)
+            self._offsets.append(self._f.tell())
+            self._counts.append(len(data))
+            self._f.write(data)
+            if self._f.tell() & 1:                          # смещения в TIFF — по словам
+                self._f.write(b"\x00")
+
+    def write(self, band):
+        """Дописывает полосу (Image того же режима и ширины)."""
+        a = np.asarray(band, dtype=np.uint8).reshape(band.height, self.width * self.bpp)
+        self._buf = np.concatenate([self._buf, a]) if len(self._buf) else a
+        self.rows_written += band.height
+        self._flush_strips()
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"{self.path}: записано {self.rows_written} строк из {self.height}")
+        self._flush_strips(final=True)
+
+        n = len(self._offsets)
+        extra_samples = self.mode == "RGBA"
+        entries = 13 + extra_samples
+        ifd_off = self._f.tell()
+        data_off = ifd_off + 2 + entries * 12 + 4
+        xres_off, bits_off = data_off, data_off + 16
+        offsets_off = bits_off + 2 * self.bpp
+        counts_off = offsets_off + 4 * n
+
+        def entry(tag, typ, count, value):
+            if typ == 3 and count == 1:
+                return struct.pack("<HHIHH", tag, typ, count, value, 0)
+            return struct.pack("<HHII", tag, typ, count, value)
+
+        ifd = struct.pack("<H", entries)
+        ifd += entry(256, 4, 1, self.width)
+        ifd += entry(257, 4, 1, self.height)
+        ifd += entry(258, 3, self.bpp, bits_off) if self.bpp > 2 else entry(258, 3, 1, 8)
+        ifd += entry(259, 3, 1, self._compression_tag)
+        ifd += entry(262, 3, 1, 1 if self.mode == "L" else 2)
+        ifd += entry(273, 4, n, offsets_off) if n > 1 else entry(273, 4, 1, self._offsets[0])
+        ifd += entry(277, 3, 1, self.bpp)
+        ifd += entry(278, 4, 1, self.rows_per_strip)
+        ifd += entry(279, 4, n, counts_off) if n > 1 else entry(279, 4, 1, self._counts[0])
+        ifd += entry(282, 5, 1, xres_off)
+        ifd += entry(283, 5, 1, xres_off + 8)
+        ifd += entry(284, 3, 1, 1)
+        ifd += entry(296, 3, 1, 2)
+        if extra_samples:
+            ifd += entry(338, 3, 1, 2)                      # несвязанная альфа
+        ifd += struct.pack("<I", 0)
+
+        dpi = int(round(self.dpi))
+        tail = struct.pack("<II", dpi, 1) * 2
+        tail += struct.pack(f"<{self.bpp}H", *([8] * self.bpp))
+        tail += struct.pack(f"<{n}I", *self._offsets)
+        tail += struct.pack(f"<{n}I", *self._counts)
+
+        self._f.write(ifd + tail)
+        self._f.seek(4)
+        self._f.write(struct.pack("<I", ifd_off))
+        return self._finish()
+
+
+def open_stream_writer(path, width, height, mode, dpi, cfg):
+    """Потоковый писатель для cfg.output_format (только png и tiff)."""
+    if output_format(cfg) == "tiff":
+        return TiffStripWriter(path, width, height, mode, dpi, cfg.tiff_compression)
+    return PngStreamWriter(path, width, height, mode, dpi, cfg.png_compress_level)
+
+
+# ──────────────────────────────
+# 🧩 Куски листа из разных процессов
+# ──────────────────────────────
+def write_band_part(path, band, mode, cfg):
+    """
+    Кусок листа для join_band_parts: для PNG — уже сжатые строки
+    (deflate_png_rows), иначе сырые пиксели в режиме mode (None — как есть).
+    """
+    adler = length = 0
+    if mode and output_format(cfg) == "png":
+        data, adler, length = deflate_png_rows(band.convert(mode), mode, cfg.png_compress_level)
+    else:
+        if mode:
+            band = band.convert(mode)
+        mode, data = band.mode, band.tobytes()
+    with atomic_output(path) as tmp, open(tmp, "wb") as f:
+        f.write(BAND_PART.pack(mode.ljust(4).encode("ascii"), band.width, band.height, adler, length))
+        f.write(data)
+    return path
+
+
+def read_band_part(path):
+    """(режим, ширина, строк, adler32, длина несжатых, данные) куска из write_band_part."""
+    with open(path, "rb") as f:
+        blob = f.read()
+    mode, width, rows, adler, length = BAND_PART.unpack_from(blob)
+    return mode.decode("ascii").strip(), width, rows, adler, length, blob[BAND_PART.size:]
+
+
+def join_band_parts(out_path, parts, width, height, mode, dpi, cfg):
+    """Склеивает куски (сверху вниз) в PNG или TIFF потоковым писателем."""
+    if output_format(cfg) == "png":
+        writer = PngPartsWriter(out_path, width, height, mode, dpi, cfg.png_compress_level)
+    else:
+        writer = TiffStripWriter(out_path, width, height, mode, dpi, cfg.tiff_compression)
+    try:
+        for part in parts:
+            part_mode, part_w, rows, adler, length, data = read_band_part(part)
+            if output_format(cfg) == "png":
+                writer.write_deflated(data, adler, length, rows)
+            else:
+                writer.write(Image.frombytes(part_mode, (part_w, rows), data))
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# модули проекта лежат в корне репозитория, не в пакете
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,22 @@
+import pytest
+from PIL import Image
+
+from config import Config
+from stream_writer import write_band_part, join_band_parts
+
+
+@pytest.mark.parametrize("fmt, mode", [("png", "RGB"), ("png", "L"), ("tiff", "RGB")])
+def test_joined_bands_match_whole_sheet(tmp_path, fmt, mode):
+    cfg = Config()
+    cfg.output_format = fmt
+    sheet = Image.effect_mandelbrot((97, 61), (-2, -1.5, 1, 1.5), 40).convert("RGBA")
+
+    parts = []
+    for y0, y1 in ((0, 20), (20, 21), (21, 61)):
+        path = str(tmp_path / f"sheet.rows{y0}.part")
+        parts.append(write_band_part(path, sheet.crop((0, y0, sheet.width, y1)), mode, cfg))
+
+    out = join_band_parts(str(tmp_path / f"sheet.{fmt}"), parts, *sheet.size, mode, 300, cfg)
+    with Image.open(out) as joined:
+        assert joined.size == sheet.size
+        assert joined.tobytes() == sheet.convert(mode).tobytes()
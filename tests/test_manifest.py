@@ -0,0 +1,26 @@
+import os
+
+from config import Config
+from manifest import artifact_key
+
+
+def test_artifact_key_follows_source_and_font(tmp_path):
+    cfg = Config()
+    cfg.project_dir = str(tmp_path)
+    cfg.input_file = str(tmp_path / "map.tif")
+    cfg.font_path = str(tmp_path / "font.otf")
+    page = {"index": 1, "matrix": [["А1"]], "rotation_matrix": [[0]]}
+    for path, data in ((cfg.input_file, b"source"), (cfg.font_path, b"font")):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    key = artifact_key(cfg, "shuffled", page)
+    assert artifact_key(cfg, "shuffled", page) == key
+
+    for path in (cfg.input_file, cfg.font_path):
+        with open(path, "ab") as f:
+            f.write(b" changed")
+        os.utime(path, ns=(1, 1))
+        changed = artifact_key(cfg, "shuffled", page)
+        assert changed != key
+        key = changed
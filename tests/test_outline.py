@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import utils
+from utils import draw_text_with_outline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT = os.path.join(ROOT, "resources", "DearType - Lifehack Sans Medium.otf")
+
+
+def test_outline_is_disc_dilation():
+    font = ImageFont.truetype(FONT, 60)
+    r = 6
+    text_mask, outline_mask, _, _ = utils._outline_masks("Ж17", font, r)
+
+    a = np.asarray(text_mask).astype(int)
+    expected = np.zeros_like(a)
+    for dx in range(-r, r + 1):
+        for dy in range(-r, r + 1):
+            if dx * dx + dy * dy <= r * r:
+                expected = np.maximum(expected, np.roll(np.roll(a, dy, 0), dx, 1))
+    assert (np.asarray(outline_mask) == expected).all()
+
+
+def test_label_masks_are_reused_at_any_position():
+    font = ImageFont.truetype(FONT, 40)
+    utils._outline_cache.clear()
+    draw = ImageDraw.Draw(Image.new("RGB", (200, 200), "white"))
+    for pos in ((10, 10), (50.5, 20.25), (100.7, 99.5)):
+        draw_text_with_outline(draw, pos, "А1", font, "black", "white", 4)
+    assert len(utils._outline_cache) == 1
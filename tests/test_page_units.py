@@ -0,0 +1,33 @@
+import os
+
+from PIL import Image
+
+from config import Config
+from sheets import render_page_unit, render_page_outputs
+from tile_store import TileStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_multi_page_unit_matches_single_pages(tmp_path):
+    cfg = Config()
+    cfg.project_name = "pages"
+    cfg.cols, cfg.rows = 2, 2
+    cfg.font_path = os.path.join(ROOT, cfg.font_path)
+    tile = 40
+    img = Image.effect_mandelbrot((cfg.cols * tile, cfg.rows * tile), (-2, -1.5, 1, 1.5), 40).convert("RGB")
+    pages = [{"index": 1, "matrix": [["А1", "Б2"]], "rotation_matrix": [[90, 0]]},
+             {"index": 2, "matrix": [["Б1", "А2"]], "rotation_matrix": [[0, 270]]}]
+    one, many = tmp_path / "one", tmp_path / "many"
+    one.mkdir(), many.mkdir()
+
+    with TileStore.from_image(img, tile, cfg) as store:
+        results = render_page_unit(cfg, store, pages, 4, 100, str(many))
+        for page in pages:
+            render_page_outputs(cfg, page, store, 4, 100, str(one))
+
+    assert sorted(results) == [(i, kind) for i in (1, 2) for kind in ("answers", "shuffled", "shuffled_rot")]
+    for path in results.values():
+        assert os.path.dirname(path) == str(many)
+        with Image.open(path) as got, Image.open(one / os.path.basename(path)) as expected:
+            assert got.tobytes() == expected.tobytes()
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+
+import pytest
+from PIL import Image
+
+from config import Config
+from state_file import write_state, read_state
+from tiles import load_random_state
+
+# config.json в том виде, в каком его писал старый Config.save() (до LAYOUT_KEYS)
+BASELINE_CONFIG = {
+    "project_name": "legacy",
+    "random_seed": 63235212,
+    "input_file": "out/legacy/map.png",
+    "cols": 3,
+    "rows": 2,
+    "grid_line_width": 16,
+    "font_scale": 1.0,
+    "tile_mm_target": 30.0,
+    "font_path": "resources/DearType - Lifehack Sans Medium.otf",
+    "letters": list("АБВГДЕЖИКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"),
+    "sheet_w_mm": 210,
+    "sheet_h_mm": 297,
+    "sheet_export_dpi": 1200,
+    "shuffled_tile_mm": 20,
+    "gap_mm": 2.5,
+    "margin_mm": 3,
+    "rotate_tiles": None,
+}
+
+BASELINE_PAGE = {
+    "index": 1,
+    "rotated": True,
+    "matrix": [["Б2", "А1", "А3"], ["Б1", "А2", "Б3"], [None, None, None]],
+    "rotation_matrix": [[90, 0, 270], [180, 90, 0], [0, 0, 0]],
+}
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_state_written_by_baseline_is_accepted(tmp_path, monkeypatch, newline):
+    """random_state.json со старым ключом (sha256 всего config.json) принимается и переводится в .bin."""
+    monkeypatch.chdir(tmp_path)
+    project = tmp_path / "out" / "legacy"
+    project.mkdir(parents=True)
+    Image.new("RGB", (30, 20), "white").save(project / "map.png")
+
+    raw = json.dumps(BASELINE_CONFIG, indent=4, ensure_ascii=False).replace("\n", newline).encode("utf-8")
+    (project / "config.json").write_bytes(raw)
+    (project / "random_state.json").write_text(json.dumps({
+        "config_hash": hashlib.sha256(raw).hexdigest(),
+        "seed": BASELINE_CONFIG["random_seed"],
+        "tiles_per_row": 3,
+        "tiles_per_col": 3,
+        "pages": [BASELINE_PAGE],
+    }, ensure_ascii=False), encoding="utf-8")
+
+    cfg = Config().load("legacy")
+    state = load_random_state(cfg)
+
+    assert state is not None
+    assert list(state["pages"]) == [BASELINE_PAGE]
+    assert os.path.exists(cfg.random_state_file)
+    # после перевода на хэш раскладки state узнаётся и без старого ключа
+    cfg.loaded_file_digest = None
+    assert load_random_state(cfg) is not None
+
+
+def test_changed_layout_invalidates_baseline_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    project = tmp_path / "out" / "legacy"
+    project.mkdir(parents=True)
+    Image.new("RGB", (30, 20), "white").save(project / "map.png")
+
+    raw = json.dumps(BASELINE_CONFIG, indent=4, ensure_ascii=False).encode("utf-8")
+    (project / "config.json").write_bytes(raw)
+    (project / "random_state.json").write_text(json.dumps({
+        "config_hash": hashlib.sha256(b"other config").hexdigest(),
+        "pages": [BASELINE_PAGE],
+    }), encoding="utf-8")
+
+    assert load_random_state(Config().load("legacy")) is None
+
+
+LETTERS = list("АБВГД")
+
+ROUND_TRIP_STATE = {
+    "config_hash": "abc",
+    "seed": 7,
+    "rng": "seedseq-pages-v1",
+    "tiles_per_row": 3,
+    "tiles_per_col": 2,
+    "pages": [
+        {"index": 1, "rotated": True, "sheet": [210, 297],
+         "matrix": [["Б2", "А1", "Д5"], ["Б1", "А2", "Г3"]],
+         "rotation_matrix": [[90, 0, 270], [180, 90, 0]]},
+        {"index": 2, "rotated": False, "sheet": [148, 210],
+         "matrix": [["В4", None, None], [None, None, None]],
+         "rotation_matrix": [[0, 0, 0], [0, 0, 0]]},
+        {"index": 3, "rotated": True,
+         "matrix": [["А5", "Б5"]],
+         "rotation_matrix": [[0, 270]]},
+    ],
+}
+
+
+def test_state_file_round_trip(tmp_path):
+    path = str(tmp_path / "random_state.bin")
+    write_state(path, ROUND_TRIP_STATE, LETTERS, 5)
+    state = read_state(path)
+
+    assert {k: v for k, v in state.items() if k != "pages"} == \
+        {k: v for k, v in ROUND_TRIP_STATE.items() if k != "pages"}
+    assert list(state["pages"]) == ROUND_TRIP_STATE["pages"]
+    assert state["pages"]._bits == 2               # 0/90/180/270 — по 2 бита на клетку
+
+
+def test_lazy_pages_access(tmp_path):
+    path = str(tmp_path / "random_state.bin")
+    write_state(path, ROUND_TRIP_STATE, LETTERS, 5)
+    pages = read_state(path)["pages"]
+    expected = ROUND_TRIP_STATE["pages"]
+
+    assert len(pages) == 3
+    assert pages._cache == {}                      # ничего не прочитано заранее
+    assert pages[-1] == expected[2]
+    assert list(pages._cache) == [2]
+    assert pages[0:2] == expected[0:2]
+    assert pages.by_index([3, 1, 3, 9]) == [expected[0], expected[2]]
+    with pytest.raises(IndexError):
+        pages[3]
+
+
+def test_float_angles_use_8bit_codes(tmp_path):
+    angles = [0, 15, 22.5, 45, 90, 180, 270, -7.5]
+    state = dict(ROUND_TRIP_STATE, pages=[{
+        "index": 1, "rotated": True,
+        "matrix": [["А1", "А2", "А3", "А4"], ["Б1", "Б2", "Б3", "Б4"]],
+        "rotation_matrix": [angles[:4], angles[4:]],
+    }])
+    path = str(tmp_path / "random_state.bin")
+    write_state(path, state, LETTERS, 5)
+    loaded = read_state(path)
+
+    assert loaded["pages"]._bits == 8
+    assert loaded["pages"][0]["rotation_matrix"] == [angles[:4], angles[4:]]
+    assert isinstance(loaded["pages"][0]["rotation_matrix"][0][2], float)
@@ -0,0 +1,55 @@
+import copy
+
+import pytest
+
+from config import Config
+from state_file import write_state, read_state
+from tiles import generate_random_state, regenerate_page
+
+
+def make_cfg(**overrides):
+    cfg = Config()
+    cfg.cols, cfg.rows = 9, 7
+    cfg.random_seed = 12345
+    cfg.shuffled_tile_mm = 60
+    for name, value in overrides.items():
+        setattr(cfg, name, value)
+    return cfg
+
+
+def make_tiles(cfg, exclude=("А1", "В5", "Ж9")):
+    return [((r, c), f"{cfg.letters[r]}{c + 1}", None)
+            for r in range(cfg.rows) for c in range(cfg.cols)
+            if f"{cfg.letters[r]}{c + 1}" not in exclude]
+
+
+@pytest.mark.parametrize("overrides", [
+    {},
+    {"rotate_tiles": [0, 22.5, 45, 90]},
+    {"sheet_formats": ["A5", "A4"]},
+])
+def test_regenerate_page_matches_full_generation(tmp_path, overrides):
+    cfg = make_cfg(**overrides)
+    state = generate_random_state(cfg, make_tiles(cfg), save=False)
+    assert len(state["pages"]) > 2
+    before = copy.deepcopy(state["pages"])
+
+    # страница пересчитывается отдельно — в любом порядке, и соседние не меняются
+    for index in reversed(range(1, len(state["pages"]) + 1)):
+        assert regenerate_page(cfg, state, index) == state["pages"][index - 1]
+    assert state["pages"] == before
+
+    # и из random_state.bin, где страницы читаются лениво
+    path = str(tmp_path / "random_state.bin")
+    write_state(path, state, cfg.letters, cfg.cols)
+    loaded = read_state(path)
+    for index in range(1, len(loaded["pages"]) + 1):
+        assert regenerate_page(cfg, loaded, index) == before[index - 1]
+
+
+def test_regenerate_page_rejects_old_rng_scheme():
+    cfg = make_cfg()
+    state = generate_random_state(cfg, make_tiles(cfg), save=False)
+    state["rng"] = None
+    with pytest.raises(ValueError):
+        regenerate_page(cfg, state, 1)
@@ -0,0 +1,84 @@
+import os
+
+from config import Config
+from manifest import RunManifest
+from render_cache import RenderCache
+
+
+def make_cache(tmp_path):
+    cfg = Config()
+    cfg.project_dir = str(tmp_path / "project")
+    cfg.input_file = str(tmp_path / "map.tif")
+    cfg.font_path = str(tmp_path / "font.otf")
+    os.makedirs(cfg.project_dir)
+    with open(cfg.input_file, "wb") as f:
+        f.write(b"source")
+    return cfg, RenderCache(cfg, 4, 100)
+
+
+def test_fetch_rejects_damaged_entry(tmp_path):
+    cfg, cache = make_cache(tmp_path)
+    page = {"index": 1, "matrix": [["А1"]], "rotation_matrix": [[0]]}
+    key = cache.key("answers", page)
+    out = tmp_path / "run"
+    out.mkdir()
+    sheet = str(out / "answers_sheet_1.png")
+    with open(sheet, "wb") as f:
+        f.write(b"x" * 1000)
+    cache.store(key, sheet)
+
+    again = str(tmp_path / "answers_sheet_1.png")
+    assert cache.fetch(key, again)
+    with open(cache._path(key, sheet), "r+b") as f:
+        f.truncate(500)
+
+    assert not cache.fetch(key, again)
+    assert not cache.has(key, sheet)
+
+
+def test_manifest_tells_damaged_from_unknown(tmp_path):
+    manifest = RunManifest(str(tmp_path))
+    path = tmp_path / "shuffled_1.png"
+    path.write_bytes(b"sheet")
+    manifest.record(str(path), "shuffled", "k1", 1)
+
+    assert manifest.verify("shuffled_1.png", "k1") is True
+    assert manifest.verify("shuffled_1.png", "k2") is None
+    path.write_bytes(b"shee")
+    assert manifest.verify("shuffled_1.png", "k1") is False
+    assert not manifest.is_done("shuffled_1.png", "k1")
+
+
+def test_fetched_sheet_is_a_copy(tmp_path):
+    cfg, cache = make_cache(tmp_path)
+    sheet = str(tmp_path / "grid.png")
+    with open(sheet, "wb") as f:
+        f.write(b"grid" * 100)
+    key = cache.key("grid")
+    cache.store(key, sheet)
+    assert os.stat(sheet).st_nlink == 1
+
+    copy = str(tmp_path / "copy.png")
+    assert cache.fetch(key, copy)
+    with open(copy, "r+b") as f:
+        f.truncate(10)
+    assert cache.fetch(key, copy)
+    assert os.path.getsize(copy) == 400
+
+
+def test_sheet_cache_evicts_least_recently_used(tmp_path):
+    cfg, cache = make_cache(tmp_path)
+    keys = []
+    for i in range(3):
+        sheet = str(tmp_path / f"shuffled_{i}.png")
+        with open(sheet, "wb") as f:
+            f.write(bytes([i]) * 1000)
+        keys.append(cache.key("shuffled", {"index": i, "matrix": [["А1"]]}))
+        cache.store(keys[-1], sheet)
+        for path in (cache._path(keys[-1], sheet), cache._meta_path(keys[-1])):
+            os.utime(path, ns=(i + 1, i + 1))
+
+    assert cache.fetch(keys[0], str(tmp_path / "read.png"))    # первый лист недавно читали
+    cache.max_bytes = 2500
+    cache.trim()
+    assert [cache.has(key, "x.png") for key in keys] == [True, False, True]
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from PIL import Image
+
+from config import Config
+from rotation import rotate_tile, paste_tile
+from sheets import render_page_outputs, compute_layout, tile_position
+from tile_store import TileStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_right_angles_match_image_rotate():
+    tile = Image.effect_mandelbrot((64, 64), (-2, -1.5, 1, 1.5), 50).convert("RGB")
+    for angle in (90, 180, 270, -90, 450, 90.0):
+        assert rotate_tile(tile, angle).tobytes() == tile.rotate(angle, expand=True).tobytes()
+
+
+@pytest.mark.parametrize("angle", [30, 135, -15])
+def test_arbitrary_angle_leaves_corners_transparent(angle):
+    tile = Image.new("RGB", (60, 60), (200, 40, 40))
+    rotated = rotate_tile(tile, angle)
+    assert rotated.size == (60, 60)
+    assert rotated.mode == "RGBA"
+    assert rotated.getpixel((0, 0))[3] == 0
+    assert rotated.getpixel((30, 30)) == (200, 40, 40, 255)
+
+    sheet = Image.new("RGBA", (60, 60), (255, 255, 255, 255))
+    paste_tile(sheet, rotated, (0, 0), angle)
+    assert sheet.getpixel((0, 0)) == (255, 255, 255, 255)
+
+
+def test_rotated_sheet_has_no_black_corners(tmp_path):
+    cfg = Config()
+    cfg.project_name = "rot"
+    cfg.cols, cfg.rows = 2, 1
+    cfg.font_path = os.path.join(ROOT, cfg.font_path)
+    tile = 40
+    img = Image.new("RGB", (cfg.cols * tile, cfg.rows * tile), (200, 40, 40))
+    px_per_mm = 4
+    page = {"index": 1, "matrix": [["А1", "А2"]], "rotation_matrix": [[30, 0]]}
+
+    with TileStore.from_image(img, tile, cfg) as store:
+        path = render_page_outputs(cfg, page, store, px_per_mm, 100, str(tmp_path), ("shuffled_rot",))["shuffled_rot"]
+
+    with Image.open(path) as sheet:
+        sheet = sheet.convert("RGB")
+        x, y = tile_position(compute_layout(cfg, page["matrix"], px_per_mm), 0, 0)
+        assert sheet.getpixel((x, y + 2)) == (255, 255, 255)
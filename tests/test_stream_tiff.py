@@ -0,0 +1,26 @@
+import pytest
+from PIL import Image
+
+from config import Config
+from stream_writer import TiffStripWriter
+from writer import STREAM_TIFF_COMPRESSIONS, stream_mode
+
+
+@pytest.mark.parametrize("compression", STREAM_TIFF_COMPRESSIONS)
+def test_strip_writer_round_trip(tmp_path, compression):
+    img = Image.effect_mandelbrot((70, 45), (-2, -1.5, 1, 1.5), 40).convert("RGB")
+    writer = TiffStripWriter(str(tmp_path / "sheet.tif"), *img.size, "RGB", 300, compression)
+    for y0, y1 in ((0, 20), (20, 45)):
+        writer.write(img.crop((0, y0, img.width, y1)))
+    with Image.open(writer.close()) as tif:
+        assert tif.tobytes() == img.tobytes()
+
+
+def test_jpeg_compressed_tiff_is_not_streamed(tmp_path):
+    cfg = Config()
+    cfg.output_format = "tiff"
+    cfg.tiff_compression = "jpeg"
+    assert stream_mode(cfg, "grid", "RGB") is None
+    assert stream_mode(cfg, "shuffled", "RGB") is None
+    with pytest.raises(ValueError, match="jpeg"):
+        TiffStripWriter(str(tmp_path / "sheet.tif"), 10, 10, "RGB", 300, "jpeg")
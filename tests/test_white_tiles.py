@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import Config
+from white_tiles import compute_tile_stats, detect_white_tiles, white_mask, white_score
+
+
+def make_image(cfg, tile=16):
+    img = Image.new("L", (cfg.cols * tile, cfg.rows * tile), 255)
+    img.paste(90, (tile, 0, 2 * tile, tile))              # тёмный тайл
+    img.putpixel((tile // 2, tile + tile // 2), 200)      # пылинка на белом
+    return img.convert("RGB")
+
+
+@pytest.mark.parametrize("stat", ["min", "percentile", "mean_std"])
+def test_detect_computes_only_needed_stats(stat):
+    cfg = Config()
+    cfg.cols, cfg.rows = 3, 2
+    cfg.white_stat = stat
+    img = make_image(cfg)
+
+    full = compute_tile_stats(img, cfg)
+    assert sorted(full) == ["mean", "min", "percentile", "std"]
+    expected = [f"{cfg.letters[r]}{c + 1}" for r, c in zip(*np.nonzero(white_mask(full, cfg)))]
+    assert detect_white_tiles(img, cfg) == expected
+
+
+def test_min_path_skips_other_stats():
+    cfg = Config()
+    cfg.cols, cfg.rows = 3, 2
+    assert list(compute_tile_stats(make_image(cfg), cfg, stats=("min",))) == ["min"]
+
+
+def test_unknown_white_stat_is_rejected():
+    cfg = Config()
+    cfg.white_stat = "median"
+    with pytest.raises(ValueError, match="median"):
+        white_score({}, cfg)
@@ -0,0 +1,23 @@
+import pytest
+from PIL import Image
+
+from config import Config
+from writer import output_extension, save_image
+
+
+@pytest.mark.parametrize("name, ext, fmt", [("jpg", ".jpg", "JPEG"), ("JPEG", ".jpg", "JPEG"),
+                                             ("tif", ".tif", "TIFF"), ("png", ".png", "PNG")])
+def test_format_aliases(tmp_path, name, ext, fmt):
+    cfg = Config()
+    cfg.output_format = name
+    assert output_extension(cfg) == ext
+    path = save_image(Image.new("RGBA", (8, 8), "white"), str(tmp_path / f"sheet{ext}"), cfg, "shuffled", 100)
+    with Image.open(path) as img:
+        assert img.format == fmt
+
+
+def test_unknown_format_is_rejected():
+    cfg = Config()
+    cfg.output_format = "bmp"
+    with pytest.raises(ValueError, match="bmp"):
+        output_extension(cfg)
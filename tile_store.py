@@ -0,0 +1,172 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+from PIL import Image
+
+
+# ──────────────────────────────
+# 🧠 Хранилище тайлов в общей памяти
+# ──────────────────────────────
+class TileStore:
+    """
+    Исходный растр, разложенный по тайлам в multiprocessing.shared_memory.
+
+    Раскладка «тайл за тайлом» (rows, cols, tile, tile, bands): каждый тайл
+    лежит в памяти непрерывным куском, поэтому воркер получает его как
+    PIL.Image поверх общего буфера без копирования.
+
+    Ведёт себя как словарь {coord: Image} (`coord in store`, `store[coord]`),
+    поэтому подставляется вместо старого img_tiles. При передаче в другой
+    процесс пиклится только имя сегмента и геометрия, а не пиксели.
+    """
+
+    def __init__(self, shm, mode, tile_size, cols, rows, letters, exclude_coords, owner):
+        self._shm = shm
+        self.mode = mode
+        self.tile_size = tile_size
+        self.cols = cols
+        self.rows = rows
+        self.letters = list(letters)
+        self.exclude_coords = set(exclude_coords)
+        self._owner = owner
+        self._bands = len(mode)
+        self._tile_bytes = tile_size * tile_size * self._bands
+
+    # === создание / подключение ===
+    @classmethod
+    def from_image(cls, img, tile_size, cfg, exclude_coords=()):
+        """Декодирует растр один раз и раскладывает его по тайлам в общую память."""
+        mode = "RGBA" if "A" in img.mode else "RGB"
+        bands = len(mode)
+        size = cfg.rows * cfg.cols * tile_size * tile_size * bands
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        store = cls(shm, mode, tile_size, cfg.cols, cfg.rows, cfg.letters,
+                    exclude_coords, owner=True)
+
+        # заполняем по одной строке тайлов, чтобы не держать вторую копию всего растра
+        for row in range(cfg.rows):
+            band = img.crop((0, row * tile_size, cfg.cols * tile_size, (row + 1) * tile_size))
+            if band.mode != mode:
+                band = band.convert(mode)
+            for col in range(cfg.cols):
+                tile = band.crop((col * tile_size, 0, (col + 1) * tile_size, tile_size))
+                offset = store._offset(row, col)
+                shm.buf[offset:offset + store._tile_bytes] = tile.tobytes()
+
+        print(f"🧠 Тайлы размещены в общей памяти: {size / 2**20:.1f} МБ ({shm.name})")
+        return store
+
+    @classmethod
+    def attach(cls, name, mode, tile_size, cols, rows, letters, exclude_coords):
+        """Подключается к уже созданному сегменту (в воркере)."""
+        # сегмент принадлежит родителю — воркер не должен удалять его при выходе
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # при fork трекер общий с родителем, иначе у воркера свой — снимаем регистрацию
+            if multiprocessing.get_start_method() != "fork":
+                resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, mode, tile_size, cols, rows, letters, exclude_coords, owner=False)
+
+    def __reduce__(self):
+        return (TileStore.attach, (self._shm.name, self.mode, self.tile_size, self.cols,
+                                   self.rows, self.letters, sorted(self.exclude_coords)))
+
+    def close(self):
+        """Отключается от сегмента; владелец дополнительно удаляет его."""
+        try:
+            self._shm.close()
+        except BufferError:
+            # ещё живы Image поверх буфера — отпускаем ссылки, отображение
+            # освободится вместе с последним из них
+            self._shm._buf = None
+            self._shm._mmap = None
+        if self._owner:
+            self._shm.unlink()
+            self._owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # === доступ к тайлам ===
+    def _offset(self, row, col):
+        return (row * self.cols + col) * self._tile_bytes
+
+    def _parse(self, coord):
+        if not coord or coord[0] not in self.letters:
+            return None
+        try:
+            row, col = self.letters.index(coord[0]), int(coord[1:]) - 1
+        except ValueError:
+            return None
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row, col
+        return None
+
+    def tile_at(self, row, col):
+        """Тайл по индексам строки/столбца — Image поверх общей памяти, без копии."""
+        offset = self._offset(row, col)
+        buf = self._shm.buf[offset:offset + self._tile_bytes]
+        return Image.frombuffer(self.mode, (self.tile_size, self.tile_size), buf,
+                                "raw", self.mode, 0, 1)
+
+    @property
+    def nbytes(self):
+        """Сколько занимает сегмент общей памяти (учитывается в бюджете --max-memory)."""
+        return self.rows * self.cols * self._tile_bytes
+
+    # === интерфейс «как у Image» для split_tiles и прочих ===
+    @property
+    def width(self):
+        return self.cols * self.tile_size
+
+    @property
+    def height(self):
+        return self.rows * self.tile_size
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def crop(self, box):
+        """
+        Вырезает область. Для прямоугольника ровно по тайлу — без копии,
+        иначе собирает область из задетых тайлов.
+        """
+        x0, y0, x1, y1 = (int(v) for v in box)
+        t = self.tile_size
+        if x1 - x0 == t and y1 - y0 == t and x0 % t == 0 and y0 % t == 0:
+            return self.tile_at(y0 // t, x0 // t)
+
+        out = Image.new(self.mode, (x1 - x0, y1 - y0))
+        for row in range(max(y0 // t, 0), min((y1 - 1) // t + 1, self.rows)):
+            for col in range(max(x0 // t, 0), min((x1 - 1) // t + 1, self.cols)):
+                out.paste(self.tile_at(row, col), (col * t - x0, row * t - y0))
+        return out
+
+    def __contains__(self, coord):
+        return coord not in self.exclude_coords and self._parse(coord) is not None
+
+    def __getitem__(self, coord):
+        if coord not in self:
+            raise KeyError(coord)
+        return self.tile_at(*self._parse(coord))
+
+    def __len__(self):
+        return self.rows * self.cols - len(self.exclude_coords)
+
+    def __iter__(self):
+        for row in range(self.rows):
+            for col in range(self.cols):
+                coord = f"{self.letters[row]}{col+1}"
+                if coord not in self.exclude_coords:
+                    yield coord
+
+    def __repr__(self):
+        return (f"TileStore({self._shm.name}, {self.cols}×{self.rows}, "
+                f"tile={self.tile_size}px, mode={self.mode}, pid={os.getpid()})")
@@ -1,12 +1,17 @@
 import os
 import json
-import random
-import math
 import hashlib
+import numpy as np
 from tqdm import tqdm
 
 from PIL import Image
 
+from state_file import write_state, read_state
+from sheet_planner import sheet_capacity, plan_sheets
+
+# схема случайности random_state: SeedSequence-потоки на страницу (записывается в файл)
+RNG_SCHEME = "seedseq-pages-v1"
+
 
 def split_tiles(img, cfg, exclude_coords):
     """Разбивает исходное изображение на тайлы (фильтрует исключённые)."""
@@ -27,114 +32,167 @@ def split_tiles(img, cfg, exclude_coords):
 # ====================== RANDOM STATE CONTROL ========================== #
 # ====================================================================== #
 
-def generate_random_state(cfg, tiles):
+def rotation_angles(cfg):
+    """Набор углов для поворотов: None — 90/180/270, список чисел — он сам, иначе без поворотов."""
+    if cfg.rotate_tiles is None:
+        return [90, 180, 270]
+    if isinstance(cfg.rotate_tiles, (list, tuple)) and cfg.rotate_tiles and \
+            all(isinstance(x, (int, float)) for x in cfg.rotate_tiles):
+        return list(cfg.rotate_tiles)
+    return [0]
+
+
+def page_rng(seed, stream):
+    """
+    Независимый генератор потока stream: 0 — раздача тайлов по страницам,
+    N — страница N. То же, что SeedSequence(seed).spawn(...)[stream], но без
+    создания остальных потоков, поэтому любую страницу можно пересчитать отдельно.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream,)))
+
+
+def coord_names(cfg):
+    """Координаты всех клеток по коду тайла row * cols + col (как в random_state.bin)."""
+    return np.array([f"{cfg.letters[r]}{c + 1}" for r in range(cfg.rows) for c in range(cfg.cols)],
+                    dtype=object)
+
+
+def tile_codes(cfg, coords):
+    """Координаты «Б7» → коды row * cols + col."""
+    letter_row = {l: i for i, l in enumerate(cfg.letters)}
+    return np.array([letter_row[coord[0]] * cfg.cols + int(coord[1:]) - 1 for coord in coords], dtype=np.int64)
+
+
+def deal_tiles(cfg, codes, capacities):
+    """Перемешивает коды тайлов потоком 0 и режет на страницы: capacities — вместимость каждой."""
+    shuffled = codes[page_rng(cfg.random_seed, 0).permutation(len(codes))]
+    bounds = np.cumsum([0] + list(capacities))
+    return [shuffled[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def generate_page(cfg, page_index, page_codes, names, tiles_per_row, tiles_per_col, sheet=None):
+    """
+    Страница page_index (с 1) из кодов её тайлов: порядок в сетке и углы
+    берутся из собственного потока страницы, так что страница не зависит
+    от соседних. Результат зависит только от набора тайлов, не от их порядка.
+    sheet — формат листа (w_mm, h_mm) от планировщика, None — лист из конфига.
     """
-    Создаёт и возвращает структуру random_state.json:
+    rng = page_rng(cfg.random_seed, page_index)
+    n_cells = tiles_per_row * tiles_per_col
+    codes = np.sort(page_codes)
+    n = len(codes)
+
+    cells = np.full(n_cells, None, dtype=object)
+    cells[:n] = names[codes[rng.permutation(n)]]
+    angles = np.asarray(rotation_angles(cfg))
+    rotations = np.zeros(n_cells, dtype=angles.dtype)
+    rotations[:n] = angles[rng.integers(0, len(angles), size=n)]
+
+    page = {
+        "index": page_index,
+        "rotated": bool(rotations.any()),
+        "matrix": cells.reshape(tiles_per_col, tiles_per_row).tolist(),
+        "rotation_matrix": rotations.reshape(tiles_per_col, tiles_per_row).tolist()
+    }
+    if sheet:
+        page["sheet"] = list(sheet)
+    return page
+
+
+def generate_random_state(cfg, tiles, save=True):
+    """
+    Создаёт и возвращает структуру random_state:
       - matrix с координатами тайлов
       - rotation_matrix с углами поворота
-      - распределение по страницам
+      - распределение по страницам и формат листа каждой (sheet_planner)
+    Случайность — потоки SeedSequence от (сид, номер): поток 0 раздаёт тайлы
+    по страницам, у каждой страницы свой поток для порядка и поворотов.
+    save=False — только в памяти (предпросмотр не трогает random_state проекта).
     """
-    print("🎲 Генерация нового random_state.json ...")
+    print("🎲 Генерация нового random_state ...")
 
-    # Фиксируем сид (гарантирует повторяемость)
+    # сид должен быть задан (init_random создаёт и сохраняет новый)
     cfg.init_random()
 
     total_tiles = len(tiles)
     print(f"Всего тайлов: {total_tiles}")
 
-    # Считаем сколько тайлов помещается на один лист
-    px_per_mm = cfg.sheet_export_dpi / 25.4
-    shuffled_tile_px = int(cfg.shuffled_tile_mm * px_per_mm)
-    gap_px = int(cfg.gap_mm * px_per_mm)
-    margin_px = int(cfg.margin_mm * px_per_mm)
-    sheet_w_px = int(cfg.sheet_w_mm * px_per_mm)
-    sheet_h_px = int(cfg.sheet_h_mm * px_per_mm)
-
-    tiles_per_row = (sheet_w_px - 2 * margin_px + gap_px) // (shuffled_tile_px + gap_px)
-    tiles_per_col = (sheet_h_px - 2 * margin_px + gap_px) // (shuffled_tile_px + gap_px)
-    tiles_per_sheet = tiles_per_row * tiles_per_col
-
-    print(f"📐 Лист вмещает {tiles_per_row} × {tiles_per_col} = {tiles_per_sheet} тайлов")
-
-    random.shuffle(tiles)
-    pages = []
-
-    # распределяем тайлы по страницам
-    total_pages = math.ceil(total_tiles / tiles_per_sheet)
-    for page_idx in tqdm(range(total_pages), desc="📄 Формирование страниц"):
-        start = page_idx * tiles_per_sheet
-        end = min(start + tiles_per_sheet, total_tiles)
-        page_tiles = tiles[start:end]
-        rot_angles = cfg.rotate_tiles
-        # Создаём пустые матрицы
-        matrix = []
-        rotation_matrix = []
-
-        for r in range(tiles_per_col):
-            row_coords = []
-            row_rotations = []
-            for c in range(tiles_per_row):
-                idx = r * tiles_per_row + c
-                if idx < len(page_tiles):
-                    (_, coord, _) = page_tiles[idx]
-                    row_coords.append(coord)
-
-                    # Генерация поворотов
-                    if cfg.rotate_tiles is None:
-                        angle = random.choice([90, 180, 270])
-                    elif isinstance(rot_angles, (list, tuple)) and all(isinstance(x, (int, float)) for x in rot_angles):
-                        angle = random.choice(rot_angles)
-                    else:
-                        angle = 0
-                    row_rotations.append(angle)
-                else:
-                    row_coords.append(None)
-                    row_rotations.append(0)
-
-            matrix.append(row_coords)
-            rotation_matrix.append(row_rotations)
-
-        pages.append({
-            "index": page_idx + 1,
-            "rotated": any(any(a != 0 for a in row) for row in rotation_matrix),
-            "matrix": matrix,
-            "rotation_matrix": rotation_matrix
-        })
+    plan = plan_sheets(cfg, total_tiles)
+    tiles_per_row, tiles_per_col = plan[0][1:] if plan else sheet_capacity(cfg)
+    if not cfg.sheet_formats:
+        print(f"📐 Лист вмещает {tiles_per_row} × {tiles_per_col} = {tiles_per_row * tiles_per_col} тайлов")
+
+    names = coord_names(cfg)
+    dealt = deal_tiles(cfg, tile_codes(cfg, [coord for _, coord, _ in tiles]),
+                       [tpr * tpc for _, tpr, tpc in plan])
+    pages = [generate_page(cfg, page_idx + 1, page_codes, names, tpr, tpc, sheet)
+             for page_idx, (page_codes, (sheet, tpr, tpc))
+             in enumerate(tqdm(list(zip(dealt, plan)), desc="📄 Формирование страниц"))]
 
     # финальная структура
     state = {
         "config_hash": cfg.compute_hash(),
         "seed": cfg.random_seed,
+        "rng": RNG_SCHEME,
         "tiles_per_row": tiles_per_row,
         "tiles_per_col": tiles_per_col,
         "pages": pages
     }
 
-    save_random_state(cfg, state)
+    if save:
+        save_random_state(cfg, state)
     return state
 
 
+def regenerate_page(cfg, state, page_index):
+    """
+    Пересчитывает одну страницу state с нуля — те же тайлы, порядок и
+    повороты, что дал бы generate_random_state, без генерации остальных.
+    """
+    if state.get("rng") != RNG_SCHEME:
+        raise ValueError("random_state создан старой схемой случайности — пересоздайте его (--reshuffle)")
+    page = state["pages"][page_index - 1]
+    coords = [coord for row in page["matrix"] for coord in row if coord]
+    return generate_page(cfg, page_index, tile_codes(cfg, coords), coord_names(cfg),
+                         len(page["matrix"][0]), len(page["matrix"]), page.get("sheet"))
+
+
 def save_random_state(cfg, state):
-    """Сохраняет random_state.json в проектной папке."""
-    with open(cfg.random_state_file, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=4, ensure_ascii=False)
-    print(f"💾 Сохранён random_state.json → {cfg.random_state_file}")
+    """Сохраняет random_state.bin в проектной папке (JSON — через state_file.export_json)."""
+    write_state(cfg.random_state_file, state, cfg.letters, cfg.cols)
+    print(f"💾 Сохранён random_state.bin → {cfg.random_state_file}")
 
 
 def load_random_state(cfg):
-    """Загружает random_state.json и проверяет его соответствие текущему конфигу."""
-    if not os.path.exists(cfg.random_state_file):
-        print("⚠️ random_state.json не найден — будет создан новый.")
+    """
+    Открывает random_state.bin и проверяет его соответствие текущему конфигу.
+    Страницы читаются лениво — по state["pages"][i] или state.pages_by_index(...).
+    Старый random_state.json читается целиком и переписывается в .bin.
+    """
+    legacy_json = os.path.splitext(cfg.random_state_file)[0] + ".json"
+    if os.path.exists(cfg.random_state_file):
+        state = read_state(cfg.random_state_file)
+    elif os.path.exists(legacy_json):
+        with open(legacy_json, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    else:
+        print("⚠️ random_state.bin не найден — будет создан новый.")
         return None
 
-    with open(cfg.random_state_file, "r", encoding="utf-8") as f:
-        state = json.load(f)
-
-    # проверка хэша
+    # проверка хэша раскладки: цвета, шрифты и вывод на random_state не влияют
     current_hash = cfg.compute_hash()
+    upgrade = not os.path.exists(cfg.random_state_file)
     if state.get("config_hash") != current_hash:
-        print("⚠️ Конфиг изменился, random_state.json устарел.")
-        return None
-
-    print(f"📖 Загружен random_state.json ({len(state['pages'])} страниц)")
+        if state.get("config_hash") != cfg.legacy_hash():
+            print("⚠️ Раскладка в конфиге изменилась, random_state устарел.")
+            return None
+        # записан со старым ключом (хэш всего config.json) — переводим на хэш раскладки
+        state = dict(state, config_hash=current_hash, pages=list(state["pages"]))
+        upgrade = True
+
+    if upgrade:
+        save_random_state(cfg, state)
+        state = read_state(cfg.random_state_file)
+
+    print(f"📖 Загружен random_state ({len(state['pages'])} страниц)")
     return state
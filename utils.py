@@ -1,4 +1,7 @@
-from PIL import ImageDraw
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
 
 def center_in_cell(draw, text, x0, y0, cell_w, cell_h, font):
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -7,10 +10,83 @@ def center_in_cell(draw, text, x0, y0, cell_w, cell_h, font):
     y = y0 + (cell_h - th) // 2 - bbox[1]
     return x, y
 
+
+# кэш масок обводки: (text, шрифт, ширина) → маски и смещение
+_outline_cache = {}
+
+
+def clear_outline_cache():
+    _outline_cache.clear()
+
+
+def _font_key(font):
+    path = getattr(font, "path", None)
+    if path is None:
+        return id(font)
+    return path, getattr(font, "size", None), getattr(font, "index", 0)
+
+
+def _dilate_disc(mask, r):
+    """
+    Морфологическое расширение маски "L" диском радиуса r: каждый пиксель —
+    максимум по кругу вокруг него. Диск — это строки dy с полушириной
+    isqrt(r² - dy²), поэтому сначала считаются горизонтальные максимумы
+    по отрезкам каждой полуширины (каждый — из предыдущего за два
+    np.maximum), а потом они сдвигаются по вертикали: ~4r проходов по
+    массиву вместо (2r+1)² сдвигов.
+    """
+    a = np.asarray(mask)
+    h = a.shape[0]
+    spans = [a]                      # spans[k] — максимум по [x-k, x+k]
+    for k in range(1, r + 1):
+        cur = spans[-1].copy()
+        np.maximum(cur[:, k:], a[:, :-k], out=cur[:, k:])
+        np.maximum(cur[:, :-k], a[:, k:], out=cur[:, :-k])
+        spans.append(cur)
+
+    out = np.zeros_like(a)
+    for dy in range(-r, r + 1):
+        src = spans[math.isqrt(r * r - dy * dy)]
+        if dy >= 0:
+            np.maximum(out[dy:], src[:h - dy], out=out[dy:])
+        else:
+            np.maximum(out[:dy], src[-dy:], out=out[:dy])
+    return Image.fromarray(out)
+
+
+def _outline_masks(text, font, outline_width):
+    """
+    Растеризует подпись один раз в маску "L" и расширяет её диском радиуса
+    outline_width (_dilate_disc) — то же, что многократное рисование текста
+    цветом обводки со сдвигами, но за один проход.
+    """
+    key = (text, _font_key(font), outline_width)
+    cached = _outline_cache.get(key)
+    if cached is not None:
+        return cached
+
+    r = int(outline_width)
+    bbox = font.getbbox(text)
+    ox = r + max(0, -bbox[0])
+    oy = r + max(0, -bbox[1])
+    size = (ox + bbox[2] + r + 1, oy + bbox[3] + r + 1)
+
+    text_mask = Image.new("L", size, 0)
+    ImageDraw.Draw(text_mask).text((ox, oy), text, font=font, fill=255)
+    # маска лежит не ближе r к краю, так что расширение в неё помещается
+    outline_mask = _dilate_disc(text_mask, r) if r > 0 else text_mask
+
+    cached = _outline_cache[key] = (text_mask, outline_mask, ox, oy)
+    return cached
+
+
 def draw_text_with_outline(draw, pos, text, font, fill, outline_fill, outline_width):
-    x, y = pos
-    for dx in range(-outline_width, outline_width + 1):
-        for dy in range(-outline_width, outline_width + 1):
-            if dx*dx + dy*dy <= outline_width*outline_width:
-                draw.text((x + dx, y + dy), text, font=font, fill=outline_fill)
-    draw.text((x, y), text, font=font, fill=fill)
+    """
+    Текст с обводкой шириной outline_width. Позиция округляется до целого
+    пикселя (половина — вверх), чтобы маски подписи не зависели от дробной
+    части и переиспользовались.
+    """
+    x, y = math.floor(pos[0] + 0.5), math.floor(pos[1] + 0.5)
+    text_mask, outline_mask, ox, oy = _outline_masks(text, font, outline_width)
+    draw.bitmap((x - ox, y - oy), outline_mask, fill=outline_fill)
+    draw.bitmap((x - ox, y - oy), text_mask, fill=fill)
@@ -1,26 +1,111 @@
 import os
-from PIL import Image
+import numpy as np
 from tqdm import tqdm
 
+from io_helpers import atomic_output
+from render_cache import source_key
 
-def detect_white_tiles(img, cfg, threshold=250):
+
+# статистики, нужные каждому способу white_stat
+WHITE_STATS = {
+    "min": ("min",),
+    "percentile": ("percentile",),
+    "mean_std": ("mean", "std"),
+}
+TILE_STATS = ("min", "mean", "std", "percentile")
+
+
+def stats_for(cfg):
+    """Какие статистики нужны для cfg.white_stat."""
+    if cfg.white_stat not in WHITE_STATS:
+        raise ValueError(f"white_stat: неизвестная статистика {cfg.white_stat!r}, "
+                         f"допустимы: {', '.join(WHITE_STATS)}")
+    return WHITE_STATS[cfg.white_stat]
+
+
+def compute_tile_stats(img, cfg, percentile=None, stats=TILE_STATS):
     """
-    Анализирует изображение и возвращает список координат тайлов,
-    которые считаются «белыми» (равномерно светлыми).
+    Считает яркостную статистику всех тайлов сразу.
+    Изображение читается полосами по строке тайлов; каждая полоса один раз
+    переводится в "L" и свёртывается в (tile, cols, tile), после чего
+    статистики по всем тайлам строки — одна редукция NumPy.
+    stats — какие из «min», «mean», «std», «percentile» считать (по
+    умолчанию все, как нужно GUI). Возвращает {имя: массив (rows, cols)}.
     """
-    print("🔍 Поиск белых тайлов...")
     tile_size = img.width // cfg.cols
-    whites = []
+    percentile = cfg.white_percentile if percentile is None else percentile
+    reducers = {
+        "min": lambda lum: lum.min(axis=(0, 2)),
+        "mean": lambda lum: lum.mean(axis=(0, 2)),
+        "std": lambda lum: lum.std(axis=(0, 2)),
+        "percentile": lambda lum: np.percentile(lum, percentile, axis=(0, 2)),
+    }
+    result = {name: np.zeros((cfg.rows, cfg.cols), dtype=np.float32) for name in stats}
 
     for row in tqdm(range(cfg.rows), desc="Проверка строк"):
-        for col in range(cfg.cols):
-            box = (col * tile_size, row * tile_size,
-                   (col + 1) * tile_size, (row + 1) * tile_size)
-            tile = img.crop(box)
-            min_val, max_val = tile.convert("L").getextrema()
-            if min_val >= threshold:
-                coord = f"{cfg.letters[row]}{col+1}"
-                whites.append(coord)
+        band = img.crop((0, row * tile_size, cfg.cols * tile_size, (row + 1) * tile_size))
+        lum = np.asarray(band.convert("L")).reshape(tile_size, cfg.cols, tile_size)
+        for name in stats:
+            result[name][row] = reducers[name](lum)
+
+    return result
+
+
+def cached_tile_stats(img, cfg):
+    """
+    compute_tile_stats с кэшем в out/<project>/.cache/tile_stats_<ключ>.npz.
+    Ключ — путь, размер и mtime исходника, геометрия сетки и white_percentile,
+    так что повторное открытие проекта не перечитывает изображение.
+    """
+    key = source_key(img, f"{cfg.cols}x{cfg.rows}", cfg.white_percentile)
+    path = os.path.join(cfg.project_dir, ".cache", f"tile_stats_{key}.npz")
+
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    stats = compute_tile_stats(img, cfg)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_output(path) as tmp, open(tmp, "wb") as f:
+        np.savez(f, **stats)
+    return stats
+
+
+def white_score(stats, cfg):
+    """
+    «Белизна» тайлов (rows, cols) в шкале white_threshold: тайл белый, если
+    оценка не ниже порога. Для mean_std тайлы с разбросом больше
+    white_std_max получают -inf и не проходят ни при каком пороге.
+    """
+    stats_for(cfg)
+    if cfg.white_stat == "percentile":
+        return stats["percentile"]
+    if cfg.white_stat == "mean_std":
+        return np.where(stats["std"] <= cfg.white_std_max, stats["mean"], -np.inf)
+    return stats["min"]
+
+
+def white_mask(stats, cfg, threshold=None):
+    """
+    Булева маска (rows, cols) «белых» тайлов по выбранной статистике cfg.white_stat:
+      min        — самый тёмный пиксель не темнее порога (строго, как раньше);
+      percentile — white_percentile% самых тёмных пикселей не темнее порога
+                   (терпит пыль и отдельные точки);
+      mean_std   — средняя яркость не ниже порога и разброс не больше
+                   white_std_max (терпит фактуру бумаги).
+    """
+    threshold = cfg.white_threshold if threshold is None else threshold
+    return white_score(stats, cfg) >= threshold
+
+
+def detect_white_tiles(img, cfg, threshold=None):
+    """
+    Анализирует изображение и возвращает список координат тайлов,
+    которые считаются «белыми» (равномерно светлыми).
+    """
+    print(f"🔍 Поиск белых тайлов (статистика: {cfg.white_stat})...")
+    # только то, что нужно выбранной статистике: для min — без std и percentile
+    mask = white_mask(compute_tile_stats(img, cfg, stats=stats_for(cfg)), cfg, threshold)
+    whites = [f"{cfg.letters[row]}{col+1}" for row, col in zip(*np.nonzero(mask))]
 
     print(f"📄 Найдено белых тайлов: {len(whites)}")
     return whites
@@ -1,9 +1,12 @@
 import os
+import threading
 import tkinter as tk
+import numpy as np
 from PIL import Image, ImageTk, Image
 from config import Config
-from image_loader import load_image
-from white_tiles import load_white_tiles, save_white_tiles
+from image_loader import LazyImage, load_image
+from pyramid import ImagePyramid
+from white_tiles import load_white_tiles, save_white_tiles, cached_tile_stats, white_score, white_mask
 import warnings
 import argparse
 
@@ -32,8 +35,14 @@ if not os.path.exists(cfg.input_file):
 img, tile_size, px_per_mm, dpi = load_image(cfg.input_file, cfg.cols, cfg.rows)
 
 # === Загружаем/создаём список белых ===
+had_whites_file = os.path.exists(cfg.white_tiles_file)
 excluded = set(load_white_tiles(cfg))
 print(f"📖 Загружены исключения: {len(excluded)} шт.")
+initial_threshold = cfg.white_threshold
+
+# === Пирамида для отображения ===
+pyramid = ImagePyramid(img, os.path.join(cfg.project_dir, ".cache", "pyramid"))
+img_w, img_h = tile_size * cfg.cols, tile_size * cfg.rows
 
 # === GUI ===
 root = tk.Tk()
@@ -43,66 +52,201 @@ root.geometry("1000x900")
 canvas = tk.Canvas(root, bg="white")
 canvas.pack(fill=tk.BOTH, expand=True)
 
-scale = 1.0
+# вид: экранных пикселей на пиксель исходника и левый верхний угол экрана в пикселях исходника
+view = {"scale": 1.0, "x": 0.0, "y": 0.0, "fit": True}
 tk_img = None
+redraw_job = None
 letters = list("АБВГДЕЖИКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ")
 
+# элементы холста создаются один раз и дальше только двигаются
+image_item = canvas.create_image(0, 0, anchor="nw")
+row_lines = [canvas.create_line(0, 0, 0, 0, fill="black", width=1) for _ in range(cfg.rows + 1)]
+col_lines = [canvas.create_line(0, 0, 0, 0, fill="black", width=1) for _ in range(cfg.cols + 1)]
+rects = {}      # метка → прямоугольник выделения
+overrides = {}  # ручные клики поверх подсказки по порогу: метка → выделена ли
+stats_box = {"stats": None, "error": None}   # заполняет фоновый поток
+shade_img = None                            # (rows, cols) RGBA-подсветка по «белизне»
+for label in excluded:
+    if label and label[0] in letters:
+        rects[label] = canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2, tags=label)
+
+
 # === Вспомогательные ===
+def to_screen(x, y):
+    return (x - view["x"]) * view["scale"], (y - view["y"]) * view["scale"]
+
 def coord_to_label(x, y):
-    row = int(y // (tile_size * scale))
-    col = int(x // (tile_size * scale))
+    row = int((view["y"] + y / view["scale"]) // tile_size)
+    col = int((view["x"] + x / view["scale"]) // tile_size)
     if 0 <= row < cfg.rows and 0 <= col < cfg.cols:
         return f"{letters[row]}{col + 1}"
     return None
 
+def cell_box(label):
+    row = letters.index(label[0])
+    col = int(label[1:]) - 1
+    x1, y1 = to_screen(col * tile_size, row * tile_size)
+    x2, y2 = to_screen((col + 1) * tile_size, (row + 1) * tile_size)
+    return x1 + 1, y1 + 1, x2 - 1, y2 - 1
+
+def fit_view():
+    w, h = canvas.winfo_width(), canvas.winfo_height()
+    view.update(scale=min(w / img_w, h / img_h), x=0.0, y=0.0, fit=True)
+
+def place_items():
+    """Переставляет сетку и выделения под текущий вид (без пересоздания)."""
+    left, top = to_screen(0, 0)
+    right, bottom = to_screen(img_w, img_h)
+    for r, line in enumerate(row_lines):
+        y = to_screen(0, r * tile_size)[1]
+        canvas.coords(line, left, y, right, y)
+    for c, line in enumerate(col_lines):
+        x = to_screen(c * tile_size, 0)[0]
+        canvas.coords(line, x, top, x, bottom)
+    for label, rect in rects.items():
+        canvas.coords(rect, *cell_box(label))
+
+def redraw_image():
+    """Перерисовывает только видимую часть изображения с подходящего уровня пирамиды."""
+    global tk_img
+    w, h = canvas.winfo_width(), canvas.winfo_height()
+    s = view["scale"]
+    x0, y0 = max(0.0, view["x"]), max(0.0, view["y"])
+    x1, y1 = min(img_w, view["x"] + w / s), min(img_h, view["y"] + h / s)
+    out_w, out_h = int((x1 - x0) * s), int((y1 - y0) * s)
+    if out_w < 1 or out_h < 1:
+        canvas.itemconfigure(image_item, state="hidden")
+        return
+    frame = pyramid.view((x0, y0, x1, y1), (out_w, out_h))
+    if shade_img is not None and shade_var.get():
+        overlay = shade_img.resize((out_w, out_h), Image.NEAREST,
+                                   box=(x0 / tile_size, y0 / tile_size, x1 / tile_size, y1 / tile_size))
+        frame = Image.alpha_composite(frame.convert("RGBA"), overlay)
+    tk_img = ImageTk.PhotoImage(frame)
+    canvas.coords(image_item, *to_screen(x0, y0))
+    canvas.itemconfigure(image_item, image=tk_img, state="normal")
+    canvas.tag_lower(image_item)
+
 def redraw():
-    global tk_img, scale
-    w = canvas.winfo_width()
-    h = canvas.winfo_height()
-    scale_x = w / (tile_size * cfg.cols)
-    scale_y = h / (tile_size * cfg.rows)
-    scale = min(scale_x, scale_y)
-
-    disp_w = int(tile_size * cfg.cols * scale)
-    disp_h = int(tile_size * cfg.rows * scale)
-    disp_img = img.resize((disp_w, disp_h), Image.NEAREST)
-    tk_img = ImageTk.PhotoImage(disp_img)
-
-    canvas.delete("all")
-    canvas.create_image(0, 0, anchor="nw", image=tk_img)
-
-    # сетка
-    for r in range(cfg.rows + 1):
-        y = r * tile_size * scale
-        canvas.create_line(0, y, tile_size * cfg.cols * scale, y, fill="black", width=1)
-    for c in range(cfg.cols + 1):
-        x = c * tile_size * scale
-        canvas.create_line(x, 0, x, tile_size * cfg.rows * scale, fill="black", width=1)
-
-    # выделенные
-    for label in excluded:
-        if not label or label[0] not in letters:
-            continue
-        row = letters.index(label[0])
-        col = int(label[1:]) - 1
-        x1 = col * tile_size * scale
-        y1 = row * tile_size * scale
-        x2 = x1 + tile_size * scale
-        y2 = y1 + tile_size * scale
-        canvas.create_rectangle(x1+1, y1+1, x2-1, y2-1, outline="red", width=2, tags=label)
+    global redraw_job
+    redraw_job = None
+    if view["fit"]:
+        fit_view()
+    place_items()
+    redraw_image()
+
+def schedule_redraw(delay=30):
+    """Склеивает серии событий (ресайз окна, прокрутка колеса) в одну перерисовку."""
+    global redraw_job
+    if redraw_job is not None:
+        root.after_cancel(redraw_job)
+    redraw_job = root.after(delay, redraw)
+
+def set_selected(label, selected):
+    """Добавляет или убирает один прямоугольник — остальные элементы не трогаются."""
+    if selected and label not in excluded:
+        excluded.add(label)
+        rects[label] = canvas.create_rectangle(*cell_box(label), outline="red", width=2, tags=label)
+    elif not selected and label in excluded:
+        excluded.remove(label)
+        if label in rects:
+            canvas.delete(rects.pop(label))
 
 def on_click(event):
     label = coord_to_label(event.x, event.y)
-    if not label:
+    if label:
+        overrides[label] = label not in excluded
+        set_selected(label, overrides[label])
+        update_status()
+
+# === Подсказка по статистике ===
+def compute_stats():
+    """Фоновый поток: своя копия LazyImage, чтобы не делить кэш полос с отрисовкой."""
+    try:
+        stats_box["stats"] = cached_tile_stats(LazyImage(img.path, img.size), cfg)
+    except Exception as e:
+        stats_box["error"] = e
+
+def make_shade(stats):
+    """Подсветка тайлов: чем белее тайл, тем зеленее, тёмные — красноватые."""
+    score = np.nan_to_num(white_score(stats, cfg), neginf=0.0)
+    heat = np.clip(score / 255.0, 0.0, 1.0)
+    shade = np.zeros((cfg.rows, cfg.cols, 4), dtype=np.uint8)
+    shade[..., 0] = (255 * (1 - heat)).astype(np.uint8)
+    shade[..., 1] = (255 * heat).astype(np.uint8)
+    shade[..., 3] = 70
+    return Image.fromarray(shade, "RGBA")
+
+def apply_threshold():
+    """Выделение = тайлы выше порога с учётом ручных кликов; меняются только отличия."""
+    stats = stats_box["stats"]
+    if stats is None:
         return
-    if label in excluded:
-        excluded.remove(label)
-    else:
-        excluded.add(label)
-    redraw()
+    mask = white_mask(stats, cfg)
+    target = {f"{letters[r]}{c + 1}" for r, c in zip(*np.nonzero(mask))}
+    target |= {label for label, on in overrides.items() if on}
+    target -= {label for label, on in overrides.items() if not on}
+    for label in target ^ excluded:
+        if label and label[0] in letters:
+            set_selected(label, label in target)
+    update_status()
+
+def on_threshold(value):
+    cfg.white_threshold = int(float(value))
+    apply_threshold()
+
+def poll_stats():
+    global shade_img
+    if stats_box["error"] is not None:
+        status_var.set(f"❌ Статистика не посчитана: {stats_box['error']}")
+        return
+    if stats_box["stats"] is None:
+        root.after(200, poll_stats)
+        return
+    shade_img = make_shade(stats_box["stats"])
+    threshold_scale.configure(state="normal")
+    if not had_whites_file:
+        # списка ещё нет — сразу предлагаем белые по порогу из конфига
+        apply_threshold()
+    update_status()
+    schedule_redraw(0)
+
+def update_status():
+    ready = "статистика готова" if stats_box["stats"] is not None else "⏳ считаю статистику тайлов…"
+    status_var.set(f"Выделено: {len(excluded)} · {ready}")
+
+def on_wheel(event):
+    """Масштаб колесом вокруг курсора."""
+    up = event.num == 4 or getattr(event, "delta", 0) > 0
+    fit_scale = min(canvas.winfo_width() / img_w, canvas.winfo_height() / img_h)
+    new_scale = min(max(view["scale"] * (1.25 if up else 0.8), fit_scale), 4.0)
+    sx = view["x"] + event.x / view["scale"]
+    sy = view["y"] + event.y / view["scale"]
+    view.update(scale=new_scale, x=sx - event.x / new_scale, y=sy - event.y / new_scale,
+                fit=new_scale == fit_scale)
+    place_items()
+    schedule_redraw()
+
+def on_pan_start(event):
+    view["drag"] = (event.x, event.y)
+
+def on_pan(event):
+    """Перетаскивание правой/средней кнопкой: элементы сдвигаются сразу, картинка — после."""
+    px, py = view["drag"]
+    dx, dy = event.x - px, event.y - py
+    view["drag"] = (event.x, event.y)
+    view.update(x=view["x"] - dx / view["scale"], y=view["y"] - dy / view["scale"], fit=False)
+    canvas.move("all", dx, dy)
+    schedule_redraw()
+
+def reset_view(event=None):
+    view["fit"] = True
+    schedule_redraw(0)
 
 def save_and_exit():
     save_white_tiles(cfg, sorted(excluded))
+    if cfg.white_threshold != initial_threshold:
+        cfg.save()
     whites_path = os.path.join(cfg.project_dir, "white_tiles.txt")
     print(f"💾 Сохранено {len(excluded)} исключений в {os.path.basename(whites_path)}")
     root.destroy()
@@ -110,10 +254,32 @@ def save_and_exit():
 
 # === Привязки ===
 canvas.bind("<Button-1>", on_click)
-canvas.bind("<Configure>", lambda e: redraw())
+canvas.bind("<Configure>", lambda e: schedule_redraw())
+canvas.bind("<MouseWheel>", on_wheel)
+canvas.bind("<Button-4>", on_wheel)
+canvas.bind("<Button-5>", on_wheel)
+for button in (2, 3):
+    canvas.bind(f"<ButtonPress-{button}>", on_pan_start)
+    canvas.bind(f"<B{button}-Motion>", on_pan)
+root.bind("<Home>", reset_view)
 
-btn = tk.Button(root, text="💾 Сохранить и выйти", command=save_and_exit)
-btn.pack(pady=5)
+panel = tk.Frame(root)
+panel.pack(fill=tk.X, pady=5)
+threshold_scale = tk.Scale(panel, from_=0, to=255, orient=tk.HORIZONTAL, length=300,
+                           label=f"Порог белого ({cfg.white_stat})", command=on_threshold)
+threshold_scale.set(cfg.white_threshold)
+threshold_scale.configure(state="disabled")
+threshold_scale.pack(side=tk.LEFT, padx=5)
+shade_var = tk.BooleanVar(value=True)
+tk.Checkbutton(panel, text="Подсветка", variable=shade_var,
+               command=lambda: schedule_redraw(0)).pack(side=tk.LEFT, padx=5)
+status_var = tk.StringVar()
+tk.Label(panel, textvariable=status_var).pack(side=tk.LEFT, padx=5)
+btn = tk.Button(panel, text="💾 Сохранить и выйти", command=save_and_exit)
+btn.pack(side=tk.RIGHT, padx=5)
 
+update_status()
+threading.Thread(target=compute_stats, daemon=True).start()
 root.after(100, redraw)
+root.after(200, poll_stats)
 root.mainloop()
@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import stage
+from io_helpers import atomic_output
+
+OUTPUT_EXTENSIONS = {"png": ".png", "tiff": ".tif", "jpeg": ".jpg"}
+OUTPUT_FORMAT_ALIASES = {"jpg": "jpeg", "tif": "tiff"}
+# сжатия TIFF, которые TiffStripWriter пишет по strip'ам: им не нужны теги
+# кроме Compression (у jpeg, например, ещё JPEGTables — такой TIFF не читается)
+STREAM_TIFF_COMPRESSIONS = (None, "raw", "tiff_lzw", "tiff_deflate", "tiff_adobe_deflate", "packbits")
+
+
+def output_format(cfg):
+    """Имя формата вывода из cfg.output_format (jpg и tif — синонимы jpeg и tiff)."""
+    name = str(cfg.output_format).lower()
+    name = OUTPUT_FORMAT_ALIASES.get(name, name)
+    if name not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"output_format: неизвестный формат {cfg.output_format!r}, "
+                         f"допустимы: {', '.join(OUTPUT_EXTENSIONS)}")
+    return name
+
+
+def output_extension(cfg):
+    """Расширение файлов листов для cfg.output_format."""
+    return OUTPUT_EXTENSIONS[output_format(cfg)]
+
+
+def _mode_for(cfg, kind):
+    # shuffled_rot кодируется так же, как shuffled
+    base_kind = "shuffled" if kind == "shuffled_rot" else kind
+    return cfg.output_modes.get(base_kind, "auto")
+
+
+def prepare_for_save(img, cfg, kind):
+    """
+    Приводит холст к режиму, заданному в cfg.output_modes для вида листа:
+      auto — RGB, если альфа везде 255 (а она почти всегда такая), иначе RGBA;
+      RGB / RGBA / L — как есть;
+      P    — палитра на 256 цветов (для answers-листов);
+      1    — чёрно-белый.
+    JPEG не умеет альфу и палитру, поэтому для него всегда RGB или L.
+    """
+    mode = _mode_for(cfg, kind)
+    if mode == "auto":
+        opaque = "A" not in img.mode or img.getchannel("A").getextrema() == (255, 255)
+        mode = "RGB" if opaque else "RGBA"
+
+    if output_format(cfg) == "jpeg" and mode not in ("RGB", "L"):
+        mode = "L" if mode == "1" else "RGB"
+
+    if mode == img.mode:
+        return img
+    if mode == "P":
+        return img.convert("RGB").quantize(256)
+    return img.convert(mode)
+
+
+def stream_mode(cfg, kind, src_mode):
+    """
+    Режим потоковой записи полосами (stream_writer) или None, если формат,
+    сжатие или режим так не пишутся (JPEG, TIFF с jpeg-сжатием, палитра,
+    1-бит — только целым холстом).
+    auto решается заранее по режиму исходных тайлов: полосы по отдельности
+    не должны выбрать разные режимы.
+    """
+    fmt = output_format(cfg)
+    if fmt not in ("png", "tiff"):
+        return None
+    if fmt == "tiff" and cfg.tiff_compression not in STREAM_TIFF_COMPRESSIONS:
+        return None
+    mode = _mode_for(cfg, kind)
+    if mode == "auto":
+        mode = "RGBA" if "A" in src_mode else "RGB"
+    return mode if mode in ("L", "RGB", "RGBA") else None
+
+
+def save_options(cfg, dpi):
+    """Параметры кодировщика Pillow для cfg.output_format."""
+    opts = {"dpi": (dpi, dpi)}
+    fmt = output_format(cfg)
+    if fmt == "tiff":
+        if cfg.tiff_compression:
+            opts["compression"] = cfg.tiff_compression
+    elif fmt == "jpeg":
+        opts["quality"] = cfg.jpeg_quality
+    else:
+        opts["compress_level"] = cfg.png_compress_level
+    return opts
+
+
+def save_image(img, out_path, cfg, kind, dpi):
+    """Кодирует и сохраняет лист с настройками вывода из конфига."""
+    fmt = output_format(cfg).upper()
+    with stage("save", kind=kind, file=os.path.basename(out_path)) as rec:
+        # через временный файл: оборванная запись не оставит битый лист
+        with atomic_output(out_path) as tmp:
+            prepare_for_save(img, cfg, kind).save(tmp, format=fmt, **save_options(cfg, dpi))
+        rec["bytes"] = os.path.getsize(out_path)
+    return out_path
+
+
+# ──────────────────────────────
+# ✍️ Пул записи
+# ──────────────────────────────
+class ImageWriter:
+    """
+    Пул потоков, в котором кодируются листы. Pillow отпускает GIL на время
+    сжатия, поэтому кодирование идёт параллельно с рендером следующих листов.
+    """
+
+    def __init__(self, threads):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="writer")
+
+    def submit(self, img, out_path, cfg, kind, dpi):
+        return self._pool.submit(save_image, img, out_path, cfg, kind, dpi)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+_writer = None
+
+
+def get_writer(cfg):
+    """Пул записи текущего процесса (создаётся при первом обращении)."""
+    global _writer
+    if _writer is None:
+        _writer = ImageWriter(cfg.writer_threads)
+    return _writer